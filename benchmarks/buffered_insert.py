@@ -0,0 +1,41 @@
+# Run from the repository root: python -m benchmarks.buffered_insert
+import os
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+ROWS = 10000
+WORKERS = 16
+LATENCY = 0.005
+
+
+def run(name, db, insert):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as workers:
+        list(workers.map(insert, range(ROWS)))
+    db.flush()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<12} {ROWS} single-row inserts from {WORKERS} threads: {ROWS / elapsed:>8.0f} rows/s")
+
+def main():
+    os.chdir(tempfile.mkdtemp())
+    with StubServer(["bench"], latency=LATENCY) as server:
+        handler = zohodb.ZohoAuthHandler("buffer", "buffer")
+        prime_token(handler)
+        with zohodb.ZohoDB(handler, ["bench"], max_threads=WORKERS) as db:
+            db.capacity.max_rows = 10 ** 6
+            db.capacity.max_cells = 10 ** 7
+            requests = server.state.requests
+            run("unbuffered", db, lambda i: db.insert(table="unbuffered", data=[{"n": i}]))
+            print(f"{'':<12} {server.state.requests - requests} requests")
+            requests = server.state.requests
+            futures = []
+            run("buffered", db, lambda i: futures.append(db.buffered_insert("buffered", {"n": i})))
+            assert all(future.result()['workbook_id'] for future in futures)
+            print(f"{'':<12} {server.state.requests - requests} requests")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Run from the repository root: python -m benchmarks.cache
+import os
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+from zohodb import zohodb
+from zohodb.zohodb import MissingData, InvalidCacheTable, CorruptedCacheTable
+
+OPS = 2000
+THREADS = 4
+
+
+# The sleep-polling lock file implementation ZohoDBCache used before the pluggable backends
+class LegacyZohoDBCache:
+    def __init__(self, hash):
+        if not hash:
+            raise MissingData("The cache hash is required")
+        self.hash = hash
+        self.cache_path = f"./.zohodb/db_cache/{self.hash}"
+        Path(f"{self.cache_path}").mkdir(parents=True, exist_ok=True)
+        
+    def __wait_till_released(self, table):
+        while True:
+            if Path(f"{self.cache_path}/{table}.lock").exists():
+                time.sleep(1)
+                continue
+            else:
+                break
+        return True
+        
+    def __lock(self, table):
+        open(f"{self.cache_path}/{table}.lock", 'a').close()
+        return True
+        
+    def __release(self, table):
+        if Path(f"{self.cache_path}/{table}.lock").exists():
+            os.remove(f"{self.cache_path}/{table}.lock")
+        return True
+            
+    def __release_and_return(self, return_value, table):
+        self.__release(table)
+        return return_value
+
+    def set(self, table, key, value):
+        self.__wait_till_released(table)
+        self.__lock(table)
+        if not Path(f"{self.cache_path}/{table}.json").exists():
+            with open(f"{self.cache_path}/{table}.json", "w") as f:
+                data = {}
+                data[key] = value
+                f.write(json.dumps(data))
+                return self.__release_and_return(True, table)
+        with open(f"{self.cache_path}/{table}.json", "r") as f:
+            try:
+                data = json.loads(f.read())
+            except json.decoder.JSONDecodeError:
+                self.__release(table)
+                raise CorruptedCacheTable
+            data[key] = value
+            with open(f"{self.cache_path}/{table}.json", "w") as fw:
+                fw.write(json.dumps(data))
+                return self.__release_and_return(True, table)
+        return self.__release_and_return(False, table)
+                
+    def get(self, table, key):
+        if not Path(f"{self.cache_path}/{table}.json").exists():
+            raise InvalidCacheTable
+        with open(f"{self.cache_path}/{table}.json", "r") as f:
+            try:
+                data = json.loads(f.read())
+            except json.decoder.JSONDecodeError:
+                raise CorruptedCacheTable
+            if key in data:
+                return data[key]
+            else:
+                return None
+                
+    def delete(self, table, key):
+        if not Path(f"{self.cache_path}/{table}.json").exists():
+            raise InvalidCacheTable
+        self.__wait_till_released(table)
+        self.__lock(table)
+        with open(f"{self.cache_path}/{table}.json", "r") as f:
+            try:
+                data = json.loads(f.read())
+            except json.decoder.JSONDecodeError:
+                self.__release(table)
+                raise CorruptedCacheTable
+            if key in data:
+                del data[key]
+            else:
+                return self.__release_and_return(False, table)
+            with open(f"{self.cache_path}/{table}.json", "w") as fw:
+                fw.write(json.dumps(data))
+                return self.__release_and_return(True, table)
+        return self.__release_and_return(False, table)
+
+def run(name, cache, threads):
+    cache.set("bench", "seed", 0)
+    def worker(offset):
+        for i in range(OPS // threads):
+            key = f"k{(offset + i) % 64}"
+            cache.set("bench", key, i)
+            cache.get("bench", key)
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(n * 1000,)) for n in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<28} {threads} thread(s): {2 * OPS / elapsed:>10.0f} ops/s")
+
+def main():
+    os.chdir(tempfile.mkdtemp())
+    for threads in (1, THREADS):
+        run("legacy lock files", LegacyZohoDBCache(f"legacy{threads}"), threads)
+        run("json + flock", zohodb.ZohoDBCache(f"json{threads}", zohodb.JsonFileCacheBackend(f"./json{threads}"), memory_ttl=0), threads)
+        run("sqlite (WAL)", zohodb.ZohoDBCache(f"sqlite{threads}", memory_ttl=0), threads)
+        run("sqlite (WAL) + memory", zohodb.ZohoDBCache(f"memory{threads}"), threads)
+
+if __name__ == "__main__":
+    main()
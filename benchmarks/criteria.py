@@ -0,0 +1,29 @@
+import time
+import random
+
+from zohodb.criteria import compile_criteria
+
+RECORDS = 1000000
+
+random.seed(1)
+countries = ["US", "AU", "N/A", "DE", "EG"]
+records = [{
+    "name": f"user{i}",
+    "country": random.choice(countries),
+    "email": f"user{i}@example.com",
+    "age": random.randint(10, 80)
+} for i in range(RECORDS)]
+
+criteria = '("country" = "us" or "email" contains "7@") and "age" > 30 and "age" < 60'
+
+start = time.perf_counter()
+compiled = compile_criteria(criteria)
+compile_time = time.perf_counter() - start
+
+start = time.perf_counter()
+matched = compiled.filter(records)
+elapsed = time.perf_counter() - start
+
+print(f"criteria: {compiled.normalized()}")
+print(f"compiled in {compile_time * 1000:.3f} ms")
+print(f"filtered {RECORDS} records in {elapsed:.3f} s ({RECORDS / elapsed:.0f} records/s), {len(matched)} matched")
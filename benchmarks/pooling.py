@@ -0,0 +1,37 @@
+# Run from the repository root: python -m benchmarks.pooling
+import os
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+REQUESTS = 2000
+THREADS = 8
+
+
+def run(client):
+    def one(_):
+        return zohodb.ZohoWorkbookRequest("wb0", {
+            "access_token": "stub-token-0",
+            "method": "worksheet.records.fetch",
+            "worksheet_name": "users",
+            "criteria": ""
+        }, client)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(one, range(REQUESTS)))
+    return REQUESTS / (time.perf_counter() - start)
+
+def main():
+    os.chdir(tempfile.mkdtemp())
+    with StubServer() as server:
+        handler = zohodb.ZohoAuthHandler("bench", "bench")
+        prime_token(handler)
+        print(f"without pooling: {run(None):.0f} req/s")
+        with zohodb.ZohoDB(handler, ["stubdb"], max_threads=THREADS) as db:
+            print(f"with pooling:    {run(db.client):.0f} req/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import gc
+import json
+import time
+import random
+import tracemalloc
+
+from zohodb import zohodb
+
+ROWS = 50000
+WORKBOOKS = 4
+
+# A Zoho fetch response per workbook, like the ones select() parses
+random.seed(1)
+responses = []
+for workbook in range(WORKBOOKS):
+    records = [{
+        "id": n,
+        "email": f"user{n}@example.com",
+        "country": random.choice(["US", "EG", "DE", "IN"]),
+        "age": random.randint(18, 80),
+        "score": round(random.random() * 100, 2),
+        "row_index": n // WORKBOOKS + 2
+    } for n in range(workbook, ROWS, WORKBOOKS)]
+    responses.append((f"wb{workbook}", json.dumps({"status": "success", "records": records})))
+
+def parsed():
+    return [(workbook, json.loads(body)) for workbook, body in responses]
+
+def build_records(succeeded):
+    return zohodb._select_result(succeeded, "records")
+
+def build_columns(succeeded):
+    return zohodb._select_result(succeeded, "columns")
+
+def measure(build):
+    best = None
+    for _ in range(5):
+        succeeded = parsed()
+        start = time.perf_counter()
+        build(succeeded)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # Memory still held by the result once the parsed responses are gone
+    gc.collect()
+    tracemalloc.start()
+    succeeded = parsed()
+    result = build(succeeded)
+    del succeeded
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, best, retained
+
+records, records_time, records_memory = measure(build_records)
+columns, columns_time, columns_memory = measure(build_columns)
+assert columns.to_dicts() == records
+
+print(f"{ROWS} rows from {WORKBOOKS} workbooks")
+print(f"list of dicts: built in {records_time * 1000:>7.1f}ms, retains {records_memory / 2 ** 20:>6.1f} MiB")
+print(f"ResultSet:     built in {columns_time * 1000:>7.1f}ms, retains {columns_memory / 2 ** 20:>6.1f} MiB")
+
+start = time.perf_counter()
+total = sum(columns.column("age"))
+print(f"summing a column: {(time.perf_counter() - start) * 1000:.2f}ms (ResultSet) vs ", end="")
+start = time.perf_counter()
+assert sum(record['age'] for record in records) == total
+print(f"{(time.perf_counter() - start) * 1000:.2f}ms (list of dicts)")
@@ -0,0 +1,384 @@
+#
+# ZohoDB.py
+#
+# @oddmario
+# Mario
+# mariolatif741@yandex.com
+#
+# License: GNU GPLv3
+
+# A tiny local stand-in for the Zoho Sheets & OAuth APIs, used by the offline benchmarks
+#
+# It serves `workbook.list`, `worksheet.records.fetch/add/update/delete`, `worksheet.usedarea`
+# and the OAuth auth/token endpoints, evaluates criteria the way Zoho does (with its own small matcher,
+# so the library's criteria code isn't checked against itself) and enforces the row/cell limits
+# (answering with the 2870/2872 "full" errors).
+# Latency and throttling can be injected through `StubState`.
+#
+# Run it standalone from the repository root with `python -m benchmarks.stub_server --port 8000 --workbooks db1,db2`
+
+import re
+import sys
+import json
+import random
+import argparse
+import time
+import threading
+import calendar
+import urllib.parse
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from zohodb import zohodb
+
+class StubState:
+    def __init__(self, workbooks, latency = 0, max_rows = 65536, max_cells = 2000000, jitter = 0, rate_limit = None):
+        self.latency = latency
+        # Each request sleeps for `latency` plus a uniform random [0, jitter) seconds
+        self.jitter = jitter
+        self.max_rows = max_rows
+        self.max_cells = max_cells
+        self.lock = threading.Lock()
+        self.workbooks = {}
+        for index, name in enumerate(workbooks):
+            self.workbooks[f"wb{index}"] = {"name": name, "sheets": {}}
+        self.requests = 0
+        self.token_grants = 0
+        self.token_refreshes = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.hits = {}
+        self.slow_workbooks = {}
+        # The next `throttle` workbook requests are answered with HTTP 429
+        self.throttle = 0
+        self.retry_after = 0.1
+        # Workbook requests beyond `rate_limit` per second are answered with HTTP 429
+        self.rate_limit = rate_limit
+        self.window = (0, 0)
+        self.throttled = 0
+
+    def delay(self, workbook_id = None):
+        latency = self.slow_workbooks.get(workbook_id, self.latency)
+        if self.jitter:
+            latency += random.uniform(0, self.jitter)
+        if latency:
+            time.sleep(latency)
+
+    def limited(self):
+        # Called with `lock` held
+        if self.throttle > 0:
+            self.throttle -= 1
+            self.throttled += 1
+            return True
+        if self.rate_limit is not None:
+            second = int(time.time())
+            started, count = self.window
+            if started != second:
+                started, count = second, 0
+            self.window = (started, count + 1)
+            if count >= self.rate_limit:
+                self.throttled += 1
+                return True
+        return False
+
+    def used_cells(self, workbook_id):
+        return sum((len(sheet) + 1) * len(_columns(sheet)) for sheet in self.workbooks[workbook_id]['sheets'].values())
+
+def _columns(rows):
+    return set(key for row in rows for key in row)
+
+# ----- Criteria -----
+# Zoho's rules: text is compared case-insensitively, a number is compared with the cells that hold one
+# (an empty or non-numeric cell never satisfies a numeric <, >, <= or >=), and at most 5 levels of parentheses
+class StubCriteriaError(ValueError):
+    pass
+
+_CRITERIA_TOKEN = re.compile(r'\s*("[^"]*"|-?\d+(?:\.\d+)?(?![\w.])|<>|!=|<=|>=|=|<|>|\(|\)|[A-Za-z_]+)')
+_MAX_PARENTHESES = 5
+
+def _cell_text(cell):
+    return "" if cell is None else str(cell).lower()
+
+def _cell_number(cell):
+    if cell is None or cell == "":
+        return None
+    try:
+        return float(cell)
+    except (TypeError, ValueError):
+        return None
+
+def _comparison(column, operator, text, quoted):
+    # text is the value as written, quoted when it was a double quoted string
+    if operator == "contains":
+        return lambda record: text.lower() in _cell_text(record.get(column))
+    numeric = not quoted or (operator in ("<", ">", "<=", ">=") and _cell_number(text) is not None)
+    if numeric:
+        value = float(text)
+        cell = lambda record: _cell_number(record.get(column))
+    else:
+        value = text.lower()
+        cell = lambda record: _cell_text(record.get(column))
+    if operator == "=":
+        return lambda record: cell(record) == value
+    if operator in ("<>", "!="):
+        return lambda record: cell(record) != value
+    compare = {"<": lambda a, b: a < b, ">": lambda a, b: a > b, "<=": lambda a, b: a <= b, ">=": lambda a, b: a >= b}[operator]
+    return lambda record: cell(record) is not None and compare(cell(record), value)
+
+class _CriteriaMatcher:
+    def __init__(self, criteria):
+        self.tokens = []
+        position = 0
+        criteria = criteria.rstrip()
+        while position < len(criteria):
+            match = _CRITERIA_TOKEN.match(criteria, position)
+            if match is None:
+                raise StubCriteriaError(f"Bad character at {position}")
+            token = match.group(1)
+            if token[0].isalpha() or token[0] == "_":
+                token = token.lower()
+                if not token in ("and", "or", "contains"):
+                    raise StubCriteriaError(f"Unknown word {token!r}")
+            self.tokens.append(token)
+            position = match.end()
+        self.position = 0
+
+    def next(self):
+        token = self.tokens[self.position] if self.position < len(self.tokens) else None
+        self.position += 1
+        return token
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def matcher(self):
+        if len(self.tokens) <= 0:
+            return lambda record: True
+        match = self.either(0)
+        if self.peek() is not None:
+            raise StubCriteriaError(f"Trailing {self.peek()!r}")
+        return match
+
+    def either(self, depth):
+        matches = [self.both(depth)]
+        while self.peek() == "or":
+            self.next()
+            matches.append(self.both(depth))
+        return matches[0] if len(matches) == 1 else lambda record: any(match(record) for match in matches)
+
+    def both(self, depth):
+        matches = [self.single(depth)]
+        while self.peek() == "and":
+            self.next()
+            matches.append(self.single(depth))
+        return matches[0] if len(matches) == 1 else lambda record: all(match(record) for match in matches)
+
+    def single(self, depth):
+        token = self.next()
+        if token == "(":
+            if depth >= _MAX_PARENTHESES:
+                raise StubCriteriaError("Too many nested parentheses")
+            match = self.either(depth + 1)
+            if self.next() != ")":
+                raise StubCriteriaError("Missing )")
+            return match
+        if token is None or not token.startswith('"'):
+            raise StubCriteriaError(f"Expected a column, got {token!r}")
+        operator = self.next()
+        if not operator in ("=", "<>", "!=", "<", ">", "<=", ">=", "contains"):
+            raise StubCriteriaError(f"Expected an operator, got {operator!r}")
+        value = self.next()
+        if value is None or value in ("(", ")", "and", "or", "contains") or value[0] in "<>!=":
+            raise StubCriteriaError(f"Expected a value, got {value!r}")
+        if value.startswith('"'):
+            return _comparison(token[1:-1], operator, value[1:-1], True)
+        return _comparison(token[1:-1], operator, value, False)
+
+def criteria_matcher(criteria):
+    return _CriteriaMatcher(str(criteria)).matcher()
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def __reply(self, payload, status = 200, headers = {}):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length).decode('utf-8') if length > 0 else ""
+        return {k: v[0] for k, v in urllib.parse.parse_qs(raw, keep_blank_values=True).items()}
+
+    def do_GET(self):
+        state = self.server.state
+        state.delay()
+        url = urllib.parse.urlparse(self.path)
+        if url.path == "/oauth/v2/auth":
+            # Approve straight away: the redirect carries the authorization code
+            query = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+            self.send_response(302)
+            self.send_header("Location", f"{query.get('redirect_uri', '/')}?code=stub-code&location=us")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if url.path == "/api/v2/workbooks":
+            with state.lock:
+                state.requests += 1
+                workbooks = [{"workbook_name": wb['name'], "resource_id": wbid} for wbid, wb in state.workbooks.items()]
+            return self.__reply({"status": "success", "workbooks": workbooks})
+        self.__reply({"status": "failure", "error_message": "Unknown endpoint"}, 404)
+
+    def do_POST(self):
+        state = self.server.state
+        url = urllib.parse.urlparse(self.path)
+        workbook_id = url.path.split("/")[-1]
+        with state.lock:
+            state.in_flight += 1
+            state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            state.hits[workbook_id] = state.hits.get(workbook_id, 0) + 1
+        try:
+            state.delay(workbook_id)
+            self.__post(state, url, workbook_id)
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+    def __post(self, state, url, workbook_id):
+        form = self.__form()
+        if url.path == "/oauth/v2/token":
+            return self.__token(state, {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()})
+        if not self.headers.get("Authorization", "").startswith(("Bearer ", "Zoho-oauthtoken ")):
+            return self.__reply({"status": "failure", "error_code": 2401, "error_message": "Invalid OAuth token"}, 401)
+        with state.lock:
+            state.requests += 1
+            if state.limited():
+                return self.__reply({"status": "failure", "error_message": "Too many requests"}, 429, {"Retry-After": str(state.retry_after)})
+            if not workbook_id in state.workbooks:
+                return self.__reply({"status": "failure", "error_code": 2831, "error_message": "Workbook not found"})
+            method = form.get("method", "")
+            if method == "worksheet.list":
+                return self.__reply({"status": "success", "worksheet_names": [{"worksheet_name": name} for name in state.workbooks[workbook_id]['sheets']]})
+            sheet = state.workbooks[workbook_id]['sheets'].setdefault(form.get("worksheet_name", ""), [])
+            try:
+                matches = criteria_matcher(form.get("criteria", ""))
+            except StubCriteriaError as e:
+                return self.__reply({"status": "failure", "error_code": 2890, "error_message": f"Invalid criteria: {e}"})
+            # Row 1 holds the column headers, records start at row 2
+            matched = [index for index, record in enumerate(sheet) if matches(record)]
+            if method == "worksheet.records.fetch":
+                start = int(form.get("records_start_index") or 1) - 1
+                if form.get("count"):
+                    matched = matched[start:start + int(form['count'])]
+                else:
+                    matched = matched[start:]
+                records = [dict(sheet[index], row_index=index + 2) for index in matched]
+                return self.__reply({"status": "success", "records": records})
+            if method == "worksheet.records.add":
+                rows = json.loads(form.get("json_data", "[]"))
+                if len(sheet) + len(rows) + 1 > state.max_rows:
+                    return self.__reply({"status": "failure", "error_code": 2870, "error_message": "The worksheet row limit has been reached"})
+                if state.used_cells(workbook_id) + len(rows) * max(len(_columns(rows)), 1) > state.max_cells:
+                    return self.__reply({"status": "failure", "error_code": 2872, "error_message": "The workbook cell limit has been reached"})
+                sheet.extend(rows)
+                return self.__reply({"status": "success"})
+            if method == "worksheet.usedarea":
+                return self.__reply({"status": "success", "last_row": len(sheet) + 1, "last_column": len(_columns(sheet))})
+            if method == "worksheet.records.update":
+                data = json.loads(form.get("data", "{}"))
+                for index in matched:
+                    sheet[index].update(data)
+                return self.__reply({"status": "success", "no_of_affected_rows": len(matched)})
+            if method == "worksheet.records.delete":
+                if form.get("row_array"):
+                    matched = [row - 2 for row in json.loads(form['row_array']) if 0 <= row - 2 < len(sheet)]
+                for index in sorted(set(matched), reverse=True):
+                    del sheet[index]
+                return self.__reply({"status": "success", "no_of_rows_deleted": len(set(matched))})
+        self.__reply({"status": "failure", "error_message": "Unknown method"})
+
+    def __token(self, state, query):
+        grant_type = query.get("grant_type")
+        with state.lock:
+            if grant_type == "authorization_code":
+                state.token_grants += 1
+                token = {"access_token": f"stub-token-g{state.token_grants}", "refresh_token": "stub-refresh"}
+            elif grant_type == "refresh_token" and query.get("refresh_token"):
+                state.token_refreshes += 1
+                token = {"access_token": f"stub-token-{state.token_refreshes}"}
+            else:
+                return self.__reply({"error": "invalid_request"}, 400)
+        token['expires_in'] = 3600
+        token['token_type'] = "Bearer"
+        self.__reply(token)
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients abandoning slow requests (deadlines, timeouts) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+class StubServer:
+    def __init__(self, workbooks = ["stubdb"], latency = 0, max_rows = 65536, max_cells = 2000000, jitter = 0, rate_limit = None, port = 0):
+        self.state = StubState(workbooks, latency, max_rows, max_cells, jitter, rate_limit)
+        self.httpd = _StubHTTPServer(("127.0.0.1", port), StubHandler)
+        self.httpd.state = self.state
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        # Point the library at the stub for the lifetime of the server
+        self.__bases = (zohodb.ZOHO_SHEETS_API_BASE, zohodb.ZOHO_OAUTH_API_BASE)
+        zohodb.ZOHO_SHEETS_API_BASE = f"{self.url}/api/v2"
+        zohodb.ZOHO_OAUTH_API_BASE = f"{self.url}/oauth/v2"
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        zohodb.ZOHO_SHEETS_API_BASE, zohodb.ZOHO_OAUTH_API_BASE = self.__bases
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def prime_token(handler, expires_in = 3600):
+    # Writes a valid token to the handler's cache so no interactive OAuth flow is triggered
+    Path(handler.cache_path).mkdir(parents=True, exist_ok=True)
+    with open(f"{handler.cache_path}/token.json", "w") as f:
+        f.write(json.dumps({
+            "access_token": "stub-token-0",
+            "refresh_token": "stub-refresh",
+            "expires_in": expires_in,
+            "created_at": calendar.timegm(time.gmtime())
+        }))
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Zoho Sheets & OAuth APIs")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workbooks", default="stubdb", help="comma separated workbook names")
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0, help="random extra latency, in seconds")
+    parser.add_argument("--rate-limit", type=int, default=None, help="workbook requests per second before answering with HTTP 429")
+    parser.add_argument("--max-rows", type=int, default=65536)
+    parser.add_argument("--max-cells", type=int, default=2000000)
+    args = parser.parse_args(argv)
+    server = StubServer(args.workbooks.split(","), args.latency, args.max_rows, args.max_cells, args.jitter, args.rate_limit, args.port)
+    print(f"Serving the Zoho stub on {server.url} (set zohodb.ZOHO_SHEETS_API_BASE = \"{server.url}/api/v2\", zohodb.ZOHO_OAUTH_API_BASE = \"{server.url}/oauth/v2\")")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    sys.exit(main())
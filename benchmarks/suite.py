@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+# Reports throughput and p50/p99 latency of select/insert/update/delete against the local stub
+#
+#   python -m benchmarks.suite
+#   python -m benchmarks.suite --workbooks 1,4 --iterations 500 --latency 0.01 --json results.json
+
+TABLE = "bench"
+OPERATIONS = ("select", "insert", "update", "delete")
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def measure(call, iterations, threads):
+    latencies = []
+    def timed(i):
+        start = time.perf_counter()
+        call(i)
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as workers:
+        list(workers.map(timed, range(iterations)))
+    elapsed = time.perf_counter() - start
+    return {
+        "ops_per_sec": iterations / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000
+    }
+
+def seed(server, rows_per_workbook, iterations):
+    # Every workbook holds `rows_per_workbook` rows, ids below `iterations` are spread over all of them
+    workbooks = list(server.state.workbooks.values())
+    for index, workbook in enumerate(workbooks):
+        workbook['sheets'][TABLE] = [{"id": n, "name": f"user{n}", "score": n % 100} for n in range(index, rows_per_workbook * len(workbooks), len(workbooks))]
+    missing = [n for n in range(rows_per_workbook * len(workbooks), iterations)]
+    for n in missing:
+        workbooks[n % len(workbooks)]['sheets'][TABLE].append({"id": n, "name": f"user{n}", "score": n % 100})
+
+def run(workbook_count, args):
+    names = [f"bench{index}" for index in range(workbook_count)]
+    results = {}
+    with StubServer(names, latency=args.latency) as server:
+        handler = zohodb.ZohoAuthHandler(f"suite{workbook_count}", "suite")
+        prime_token(handler)
+        with zohodb.ZohoDB(handler, names, max_threads=max(args.threads, workbook_count)) as db:
+            db.capacity.max_rows = 10 ** 6
+            db.capacity.max_cells = 10 ** 8
+            db.workbookids()
+            seed(server, args.rows, args.iterations)
+            calls = {
+                "select": lambda i: db.select(table=TABLE, criteria=f"\"id\" = {i}"),
+                "insert": lambda i: db.insert(table=TABLE, data=[{"id": -1 - i, "name": "new", "score": 0}]),
+                "update": lambda i: db.update(table=TABLE, criteria=f"\"id\" = {i}", data={"score": 100}),
+                "delete": lambda i: db.delete(table=TABLE, criteria=f"\"id\" = {i}")
+            }
+            for operation in args.operations:
+                requests = server.state.requests
+                results[operation] = measure(calls[operation], args.iterations, args.threads)
+                results[operation]['requests'] = server.state.requests - requests
+    return results
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="ZohoDB benchmark suite (runs against the local stub server)")
+    parser.add_argument("--workbooks", default="1,4,16", help="comma separated workbook counts")
+    parser.add_argument("--operations", default=",".join(OPERATIONS))
+    parser.add_argument("--iterations", type=int, default=200, help="calls per operation")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent callers")
+    parser.add_argument("--rows", type=int, default=1000, help="rows seeded into every workbook")
+    parser.add_argument("--latency", type=float, default=0, help="seconds the stub adds to every request")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+    args.operations = args.operations.split(",")
+
+    os.chdir(tempfile.mkdtemp())
+    report = {"latency": args.latency, "iterations": args.iterations, "threads": args.threads, "rows": args.rows, "results": {}}
+    print(f"{'workbooks':>9} {'operation':<9} {'ops/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'requests':>9}")
+    for workbook_count in [int(count) for count in args.workbooks.split(",")]:
+        results = run(workbook_count, args)
+        report['results'][str(workbook_count)] = results
+        for operation, result in results.items():
+            print(f"{workbook_count:>9} {operation:<9} {result['ops_per_sec']:>9.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['requests']:>9}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=4)
+
+if __name__ == "__main__":
+    sys.exit(main())
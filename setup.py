@@ -21,6 +21,9 @@ setup(
     keywords=['zohodb.py', 'zohodb', 'database', 'zoho', 'sheets'],
     url='https://github.com/oddmario/zohodb.py',
     install_requires=['httpx'],
+    extras_require={
+        'http2': ['httpx[http2]']
+    },
     long_description=(pathlib.Path(__file__).parent / "README.md").read_text(),
     long_description_content_type="text/markdown"
 )
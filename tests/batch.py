@@ -0,0 +1,78 @@
+# Run from the repository root: python -m tests.batch
+import asyncio
+import tempfile
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+def seed(server):
+    for workbook in ("wb0", "wb1"):
+        server.state.workbooks[workbook]['sheets']['users'] = [{"id": f"{workbook}-{index}", "age": index} for index in range(10)]
+    server.state.workbooks["wb0"]['sheets']['logs'] = []
+
+def ids(server, workbook):
+    return [row['id'] for row in server.state.workbooks[workbook]['sheets']['users']]
+
+def check_deletes(server, results, requests):
+    # Rows 3, 5 & 9 of wb0 (row indexes from before the batch) went in one request, row 40 lies past the last row
+    assert requests == 3, requests
+    assert results[:4] == [True, True, True, False], results
+    assert isinstance(results[4], zohodb.InsertResult) and bool(results[4])
+    assert results[5] is True
+    assert ids(server, "wb0") == [f"wb0-{index}" for index in range(10) if not index in (1, 3, 7)]
+    # The update of the other workbook only changed its own row
+    assert ids(server, "wb1") == [f"wb1-{index}" for index in range(10)]
+    assert [row['age'] for row in server.state.workbooks["wb1"]['sheets']['users']] == [index if index != 4 else 40 for index in range(10)]
+
+def main():
+    with StubServer(["db1", "db2"]) as server, tempfile.TemporaryDirectory() as cache_root:
+        seed(server)
+        handler = zohodb.ZohoAuthHandler("batch", "batch", cache_root=cache_root)
+        prime_token(handler)
+        with zohodb.ZohoDB(handler, ["db1", "db2"], cache_root=cache_root) as db:
+            before = server.state.requests
+            with db.batch() as batch:
+                batch.delete(table="users", criteria="", row_id=3, workbook_id="wb0")
+                batch.delete(table="users", criteria="", row_id=5, workbook_id="wb0")
+                batch.delete(table="users", criteria="", row_id=9, workbook_id="wb0")
+                batch.delete(table="users", criteria="", row_id=40, workbook_id="wb0")
+                batch.insert(table="logs", data=[{"event": "cleanup"}])
+                batch.update(table="users", criteria='"id" = "wb1-4"', data={"age": 40}, workbook_id="wb1")
+            print(f"sync batch: {batch.results} in {batch.requests} requests ({server.state.requests - before} sent)")
+            check_deletes(server, batch.results, batch.requests)
+
+            # Deletes that don't name a workbook aren't merged, each one keeps its own outcome
+            with db.batch() as batch:
+                batch.delete(table="users", criteria="", row_id=2)
+                batch.delete(table="users", criteria="", row_id=200)
+            assert batch.requests == 2 and batch.results == [True, False], batch.results
+
+            # The header row can't be deleted, whether it comes as row_id or in row_ids
+            for kwargs in ({"row_id": 1}, {"row_ids": [4, 1]}):
+                try:
+                    db.delete(table="users", criteria="", workbook_id="wb0", **kwargs)
+                except zohodb.InvalidType:
+                    pass
+                else:
+                    raise AssertionError(f"{kwargs} deleted the header row")
+
+        async def run(cache_root):
+            # A cache of its own: the tracked row counts of the first run don't match the seeded rows anymore
+            seed(server)
+            async_handler = zohodb.AsyncZohoAuthHandler("batch", "batch", cache_root=cache_root)
+            prime_token(async_handler)
+            async with zohodb.AsyncZohoDB(async_handler, ["db1", "db2"], cache_root=cache_root) as db:
+                async with db.batch() as batch:
+                    batch.delete(table="users", criteria="", row_id=3, workbook_id="wb0")
+                    batch.delete(table="users", criteria="", row_id=5, workbook_id="wb0")
+                    batch.delete(table="users", criteria="", row_id=9, workbook_id="wb0")
+                    batch.delete(table="users", criteria="", row_id=40, workbook_id="wb0")
+                    batch.insert(table="logs", data=[{"event": "cleanup"}])
+                    batch.update(table="users", criteria='"id" = "wb1-4"', data={"age": 40}, workbook_id="wb1")
+                print(f"async batch: {batch.results} in {batch.requests} requests")
+                check_deletes(server, batch.results, batch.requests)
+        with tempfile.TemporaryDirectory() as async_cache_root:
+            asyncio.run(run(async_cache_root))
+
+if __name__ == "__main__":
+    main()
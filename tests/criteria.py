@@ -0,0 +1,86 @@
+# Run from the repository root: python -m tests.criteria
+import tempfile
+
+from zohodb import zohodb
+from zohodb.criteria import InvalidCriteria, MAX_NESTING, compile_criteria, parse_criteria, normalize_criteria
+from benchmarks.stub_server import StubServer, prime_token
+
+RECORDS = [
+    {"name": "Mario", "country": "EG", "age": 25},
+    {"name": "mario", "country": "eg", "age": "25.0"},
+    {"name": "John", "country": "US", "age": 17},
+    {"name": "Jane", "country": "N/A", "age": ""},
+    {"name": "Kate", "country": "", "age": "unknown"},
+    {"name": "Ann", "age": 61}
+]
+
+CRITERIA = [
+    '"name" = "MARIO"',
+    '"age" = 25',
+    '"age" <> 25',
+    '"age" > 18',
+    '"age" <= "25"',
+    '"country" != "eg"',
+    '"country" = ""',
+    '"name" contains "AR"',
+    '"age" contains 5',
+    '("country" = "US" or "age" >= 60) and "name" <> "Ann"',
+    '"country" = "EG" AND "age" < 30 OR "name" = "Kate"'
+]
+
+PARSE_ERRORS = [
+    '"name" = ',
+    '"name" == "Mario"',
+    'name = "Mario"',
+    '"name" = Mario',
+    '"name" = "Mario" and',
+    '("name" = "Mario"',
+    '"name" = "Mario")',
+    '"name" = "Mario" ; "age" = 1'
+]
+
+def main():
+    for criteria in PARSE_ERRORS:
+        try:
+            parse_criteria(criteria)
+        except InvalidCriteria as e:
+            print(f"{criteria!r}: {e}")
+        else:
+            raise AssertionError(f"{criteria!r} parsed")
+
+    # Zoho allows 5 levels of nested criteria
+    nested = lambda depth: "(" * depth + '"age" = 1' + ")" * depth
+    parse_criteria(nested(MAX_NESTING))
+    try:
+        parse_criteria(nested(MAX_NESTING + 1))
+    except InvalidCriteria as e:
+        print(f"{MAX_NESTING + 1} levels: {e}")
+    else:
+        raise AssertionError("the nesting limit wasn't enforced")
+
+    for criteria in CRITERIA:
+        # Normalizing is stable and doesn't change what matches
+        normalized = normalize_criteria(criteria)
+        assert normalize_criteria(normalized) == normalized, criteria
+        assert compile_criteria(normalized).filter(RECORDS) == compile_criteria(criteria).filter(RECORDS), criteria
+
+    # The compiled predicate picks the rows the stub's own criteria matcher (which follows Zoho's rules) returns
+    with StubServer(["db1"]) as server, tempfile.TemporaryDirectory() as cache_root:
+        server.state.workbooks["wb0"]['sheets']['users'] = [dict(record) for record in RECORDS]
+        handler = zohodb.ZohoAuthHandler("criteria", "criteria", cache_root=cache_root)
+        prime_token(handler)
+        with zohodb.ZohoDB(handler, ["db1"], validate_criteria=True, cache_root=cache_root) as db:
+            for criteria in CRITERIA:
+                remote = [record['name'] for record in db.select(table="users", criteria=criteria, use_cache=False)]
+                local = [record['name'] for record in compile_criteria(criteria).filter(RECORDS)]
+                print(f"{criteria}: {remote}")
+                assert remote == local, (criteria, remote, local)
+            try:
+                db.select(table="users", criteria=nested(MAX_NESTING + 1))
+            except InvalidCriteria:
+                pass
+            else:
+                raise AssertionError("validate_criteria let a criteria Zoho refuses through")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# Run from the repository root: python -m tests.fanout
+import time
+import tempfile
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+WORKBOOKS = [f"db{index}" for index in range(8)]
+LATENCY = 0.2
+
+def main():
+    with StubServer(WORKBOOKS, latency=LATENCY) as server, tempfile.TemporaryDirectory() as cache_root:
+        handler = zohodb.ZohoAuthHandler("fanout", "fanout", cache_root=cache_root)
+        prime_token(handler)
+        with zohodb.ZohoDB(handler, WORKBOOKS) as db:
+            workbookids = db.workbookids()
+            server.state.hits = {}
+            start = time.perf_counter()
+            db.select(table="users", criteria="")
+            elapsed = time.perf_counter() - start
+            print(f"select over {len(workbookids)} workbooks: {elapsed:.2f}s (one request takes {LATENCY}s), {server.state.max_in_flight} requests in flight at once")
+            assert sorted(server.state.hits) == sorted(workbookids)
+            assert server.state.max_in_flight == len(workbookids)
+            assert elapsed < LATENCY * 2
+
+            # A slow workbook is reported as failed once the query deadline passes
+            server.state.slow_workbooks = {workbookids[-1]: 2}
+            start = time.perf_counter()
+            rows = db.select(table="users", criteria="", deadline=0.5, allow_partial=True)
+            print(f"deadline 0.5s: returned after {time.perf_counter() - start:.2f}s, failures={rows.failures}")
+            assert list(rows.failures) == [workbookids[-1]]
+            try:
+                db.select(table="users", criteria="", workbook_timeout=0.5)
+            except zohodb.WorkbookRequestsFailed as e:
+                print(f"workbook_timeout 0.5s: {list(e.failures)} failed")
+                assert list(e.failures) == [workbookids[-1]]
+            else:
+                raise AssertionError("expected WorkbookRequestsFailed")
+            server.state.slow_workbooks = {}
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,5 @@ db = zohodb.ZohoDB(handler, [
 query = db.insert(table="users", data=[{
     "username": "kaitlyn"
 }])
-print(query) # expected: True
+print(bool(query)) # expected: True
+print(query.placements)
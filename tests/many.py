@@ -0,0 +1,72 @@
+# Run from the repository root: python -m tests.many
+import asyncio
+import tempfile
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+def seed(server):
+    for workbook in ("wb0", "wb1"):
+        server.state.workbooks[workbook]['sheets']['users'] = [{"id": f"{workbook}-{index}", "age": index, "country": "N/A" if index % 2 else "US"} for index in range(20)]
+    # Two rows that can't be told apart without a key column
+    server.state.workbooks["wb0"]['sheets']['events'] = [{"kind": "login"}, {"kind": "login"}, {"kind": "logout"}]
+
+def rows(server, workbook):
+    return server.state.workbooks[workbook]['sheets']['users']
+
+def main():
+    with StubServer(["db1", "db2"]) as server, tempfile.TemporaryDirectory() as cache_root:
+        seed(server)
+        handler = zohodb.ZohoAuthHandler("many", "many", cache_root=cache_root)
+        prime_token(handler)
+        with zohodb.ZohoDB(handler, ["db1", "db2"], cache_root=cache_root) as db:
+            # One delete request per workbook, an outcome per row
+            young = db.select(table="users", criteria='"age" < 5')
+            before = server.state.requests
+            outcomes = db.delete_many(table="users", rows=young)
+            print(f"delete_many: {len(young)} rows in {server.state.requests - before} requests (usedarea included)")
+            assert outcomes == [True] * len(young)
+            assert all(row['age'] >= 5 for workbook in ("wb0", "wb1") for row in rows(server, workbook))
+            assert len(rows(server, "wb0")) == len(rows(server, "wb1")) == 15
+
+            # Rows matched by their cells, and by a criteria
+            targets = db.select(table="users", criteria='"country" = "N/A" and "age" < 10')
+            outcomes = db.update_many(table="users", updates=[(row, {"country": "EG"}) for row in targets] + [('"age" = 19', {"country": "DE"}), ('"age" = 99', {"country": "XX"})])
+            assert outcomes == [True] * len(targets) + [True, False], outcomes
+            for workbook in ("wb0", "wb1"):
+                assert [row['country'] for row in rows(server, workbook) if row['age'] < 10] == ["EG" if row['age'] % 2 else "US" for row in rows(server, workbook) if row['age'] < 10]
+                assert rows(server, workbook)[-1]['country'] == "DE"
+
+            # A row whose cells match another row too is reported instead of passing for a single update
+            events = db.select(table="events", criteria="")
+            outcomes = db.update_many(table="events", updates=[(events[0], {"seen": 1}), (events[2], {"seen": 1})])
+            print(f"update_many of a duplicated row: {outcomes}")
+            assert isinstance(outcomes[0], zohodb.UnexpectedResponse) and outcomes[1] is True
+
+        # With a key column, the rows are matched by their key
+        seed(server)
+        with tempfile.TemporaryDirectory() as keyed_cache_root:
+            async def run():
+                async_handler = zohodb.AsyncZohoAuthHandler("many", "many", cache_root=keyed_cache_root)
+                prime_token(async_handler)
+                async with zohodb.AsyncZohoDB(async_handler, ["db1", "db2"], keys={"users": "id"}, cache_root=keyed_cache_root) as db:
+                    targets = await db.select(table="users", criteria='"age" >= 18')
+                    outcomes = await db.update_many(table="users", updates=[(row, {"age": row['age'] + 100}) for row in targets])
+                    assert outcomes == [True] * len(targets) == [True] * 4, outcomes
+                    assert [row['age'] for row in rows(server, "wb1")[-2:]] == [118, 119]
+                    outcomes = await db.delete_many(table="users", rows=await db.select(table="users", criteria='"age" >= 100'))
+                    assert outcomes == [True] * 4 and len(rows(server, "wb0")) == len(rows(server, "wb1")) == 18
+            asyncio.run(run())
+
+        # Rows that aren't select() results are refused before anything is sent
+        with zohodb.ZohoDB(handler, ["db1", "db2"], cache_root=cache_root) as db:
+            for call in (lambda: db.delete_many(table="users", rows=[{"id": "wb0-5"}]), lambda: db.update_many(table="users", updates=[({"age": 5}, {"age": 6})])):
+                try:
+                    call()
+                except zohodb.MissingData:
+                    pass
+                else:
+                    raise AssertionError("a row without row_index/workbook_id was accepted")
+
+if __name__ == "__main__":
+    main()
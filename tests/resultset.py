@@ -0,0 +1,50 @@
+# Run from the repository root: python -m tests.resultset
+import array
+import tempfile
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+WORKBOOKS = ["db1", "db2", "db3"]
+
+def main():
+    with StubServer(WORKBOOKS) as server, tempfile.TemporaryDirectory() as cache_root:
+        sheets = server.state.workbooks
+        sheets["wb0"]['sheets']['users'] = [{"name": f"user{index}", "age": index, "score": index / 2} for index in range(50)]
+        sheets["wb1"]['sheets']['users'] = []
+        # A workbook whose rows don't all have the same cells
+        sheets["wb2"]['sheets']['users'] = [{"name": "extra", "age": 7}, {"name": "tagged", "age": 8, "tag": "x"}]
+        handler = zohodb.ZohoAuthHandler("resultset", "resultset", cache_root=cache_root)
+        prime_token(handler)
+        with zohodb.ZohoDB(handler, WORKBOOKS, cache_root=cache_root) as db:
+            for criteria in ("", '"age" < 10', '"name" = "nobody"'):
+                records = db.select(table="users", criteria=criteria, use_cache=False)
+                rows = db.select(table="users", criteria=criteria, use_cache=False, as_="columns")
+                # The same rows, cells & workbook IDs, in the same order, as the list of dicts
+                assert isinstance(rows, zohodb.ResultSet)
+                assert len(rows) == len(records) and bool(rows) == bool(records)
+                assert rows.to_dicts() == [dict(record) for record in records], criteria
+                assert [row['workbook_id'] for row in rows] == [record['workbook_id'] for record in records]
+                assert rows.failures == records.failures == {}
+                print(f"{criteria or 'every row'}: {len(rows)} rows, columns {rows.columns}, runs {rows.runs()}")
+
+            # Numeric columns of rows that all have the same cells are packed into typed arrays
+            rows = db.select(table="users", criteria='"age" >= 10', use_cache=False, as_="columns")
+            assert isinstance(rows.column("age"), array.array) and isinstance(rows.column("score"), array.array)
+            assert list(rows.column("age")) == list(range(10, 50))
+
+            # Missing cells are left out of the rows and read as None from the column
+            rows = db.select(table="users", criteria="", use_cache=False, as_="columns")
+            assert rows.column("tag")[-2:] == [None, "x"] and "tag" not in rows[-2] and rows[-1]['tag'] == "x"
+            assert rows[-1].to_dict() == {"name": "tagged", "age": 8, "tag": "x", "row_index": 3, "workbook_id": "wb2"}
+            assert [row['name'] for row in rows[48:51]] == ["user48", "user49", "extra"]
+            assert rows.column("workbook_id") == ["wb0"] * 50 + ["wb2"] * 2
+
+            # A failed workbook is reported on the ResultSet like on the list
+            server.state.slow_workbooks = {"wb2": 2}
+            rows = db.select(table="users", criteria="", use_cache=False, as_="columns", workbook_timeout=0.5, allow_partial=True)
+            server.state.slow_workbooks = {}
+            assert list(rows.failures) == ["wb2"] and len(rows) == 50
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Run from the repository root: python -m tests.sharding
+import tempfile
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+ROWS = 300
+
+def main():
+    with StubServer(["db1", "db2", "db3"]) as server, tempfile.TemporaryDirectory() as cache_root:
+        handler = zohodb.ZohoAuthHandler("sharding", "sharding", cache_root=cache_root)
+        prime_token(handler)
+        with zohodb.ZohoDB(handler, ["db1", "db2"], shard_keys={"users": "id"}, cache_root=cache_root) as db:
+            db.insert(table="users", data=[{"id": index, "name": f"user{index}"} for index in range(ROWS)])
+            # Every row sits in the workbook its shard key hashes to
+            for row in db.select(table="users", criteria=""):
+                assert row['workbook_id'] == db.sharding.workbook("users", row['id'], db.workbookids())
+
+            # Changing the shard key would strand the row in its old workbook
+            try:
+                db.update(table="users", criteria='"id" = 7', data={"id": 99})
+            except zohodb.InvalidType as e:
+                print(f"shard key update rejected: {e}")
+            else:
+                raise AssertionError("expected InvalidType")
+            # Rewriting the same key (in another format) is fine, and the row is still found by its key
+            assert db.update(table="users", criteria='"id" = 7', data={"id": "7.0", "name": "seven"}) is True
+            rows = db.select(table="users", criteria='"id" = 7')
+            assert len(rows) == 1 and rows[0]['name'] == "seven", rows
+            assert db.delete(table="users", criteria='"id" = 7') is True
+            assert len(db.select(table="users", criteria='"id" = 7')) == 0
+
+        # A third workbook takes about a third of the keys, and only those move
+        with zohodb.ZohoDB(handler, ["db1", "db2", "db3"], shard_keys={"users": "id"}, cache_root=cache_root) as db:
+            before = {row['id']: row['workbook_id'] for row in db.select(table="users", criteria="")}
+            report = db.rebalance("users")
+            after = {row['id']: row['workbook_id'] for row in db.select(table="users", criteria="", use_cache=False)}
+            moved = [key for key in before if before[key] != after[key]]
+            print(f"rebalance over 3 workbooks moved {report['moved']} of {report['rows']} rows")
+            assert sorted(after) == sorted(before)
+            assert len(moved) == report['moved']
+            assert all(after[key] == db.workbookids()[2] for key in moved)
+            assert abs(report['moved'] / report['rows'] - 1 / 3) < 0.1
+            assert db.rebalance("users")['moved'] == 0
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# Run from the repository root: python -m tests.token_refresh
+import time
+import tempfile
+import threading
+
+from zohodb import zohodb
+from benchmarks.stub_server import StubServer, prime_token
+
+THREADS = 200
+
+def hammer(handler, until, errors):
+    try:
+        while time.time() < until:
+            handler.token()
+    except Exception as e:
+        errors.append(e)
+
+def stress(refresh_margin):
+    with StubServer() as server, tempfile.TemporaryDirectory() as cache_root:
+        handler = zohodb.ZohoAuthHandler(f"stress{refresh_margin}", "stress", refresh_margin=refresh_margin, cache_root=cache_root)
+        # The token expires ~1 second into the run
+        prime_token(handler, expires_in=1)
+        errors = []
+        until = time.time() + 3
+        threads = [threading.Thread(target=hammer, args=(handler, until, errors)) for _ in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        print(f"refresh_margin={refresh_margin}: {server.state.token_refreshes} refresh(es), {len(errors)} error(s), token={handler.token()}")
+        assert server.state.token_refreshes == 1
+        assert errors == []
+
+if __name__ == "__main__":
+    stress(0)
+    stress(60)
@@ -0,0 +1,318 @@
+#
+# ZohoDB.py
+#
+# @oddmario
+# Mario
+# mariolatif741@yandex.com
+#
+# License: GNU GPLv3
+
+# criteria.py
+# Parses the Zoho Sheets criteria language into an AST and compiles it into Python predicates
+
+import re
+
+MAX_NESTING = 5
+
+class InvalidCriteria(Exception):
+    """Thrown when a criteria string can't be parsed"""
+    pass
+
+# ----- AST -----
+class MatchAll:
+    __slots__ = ()
+
+    def to_criteria(self):
+        return ""
+
+    def _source(self):
+        return "True"
+
+    def _sql(self, column):
+        return "1", []
+
+    def __eq__(self, other):
+        return isinstance(other, MatchAll)
+
+    def __hash__(self):
+        return hash(MatchAll)
+
+    def __repr__(self):
+        return "MatchAll()"
+
+class Comparison:
+    __slots__ = ("column", "operator", "value")
+
+    def __init__(self, column, operator, value):
+        self.column = column
+        self.operator = operator
+        self.value = value
+
+    def to_criteria(self):
+        if isinstance(self.value, str):
+            value = f"\"{self.value}\""
+        else:
+            value = repr(self.value)
+        return f"\"{self.column}\" {self.operator} {value}"
+
+    def _source(self):
+        column = repr(self.column)
+        if self.operator == "contains":
+            return f"({repr(str(self.value).lower())} in _text(r.get({column})))"
+        if self.operator == "=":
+            if isinstance(self.value, str):
+                return f"(_text(r.get({column})) == {repr(self.value.lower())})"
+            return f"(_number(r.get({column})) == {repr(self.value)})"
+        if self.operator in ("<>", "!="):
+            if isinstance(self.value, str):
+                return f"(_text(r.get({column})) != {repr(self.value.lower())})"
+            return f"(_number(r.get({column})) != {repr(self.value)})"
+        if isinstance(self.value, str):
+            return f"(_text(r.get({column})) {self.operator} {repr(self.value.lower())})"
+        # Empty or non-numeric cells never satisfy a numeric range comparison
+        return f"(_compare(_number(r.get({column})), {repr(self.operator)}, {repr(self.value)}))"
+
+    def _sql(self, column):
+        # Mirrors _source() through the zohodb_text()/zohodb_number() SQL functions (see register_sql_functions())
+        cell = column(self.column)
+        if self.operator == "contains":
+            return f"(instr(zohodb_text({cell}), ?) > 0)", [str(self.value).lower()]
+        if isinstance(self.value, str):
+            operator = "!=" if self.operator == "<>" else self.operator
+            return f"(zohodb_text({cell}) {operator} ?)", [self.value.lower()]
+        if self.operator in ("<>", "!="):
+            # An empty cell is "not equal" to any number
+            return f"(zohodb_number({cell}) IS NOT ?)", [self.value]
+        return f"(zohodb_number({cell}) {self.operator} ?)", [self.value]
+
+    def __eq__(self, other):
+        return isinstance(other, Comparison) and (self.column, self.operator, self.value) == (other.column, other.operator, other.value)
+
+    def __hash__(self):
+        return hash((self.column, self.operator, self.value))
+
+    def __repr__(self):
+        return f"Comparison({self.column!r}, {self.operator!r}, {self.value!r})"
+
+class And:
+    __slots__ = ("operands",)
+    keyword = "and"
+
+    def __init__(self, operands):
+        self.operands = tuple(operands)
+
+    def to_criteria(self):
+        return f" {self.keyword} ".join(_wrapped(operand, self) for operand in self.operands)
+
+    def _source(self):
+        return "(" + f" {self.keyword} ".join(operand._source() for operand in self.operands) + ")"
+
+    def _sql(self, column):
+        parts = []
+        params = []
+        for operand in self.operands:
+            sql, operand_params = operand._sql(column)
+            parts.append(sql)
+            params.extend(operand_params)
+        return "(" + f" {self.keyword.upper()} ".join(parts) + ")", params
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.operands == other.operands
+
+    def __hash__(self):
+        return hash((self.keyword, self.operands))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self.operands)!r})"
+
+class Or(And):
+    __slots__ = ()
+    keyword = "or"
+
+def _wrapped(node, parent):
+    if isinstance(node, (And, Or)) and type(node) is not type(parent):
+        return f"({node.to_criteria()})"
+    return node.to_criteria()
+# ----------
+
+_TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<string>"[^"]*")
+      | (?P<number>-?\d+(?:\.\d+)?(?![\w.]))
+      | (?P<operator><>|!=|<=|>=|=|<|>)
+      | (?P<paren>[()])
+      | (?P<word>[A-Za-z_]+)
+    )""", re.VERBOSE)
+
+_KEYWORD_OPERATORS = ("contains",)
+
+def _tokenize(criteria):
+    tokens = []
+    position = 0
+    criteria = criteria.rstrip()
+    while position < len(criteria):
+        match = _TOKEN.match(criteria, position)
+        if match is None:
+            position += len(criteria[position:]) - len(criteria[position:].lstrip())
+            raise InvalidCriteria(f"Unexpected character {criteria[position]!r} at position {position}")
+        kind = match.lastgroup
+        text = match.group(kind)
+        start = match.start(kind)
+        if kind == "word":
+            text = text.lower()
+            if text in ("and", "or"):
+                kind = text
+            elif text in _KEYWORD_OPERATORS:
+                kind = "operator"
+            else:
+                raise InvalidCriteria(f"Unknown keyword {text!r} at position {start} (strings must be surrounded by double quotes)")
+        tokens.append((kind, text, start))
+        position = match.end()
+    return tokens
+
+class _Parser:
+    def __init__(self, criteria):
+        self.tokens = _tokenize(criteria)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None, -1)
+
+    def take(self, kind, what):
+        token = self.peek()
+        if token[0] != kind:
+            if token[0] is None:
+                raise InvalidCriteria(f"Expected {what} but the criteria ended")
+            raise InvalidCriteria(f"Expected {what} at position {token[2]}, got {token[1]!r}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            return MatchAll()
+        node = self.expression(0)
+        token = self.peek()
+        if token[0] is not None:
+            raise InvalidCriteria(f"Unexpected {token[1]!r} at position {token[2]}")
+        return node
+
+    def expression(self, depth):
+        operands = [self.conjunction(depth)]
+        while self.peek()[0] == "or":
+            self.position += 1
+            operands.append(self.conjunction(depth))
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def conjunction(self, depth):
+        operands = [self.primary(depth)]
+        while self.peek()[0] == "and":
+            self.position += 1
+            operands.append(self.primary(depth))
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def primary(self, depth):
+        token = self.peek()
+        if token[0] == "paren" and token[1] == "(":
+            if depth >= MAX_NESTING:
+                raise InvalidCriteria(f"A maximum of {MAX_NESTING} nested criteria can be used (position {token[2]})")
+            self.position += 1
+            node = self.expression(depth + 1)
+            token = self.peek()
+            if token[0] != "paren" or token[1] != ")":
+                raise InvalidCriteria(f"Missing a closing parenthesis at position {token[2] if token[0] else 'end'}")
+            self.position += 1
+            return node
+        column = self.take("string", "a double quoted column name")[1][1:-1]
+        operator = self.take("operator", "a comparison operator")[1]
+        kind, text, position = self.peek()
+        if kind == "string":
+            value = text[1:-1]
+        elif kind == "number":
+            value = float(text) if "." in text else int(text)
+        else:
+            raise InvalidCriteria(f"Expected a double quoted string or a number at position {position}" if kind else "Expected a value but the criteria ended")
+        self.position += 1
+        if operator in ("<", ">", "<=", ">=") and isinstance(value, str):
+            try:
+                value = float(value) if "." in value else int(value)
+            except ValueError:
+                pass
+        return Comparison(column, operator, value)
+
+def parse_criteria(criteria):
+    return _Parser(str(criteria)).parse()
+
+def normalize_criteria(criteria):
+    return parse_criteria(criteria).to_criteria()
+
+def equality_value(criteria, column):
+    # The value criteria requires column to be equal to, or None when it allows more than one value
+    node = parse_criteria(criteria)
+    operands = node.operands if isinstance(node, And) and not isinstance(node, Or) else (node,)
+    for operand in operands:
+        if isinstance(operand, Comparison) and operand.column == column and operand.operator == "=":
+            return operand.value
+    return None
+
+def _text(value):
+    if value is None:
+        return ""
+    return str(value).lower()
+
+def _number(value):
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _compare(left, operator, right):
+    if left is None:
+        return False
+    if operator == "<":
+        return left < right
+    if operator == ">":
+        return left > right
+    if operator == "<=":
+        return left <= right
+    return left >= right
+
+class CompiledCriteria:
+    __slots__ = ("criteria", "ast", "predicate")
+
+    def __init__(self, criteria):
+        if isinstance(criteria, CompiledCriteria):
+            criteria = criteria.criteria
+        self.criteria = str(criteria)
+        self.ast = parse_criteria(self.criteria)
+        # The AST only holds repr()'d literals, so the generated source is safe to evaluate
+        self.predicate = eval(f"lambda r: {self.ast._source()}", {"_text": _text, "_number": _number, "_compare": _compare})
+
+    def normalized(self):
+        return self.ast.to_criteria()
+
+    def __call__(self, record):
+        return self.predicate(record)
+
+    def filter(self, records):
+        return list(filter(self.predicate, records))
+
+    def __repr__(self):
+        return f"CompiledCriteria({self.normalized()!r})"
+
+def compile_criteria(criteria):
+    return CompiledCriteria(criteria)
+
+def criteria_to_sql(criteria, column):
+    # column maps a column name to the SQL expression holding its cells, returns (sql, params)
+    if isinstance(criteria, CompiledCriteria):
+        return criteria.ast._sql(column)
+    return parse_criteria(criteria)._sql(column)
+
+def register_sql_functions(connection):
+    # The SQL returned by criteria_to_sql() compares cells the same way the compiled predicates do
+    connection.create_function("zohodb_text", 1, _text, deterministic=True)
+    connection.create_function("zohodb_number", 1, _number, deterministic=True)
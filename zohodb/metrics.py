@@ -0,0 +1,268 @@
+#
+# ZohoDB.py
+#
+# @oddmario
+# Mario
+# mariolatif741@yandex.com
+#
+# License: GNU GPLv3
+
+# metrics.py
+# An optional metrics collector that ZohoDB, the auth handlers and ZohoDBCache report to
+
+import time
+import bisect
+import threading
+
+# Upper bounds (in seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds = DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        # The last slot counts the observations above the largest bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Estimated by interpolating inside the bucket holding the q-th observation
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                if index >= len(self.bounds):
+                    return lower
+                return lower + (self.bounds[index] - lower) * ((rank - seen) / count)
+            seen += count
+        return self.bounds[-1]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(self.bounds + (float("inf"),), self.counts))
+        }
+
+class ZohoMetricsListener:
+    # Receives the same events as ZohoMetrics, subclass it and override what you need
+
+    def operation_started(self, name, attributes):
+        return None
+
+    def operation_ended(self, handle, seconds, error):
+        pass
+
+    def request(self, workbook, method, seconds, status, error):
+        pass
+
+class _Operation:
+    __slots__ = ("metrics", "name", "attributes", "start", "handles")
+
+    def __init__(self, metrics, name, attributes):
+        self.metrics = metrics
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.handles = [listener.operation_started(self.name, self.attributes) for listener in self.metrics.listeners]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        self.metrics.operation_ended(self.name, seconds, exc_value)
+        for listener, handle in zip(self.metrics.listeners, self.handles):
+            listener.operation_ended(handle, seconds, exc_value)
+        return False
+
+class ZohoMetrics:
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.listeners = []
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.operations = {}
+            self.operation_errors = {}
+            self.requests = {}
+            self.workbook_requests = {}
+            self.request_errors = {}
+            self.statuses = {}
+            self.bytes_sent = {}
+            self.bytes_received = {}
+            self.retries = {}
+            self.throttles = {}
+            self.token_refreshes = {}
+            self.token_refresh_failures = {}
+            self.phases = {}
+            self.cache_hits = {}
+            self.cache_misses = {}
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+        return listener
+
+    def __observe(self, histograms, key, seconds):
+        # Called with self.__lock held
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def operation(self, name, **attributes):
+        return _Operation(self, name, attributes)
+
+    def operation_ended(self, name, seconds, error = None):
+        with self.__lock:
+            self.__observe(self.operations, name, seconds)
+            if error is not None:
+                self.operation_errors[name] = self.operation_errors.get(name, 0) + 1
+
+    def request(self, workbook, method, seconds, sent = 0, received = 0, status = None, error = None):
+        with self.__lock:
+            self.__observe(self.requests, method, seconds)
+            self.__observe(self.workbook_requests, workbook, seconds)
+            self.bytes_sent[workbook] = self.bytes_sent.get(workbook, 0) + sent
+            self.bytes_received[workbook] = self.bytes_received.get(workbook, 0) + received
+            if status is not None:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+                if status == 429:
+                    self.throttles[workbook] = self.throttles.get(workbook, 0) + 1
+            if error is not None:
+                self.request_errors[workbook] = self.request_errors.get(workbook, 0) + 1
+        for listener in self.listeners:
+            listener.request(workbook, method, seconds, status, error)
+
+    def retry(self, workbook):
+        with self.__lock:
+            self.retries[workbook] = self.retries.get(workbook, 0) + 1
+
+    def token_refresh(self, kind, seconds, ok = True):
+        # kind is "refresh" or "authorization_code"
+        with self.__lock:
+            self.token_refreshes[kind] = self.token_refreshes.get(kind, 0) + 1
+            if not ok:
+                self.token_refresh_failures[kind] = self.token_refresh_failures.get(kind, 0) + 1
+            self.__observe(self.phases, "token_refresh", seconds)
+
+    def phase(self, name, seconds):
+        # Time spent in one step of a call: "token", "parse", "rate_limit", "cache_io", "cache_lock_wait"...
+        with self.__lock:
+            self.__observe(self.phases, name, seconds)
+
+    def cache_lookup(self, table, hit):
+        with self.__lock:
+            counts = self.cache_hits if hit else self.cache_misses
+            counts[table] = counts.get(table, 0) + 1
+
+    def snapshot(self):
+        with self.__lock:
+            return {
+                "operations": {name: histogram.snapshot() for name, histogram in self.operations.items()},
+                "operation_errors": dict(self.operation_errors),
+                "requests": {method: histogram.snapshot() for method, histogram in self.requests.items()},
+                "workbooks": {workbook: histogram.snapshot() for workbook, histogram in self.workbook_requests.items()},
+                "request_errors": dict(self.request_errors),
+                "statuses": dict(self.statuses),
+                "bytes_sent": dict(self.bytes_sent),
+                "bytes_received": dict(self.bytes_received),
+                "retries": dict(self.retries),
+                "throttles": dict(self.throttles),
+                "token_refreshes": dict(self.token_refreshes),
+                "token_refresh_failures": dict(self.token_refresh_failures),
+                "phases": {name: histogram.snapshot() for name, histogram in self.phases.items()},
+                "cache_hits": dict(self.cache_hits),
+                "cache_misses": dict(self.cache_misses)
+            }
+
+    def prometheus(self, prefix = "zohodb"):
+        # Prometheus text exposition format, e.g. to serve from a /metrics endpoint
+        with self.__lock:
+            lines = []
+            lines += _histogram_lines(f"{prefix}_operation_duration_seconds", "operation", self.operations)
+            lines += _counter_lines(f"{prefix}_operation_errors_total", "operation", self.operation_errors)
+            lines += _histogram_lines(f"{prefix}_request_duration_seconds", "method", self.requests)
+            lines += _histogram_lines(f"{prefix}_workbook_request_duration_seconds", "workbook", self.workbook_requests)
+            lines += _counter_lines(f"{prefix}_request_errors_total", "workbook", self.request_errors)
+            lines += _counter_lines(f"{prefix}_responses_total", "status", self.statuses)
+            lines += _counter_lines(f"{prefix}_request_bytes_total", "workbook", self.bytes_sent)
+            lines += _counter_lines(f"{prefix}_response_bytes_total", "workbook", self.bytes_received)
+            lines += _counter_lines(f"{prefix}_retries_total", "workbook", self.retries)
+            lines += _counter_lines(f"{prefix}_throttled_total", "workbook", self.throttles)
+            lines += _counter_lines(f"{prefix}_token_refreshes_total", "kind", self.token_refreshes)
+            lines += _counter_lines(f"{prefix}_token_refresh_failures_total", "kind", self.token_refresh_failures)
+            lines += _histogram_lines(f"{prefix}_phase_duration_seconds", "phase", self.phases)
+            lines += _counter_lines(f"{prefix}_cache_hits_total", "table", self.cache_hits)
+            lines += _counter_lines(f"{prefix}_cache_misses_total", "table", self.cache_misses)
+        return "\n".join(lines) + "\n"
+
+# ----- Prometheus text exposition -----
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f"{name}=\"{_label_value(value)}\"" for name, value in labels.items()) + "}"
+
+def _histogram_lines(name, label, histograms):
+    lines = [f"# TYPE {name} histogram"]
+    for key, histogram in histograms.items():
+        cumulative = 0
+        for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(f"{name}_bucket{_labels({label: key, 'le': le})} {cumulative}")
+        lines.append(f"{name}_sum{_labels({label: key})} {histogram.sum}")
+        lines.append(f"{name}_count{_labels({label: key})} {histogram.count}")
+    return lines
+
+def _counter_lines(name, label, counts):
+    lines = [f"# TYPE {name} counter"]
+    for key, count in counts.items():
+        lines.append(f"{name}{_labels({label: key})} {count}")
+    return lines
+# ----------
+
+# ----- OpenTelemetry-style spans -----
+class OpenTelemetrySpans(ZohoMetricsListener):
+    # Turns operations & requests into spans of an OpenTelemetry tracer (anything with the same start_span() API works)
+
+    def __init__(self, tracer, prefix = "zohodb"):
+        self.tracer = tracer
+        self.prefix = prefix
+
+    def operation_started(self, name, attributes):
+        return self.tracer.start_span(f"{self.prefix}.{name}", attributes={f"{self.prefix}.{key}": str(value) for key, value in attributes.items()})
+
+    def operation_ended(self, handle, seconds, error):
+        if error is not None:
+            handle.record_exception(error)
+        handle.end()
+
+    def request(self, workbook, method, seconds, status, error):
+        # Requests run on pool threads, so their spans are created after the fact with explicit timestamps
+        end = time.time_ns()
+        attributes = {f"{self.prefix}.workbook_id": str(workbook), f"{self.prefix}.method": str(method)}
+        if status is not None:
+            attributes['http.status_code'] = status
+        span = self.tracer.start_span(f"{self.prefix}.request", attributes=attributes, start_time=end - int(seconds * 1e9))
+        if error is not None:
+            span.record_exception(error)
+        span.end(end_time=end)
+# ----------
@@ -0,0 +1,190 @@
+#
+# ZohoDB.py
+#
+# @oddmario
+# Mario
+# mariolatif741@yandex.com
+#
+# License: GNU GPLv3
+
+# replica.py
+# A local SQLite mirror of Zoho Sheets tables, used by ZohoDB.sync() and select(consistency="local")
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from pathlib import Path
+
+from .criteria import criteria_to_sql, register_sql_functions
+
+def _cell(column):
+    # Criteria can't contain a double quote in a column name, so only the SQL quote needs escaping
+    column = str(column).replace("'", "''")
+    return f"json_extract(data, '$.\"{column}\"')"
+
+class ZohoReplica:
+    def __init__(self, path, timeout = 30):
+        self.path = path
+        self.timeout = timeout
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.__local = threading.local()
+        with self.__transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS rows (tbl TEXT NOT NULL, workbook_id TEXT NOT NULL, position INTEGER NOT NULL, row_index INTEGER NOT NULL, data TEXT NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS rows_location ON rows (tbl, workbook_id, row_index)")
+            # What was mirrored from each workbook: last_row is the last used row of the worksheet (row 1 holds the headers)
+            db.execute("CREATE TABLE IF NOT EXISTS synced (tbl TEXT NOT NULL, workbook_id TEXT NOT NULL, position INTEGER NOT NULL, last_row INTEGER NOT NULL, stale INTEGER NOT NULL DEFAULT 0, synced_at REAL NOT NULL, PRIMARY KEY (tbl, workbook_id))")
+
+    def __connection(self):
+        db = getattr(self.__local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            # The criteria SQL and the column indexes are built on these functions
+            register_sql_functions(db)
+            self.__local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        db = self.__connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def index(self, table, columns):
+        with self.__transaction() as db:
+            for column in columns:
+                name = hashlib.md5(f"{table}\0{column}".encode('utf-8')).hexdigest()
+                # Text & numeric comparisons use different expressions, so each gets its own index
+                db.execute(f"CREATE INDEX IF NOT EXISTS text_{name} ON rows (tbl, zohodb_text({_cell(column)}))")
+                db.execute(f"CREATE INDEX IF NOT EXISTS number_{name} ON rows (tbl, zohodb_number({_cell(column)}))")
+
+    def state(self, table):
+        db = self.__connection()
+        rows = db.execute("SELECT workbook_id, position, last_row, stale, synced_at FROM synced WHERE tbl = ?", (str(table),)).fetchall()
+        return {workbook: {"position": position, "last_row": last_row, "stale": bool(stale), "synced_at": synced_at} for workbook, position, last_row, stale, synced_at in rows}
+
+    def synced(self, table):
+        return len(self.state(table)) > 0
+
+    def __record_state(self, db, table, workbook_id, position, last_row):
+        db.execute("INSERT INTO synced (tbl, workbook_id, position, last_row, stale, synced_at) VALUES (?, ?, ?, ?, 0, ?) ON CONFLICT (tbl, workbook_id) DO UPDATE SET position = excluded.position, last_row = excluded.last_row, stale = 0, synced_at = excluded.synced_at", (table, workbook_id, position, last_row, time.time()))
+
+    def __add_rows(self, db, table, workbook_id, position, records):
+        rows = []
+        for record in records:
+            data = {key: value for key, value in record.items() if key != "row_index" and key != "workbook_id"}
+            rows.append((table, workbook_id, position, int(record['row_index']), json.dumps(data)))
+        db.executemany("INSERT INTO rows (tbl, workbook_id, position, row_index, data) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def replace(self, table, workbook_id, position, records, last_row):
+        table = str(table)
+        with self.__transaction() as db:
+            db.execute("DELETE FROM rows WHERE tbl = ? AND workbook_id = ?", (table, workbook_id))
+            self.__add_rows(db, table, workbook_id, position, records)
+            self.__record_state(db, table, workbook_id, position, last_row)
+
+    def append(self, table, workbook_id, position, records, last_row):
+        table = str(table)
+        with self.__transaction() as db:
+            self.__add_rows(db, table, workbook_id, position, records)
+            self.__record_state(db, table, workbook_id, position, last_row)
+
+    def forget(self, table, workbook_ids):
+        # Workbooks that aren't part of the database anymore
+        with self.__transaction() as db:
+            for workbook_id in workbook_ids:
+                db.execute("DELETE FROM rows WHERE tbl = ? AND workbook_id = ?", (str(table), workbook_id))
+                db.execute("DELETE FROM synced WHERE tbl = ? AND workbook_id = ?", (str(table), workbook_id))
+
+    def mark_stale(self, table, workbook_ids):
+        # The next sync() fetches these workbooks again from scratch
+        with self.__transaction() as db:
+            for workbook_id in workbook_ids:
+                db.execute("UPDATE synced SET stale = 1 WHERE tbl = ? AND workbook_id = ?", (str(table), workbook_id))
+
+    def select(self, table, criteria, columns = None, workbook_ids = None):
+        # Returns [(workbook_id, records)] in the same order select() would
+        where, params = criteria_to_sql(criteria, _cell)
+        sql = f"SELECT workbook_id, row_index, data FROM rows WHERE tbl = ? AND {where}"
+        params = [str(table)] + params
+        if workbook_ids is not None:
+            sql += f" AND workbook_id IN ({', '.join('?' * len(workbook_ids))})"
+            params += list(workbook_ids)
+        parts = []
+        for workbook_id, row_index, data in self.__connection().execute(sql + " ORDER BY position, row_index", params):
+            record = json.loads(data)
+            if columns:
+                record = {column: record[column] for column in columns if column in record}
+            record['row_index'] = row_index
+            if len(parts) == 0 or parts[-1][0] != workbook_id:
+                parts.append((workbook_id, []))
+            parts[-1][1].append(record)
+        return parts
+
+    def rows(self, table, workbook_id, first_row_index, last_row_index):
+        # The mirrored records of one workbook between two row indexes, in row order
+        records = []
+        for row_index, data in self.__connection().execute("SELECT row_index, data FROM rows WHERE tbl = ? AND workbook_id = ? AND row_index BETWEEN ? AND ? ORDER BY row_index", (str(table), workbook_id, int(first_row_index), int(last_row_index))):
+            record = json.loads(data)
+            record['row_index'] = row_index
+            records.append(record)
+        return records
+
+    def inserted(self, table, workbook_id, rows):
+        # Zoho appends new rows right after the last used row
+        table = str(table)
+        with self.__transaction() as db:
+            synced = db.execute("SELECT position, last_row FROM synced WHERE tbl = ? AND workbook_id = ?", (table, workbook_id)).fetchone()
+            if synced is None:
+                return False
+            position, last_row = synced
+            last_row = max(last_row, 1)
+            self.__add_rows(db, table, workbook_id, position, [dict(row, row_index=last_row + 1 + offset) for offset, row in enumerate(rows)])
+            db.execute("UPDATE synced SET last_row = ? WHERE tbl = ? AND workbook_id = ?", (last_row + len(rows), table, workbook_id))
+        return True
+
+    def updated(self, table, workbook_ids, criteria, data):
+        table = str(table)
+        where, params = criteria_to_sql(criteria, _cell)
+        updated = 0
+        with self.__transaction() as db:
+            for workbook_id in workbook_ids:
+                matches = db.execute(f"SELECT rowid, data FROM rows WHERE tbl = ? AND workbook_id = ? AND {where}", [table, workbook_id] + params).fetchall()
+                db.executemany("UPDATE rows SET data = ? WHERE rowid = ?", [(json.dumps(dict(json.loads(row_data), **data)), rowid) for rowid, row_data in matches])
+                updated += len(matches)
+        return updated
+
+    def __remove(self, db, table, workbook_id, row_indexes):
+        # The rows below a deleted row move up by one, like they do in the worksheet
+        for row_index in sorted(set(row_indexes), reverse=True):
+            db.execute("DELETE FROM rows WHERE tbl = ? AND workbook_id = ? AND row_index = ?", (table, workbook_id, row_index))
+            db.execute("UPDATE rows SET row_index = row_index - 1 WHERE tbl = ? AND workbook_id = ? AND row_index > ?", (table, workbook_id, row_index))
+        db.execute("UPDATE synced SET last_row = max(1, last_row - ?) WHERE tbl = ? AND workbook_id = ?", (len(set(row_indexes)), table, workbook_id))
+
+    def deleted(self, table, workbook_id, criteria = None, row_indexes = None):
+        # Returns how many mirrored rows were deleted
+        table = str(table)
+        with self.__transaction() as db:
+            if row_indexes is None:
+                where, params = criteria_to_sql(criteria, _cell)
+                row_indexes = [row[0] for row in db.execute(f"SELECT row_index FROM rows WHERE tbl = ? AND workbook_id = ? AND {where}", [table, workbook_id] + params)]
+            else:
+                existing = set(row[0] for row in db.execute("SELECT row_index FROM rows WHERE tbl = ? AND workbook_id = ?", (table, workbook_id)))
+                row_indexes = [row_index for row_index in row_indexes if row_index in existing]
+            self.__remove(db, table, workbook_id, row_indexes)
+        return len(set(row_indexes))
+
+    def stats(self, table = None):
+        db = self.__connection()
+        if table is None:
+            return {tbl: count for tbl, count in db.execute("SELECT tbl, count(*) FROM rows GROUP BY tbl")}
+        return {workbook_id: count for workbook_id, count in db.execute("SELECT workbook_id, count(*) FROM rows WHERE tbl = ? GROUP BY workbook_id", (str(table),))}
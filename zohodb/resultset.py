@@ -0,0 +1,183 @@
+#
+# ZohoDB.py
+#
+# @oddmario
+# Mario
+# mariolatif741@yandex.com
+#
+# License: GNU GPLv3
+
+# resultset.py
+# A read-only, column oriented alternative to the list of dicts returned by select()
+
+import array
+import bisect
+import operator
+from collections.abc import Mapping
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Stands in for the cells a record didn't have
+_MISSING = object()
+
+def _typed(values):
+    # Homogeneous int/float columns are kept in a typed array (8 bytes per value instead of a pointer to an object)
+    kinds = set(map(type, values))
+    try:
+        if kinds == {int}:
+            return array.array("q", values)
+        if kinds == {float} or kinds == {int, float}:
+            return array.array("d", values)
+    except OverflowError:
+        pass
+    return values
+
+class Row(Mapping):
+    # A lazy view of one row of a ResultSet, it behaves like the dict select() usually returns
+    __slots__ = ("_result", "_index")
+
+    def __init__(self, result, index):
+        self._result = result
+        self._index = index
+
+    def __getitem__(self, key):
+        if key == "workbook_id":
+            return self._result.workbook_id(self._index)
+        values = self._result._values.get(key)
+        if values is None:
+            raise KeyError(key)
+        value = values[self._index]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        index = self._index
+        for column in self._result.columns:
+            if self._result._values[column][index] is not _MISSING:
+                yield column
+        yield "workbook_id"
+
+    def __len__(self):
+        return sum(1 for column in self)
+
+    def to_dict(self):
+        return {column: self[column] for column in self}
+
+    def __repr__(self):
+        return f"Row({self.to_dict()!r})"
+
+class ResultSet:
+    def __init__(self, parts = ()):
+        # parts is a sequence of (workbook_id, records) pairs, in the order the rows should appear in
+        self.failures = {}
+        self.columns = []
+        self._values = {}
+        # Consecutive rows come from the same workbook, so workbook IDs are stored once per run: (run end, workbook_id)
+        self._runs = []
+        self._ends = []
+        length = 0
+        lists = {}
+        # Columns some records didn't have, they stay plain lists
+        sparse = set()
+        for workbook_id, records in parts:
+            if len(records) == 0:
+                continue
+            columns, cells = _extract(records)
+            for column in columns:
+                if not column in lists:
+                    self.columns.append(column)
+                    lists[column] = [_MISSING] * length
+                    if length > 0:
+                        sparse.add(column)
+            if cells is not None:
+                for column, values in lists.items():
+                    if column in cells and len(values) == 0:
+                        lists[column] = cells[column]
+                    elif column in cells:
+                        values.extend(cells[column])
+                    else:
+                        values.extend([_MISSING] * len(records))
+                        sparse.add(column)
+            else:
+                sparse.update(lists)
+                for column, values in lists.items():
+                    values.extend([record.get(column, _MISSING) for record in records])
+            length += len(records)
+            self._runs.append((length, workbook_id))
+            self._ends.append(length)
+        self._length = length
+        for column, values in lists.items():
+            self._values[column] = values if column in sparse else _typed(values)
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Row(self, i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("ResultSet index out of range")
+        return Row(self, index)
+
+    def __iter__(self):
+        for index in range(self._length):
+            yield Row(self, index)
+
+    def workbook_id(self, index):
+        return self._runs[bisect.bisect_right(self._ends, index)][1]
+
+    def runs(self):
+        # [(start, end, workbook_id)] where rows[start:end] came from workbook_id
+        start = 0
+        runs = []
+        for end, workbook_id in self._runs:
+            runs.append((start, end, workbook_id))
+            start = end
+        return runs
+
+    def column(self, name):
+        if name == "workbook_id":
+            return [workbook_id for start, end, workbook_id in self.runs() for _ in range(end - start)]
+        if not name in self._values:
+            raise KeyError(name)
+        values = self._values[name]
+        if isinstance(values, array.array):
+            return values
+        return [None if value is _MISSING else value for value in values]
+
+    def to_numpy(self, name):
+        if numpy is None:
+            raise ImportError("NumPy is required for ResultSet.to_numpy()")
+        values = self._values.get(name) if name != "workbook_id" else None
+        if isinstance(values, array.array):
+            # Shares the memory of the typed array, no copy is made
+            return numpy.frombuffer(values, dtype=numpy.int64 if values.typecode == "q" else numpy.float64)
+        return numpy.array(self.column(name), dtype=object)
+
+    def to_dicts(self):
+        return [row.to_dict() for row in self]
+
+    def __repr__(self):
+        return f"ResultSet({self._length} rows, columns={self.columns!r})"
+
+def _extract(records):
+    # The records of a single response almost always share their keys: pull each column out in one pass
+    first = records[0]
+    if set(map(len, records)) == {len(first)}:
+        try:
+            return list(first), {column: list(map(operator.itemgetter(column), records)) for column in first}
+        except KeyError:
+            pass
+    # Otherwise return every column seen and let the caller fill the gaps
+    columns = {}
+    for record in records:
+        columns.update(dict.fromkeys(record))
+    return list(columns), None
@@ -14,8 +14,27 @@ import urllib.parse
 import hashlib
 import calendar
 import time
+import asyncio
+import threading
+import contextlib
+import copy
+import sqlite3
+import collections
+import collections.abc
+import random
+import bisect
+import atexit
+import decimal
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from .criteria import InvalidCriteria, CompiledCriteria, compile_criteria, parse_criteria, normalize_criteria, equality_value
+from .metrics import ZohoMetrics, ZohoMetricsListener, OpenTelemetrySpans
+from .resultset import ResultSet, Row
+from .replica import ZohoReplica
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 ZOHO_OAUTH_API_BASE = "https://accounts.zoho.com/oauth/v2"
 ZOHO_SHEETS_API_BASE = "https://sheet.zoho.com/api/v2"
@@ -52,437 +71,3594 @@ class InvalidCacheTable(Exception):
 class CorruptedCacheTable(Exception):
     """Thrown when a cache table contains malformed JSON data"""
     pass
+
+class InvalidSchema(Exception):
+    """Thrown when a table or a column doesn't exist in any of the workbooks"""
+    pass
+
+class WorkbookRequestsFailed(UnexpectedResponse):
+    """Thrown when the request to one or more workbooks failed (see .failures and .partial)"""
+    def __init__(self, failures, partial = None):
+        self.failures = failures
+        self.partial = partial
+        super().__init__("; ".join(f"{workbook}: {message}" for workbook, message in failures.items()))
 # ----------
 
-def ZohoWorkbookRequest(workbook_id, data):
+# ----- Request building & response parsing shared by ZohoDB and AsyncZohoDB -----
+def _workbook_request(workbook_id, data):
     if not "access_token" in data:
         raise MissingData("Missing the access token used for authentication")
     token = str(data['access_token']).strip()
-    del data['access_token']
+    payload = {k: v for k, v in data.items() if k != "access_token"}
+    return f"{ZOHO_SHEETS_API_BASE}/{workbook_id}", payload, {
+        "Authorization": f"Bearer {token}"
+    }
+
+def _parse_json(req, what = "Zoho"):
     try:
-        return httpx.post(f"{ZOHO_SHEETS_API_BASE}/{workbook_id}", data=data, headers={
-            "Authorization": f"Bearer {token}"
-        })
+        return json.loads(req.text)
+    except json.decoder.JSONDecodeError as e:
+        raise InvalidJsonResponse(f"Failed to parse the {what} response: {e}")
+
+def _raise_on_failure(res):
+    if res['status'] == "failure":
+        raise UnexpectedResponse(res['error_message'])
+    return res
+
+def _fanout_options(kwargs, workbook_timeout, deadline):
+    workbook_timeout = kwargs.get("workbook_timeout", workbook_timeout)
+    deadline = kwargs.get("deadline", deadline)
+    return workbook_timeout, deadline, bool(kwargs.get("allow_partial", False))
+
+def _split_outcomes(workbookids, outcomes):
+    # outcomes maps a workbook ID to its parsed response or to the exception its request raised
+    succeeded = []
+    failures = {}
+    for workbook in workbookids:
+        outcome = outcomes.get(workbook)
+        if outcome is None:
+            failures[workbook] = "The query deadline was exceeded"
+        elif isinstance(outcome, BaseException):
+            failures[workbook] = str(outcome) or type(outcome).__name__
+        elif outcome.get('status') == "failure":
+            failures[workbook] = outcome.get('error_message', "Unknown error")
+        else:
+            succeeded.append((workbook, outcome))
+    return succeeded, failures
+
+def _check_failures(failures, allow_partial, partial):
+    if len(failures) > 0 and not allow_partial:
+        raise WorkbookRequestsFailed(failures, partial)
+    return partial
+
+class RecordList(list):
+    # A list of records which also reports the workbooks that couldn't be queried
+    def __init__(self, records = ()):
+        super().__init__(records)
+        self.failures = {}
+
+_IDEMPOTENT_METHODS = ("worksheet.records.fetch", "worksheet.records.update", "worksheet.usedarea")
+
+def _response_body(req):
+    # Throttling & server errors often don't come with a JSON body
+    try:
+        return json.loads(req.text)
+    except json.decoder.JSONDecodeError:
+        return None
+
+def _observe_request(metrics, workbook_id, data, start, req = None, error = None):
+    if req is None:
+        return metrics.request(workbook_id, data.get("method"), time.perf_counter() - start, error=error)
+    metrics.request(workbook_id, data.get("method"), time.perf_counter() - start, len(req.request.content), len(req.content), req.status_code)
+
+class _RequestAttempts:
+    # The per-request side of a workbook request: the metrics of each attempt & whether to retry it
+    def __init__(self, metrics, retry_policy, workbook_id, data):
+        self.metrics = metrics
+        self.retry_policy = retry_policy
+        self.workbook_id = workbook_id
+        self.data = data
+        self.attempt = 0
+        self.start = None
+
+    def limited(self, waited):
+        if self.metrics is not None and waited > 0:
+            self.metrics.phase("rate_limit", waited)
+
+    def sending(self):
+        self.attempt += 1
+        if self.metrics is not None:
+            self.start = time.perf_counter()
+
+    def failed(self, error):
+        # The delay before the next attempt, or None when the error is final
+        if self.metrics is not None:
+            _observe_request(self.metrics, self.workbook_id, self.data, self.start, error=error)
+        if not self.retry_policy.allows(self.data, self.attempt):
+            self.retry_policy.record(False)
+            return None
+        return self.__retry(self.retry_policy.delay(self.attempt))
+
+    def answered(self, req):
+        # The parsed response and the delay before the next attempt (None once the response is final)
+        if self.metrics is not None:
+            _observe_request(self.metrics, self.workbook_id, self.data, self.start, req)
+            start = time.perf_counter()
+        res = _response_body(req)
+        if self.metrics is not None:
+            self.metrics.phase("parse", time.perf_counter() - start)
+        if self.retry_policy.retryable(req, res):
+            if self.retry_policy.allows(self.data, self.attempt):
+                return None, self.__retry(self.retry_policy.delay(self.attempt, req))
+            self.retry_policy.record(False)
+        if res is None:
+            return _parse_json(req), None
+        return res, None
+
+    def __retry(self, delay):
+        self.retry_policy.record(True)
+        if self.metrics is not None:
+            self.metrics.retry(self.workbook_id)
+        return delay
+
+def _cache_root(cache_root):
+    # ZOHODB_CACHE_ROOT lets every process of a deployment share one cache directory without code changes
+    if cache_root is None:
+        cache_root = os.environ.get("ZOHODB_CACHE_ROOT", "./.zohodb")
+    return str(cache_root)
+
+def _require(kwargs, requireds):
+    for required in requireds:
+        if not required in kwargs:
+            raise MissingData(f"Missing the required argument '{required}'")
+
+def _workbook_id_arg(kwargs):
+    if not "workbook_id" in kwargs:
+        return ""
+    return str(kwargs['workbook_id']).strip()
+
+def _workbook_list(res, workbooks):
+    _raise_on_failure(res)
+    names = set(workbooks)
+    workbookids = [workbook['resource_id'] for workbook in res['workbooks'] if workbook['workbook_name'] in names]
+    if not workbookids or workbookids == []:
+        raise UnexpectedResponse("Unable to find any workbooks with the name(s) specified")
+    return workbookids
+
+def _workbook_list_request(token):
+    return f"{ZOHO_SHEETS_API_BASE}/workbooks?method=workbook.list", {
+        "Authorization": f"Bearer {token}"
+    }
+
+def _fetched_workbooks(metadata, req, workbooks):
+    workbookids = _workbook_list(_parse_json(req), workbooks)
+    metadata.set_workbookids(workbookids)
+    return workbookids
+
+def _worksheets_payload(token):
+    return {
+        "access_token": token,
+        "method": "worksheet.list"
+    }
+
+def _worksheet_names(res):
+    return [worksheet['worksheet_name'] for worksheet in _raise_on_failure(res).get('worksheet_names', [])]
+
+def _headers_payload(token, table):
+    # The keys of the first record are the column headers of the worksheet
+    return _select_page_payload(token, table, "", [], 1, 1)
+
+def _merge_headers(headers, res):
+    records = _raise_on_failure(res).get('records', [])
+    for column in (records[0] if records else []):
+        if column != "row_index" and not column in headers:
+            headers.append(column)
+    return headers
+
+def _fetched_worksheets(metadata, succeeded, failures):
+    _check_failures(failures, False, None)
+    worksheets = {workbook: _worksheet_names(res) for workbook, res in succeeded}
+    metadata.set_worksheets(worksheets)
+    return worksheets
+
+def _header_workbooks(worksheets, table):
+    # The workbooks that have the table, the others have no headers to report
+    return [workbook for workbook, names in worksheets.items() if table in names]
+
+def _fetched_headers(metadata, table, succeeded, failures):
+    _check_failures(failures, False, None)
+    headers = []
+    for workbook, res in succeeded:
+        _merge_headers(headers, res)
+    metadata.set_headers(table, headers)
+    return headers
+
+def _warmup_requests(worksheets, tables):
+    # The tables warmup() covers and the (table, workbook) header requests it sends
+    if tables is None:
+        tables = _tables(worksheets)
+    return [str(table) for table in tables], [(str(table), workbook) for table in tables for workbook in _header_workbooks(worksheets, str(table))]
+
+def _warmed_headers(metadata, tables, requests, responses):
+    headers = {table: [] for table in tables}
+    for (table, workbook), res in zip(requests, responses):
+        _merge_headers(headers[table], res)
+    for table, columns in headers.items():
+        metadata.set_headers(table, columns)
+    return headers
+
+def _tables(worksheets):
+    return sorted(set(name for names in worksheets.values() for name in names))
+
+def _check_schema(table, worksheets, headers, columns):
+    if not table in _tables(worksheets):
+        raise InvalidSchema(f"None of the workbooks has a worksheet named '{table}'")
+    # A worksheet without any records yet has no known headers
+    unknown = [column for column in columns if len(headers) > 0 and not column in headers]
+    if len(unknown) > 0:
+        raise InvalidSchema(f"Unknown column(s) in '{table}': {', '.join(map(str, unknown))}")
+
+def _data_columns(data):
+    if isinstance(data, dict):
+        return list(data)
+    return list(dict.fromkeys(column for row in data for column in row))
+
+def _maybe_vanished(outcomes):
+    # Workbooks answering with an error other than being full may have been deleted or renamed
+    return [workbook for workbook, outcome in outcomes.items() if isinstance(outcome, dict) and outcome.get('status') == "failure" and not _workbook_is_full(outcome)]
+
+def _vanished_workbooks(workbookids, current):
+    return [workbook for workbook in workbookids if not workbook in current]
+
+def _remaining(deadline, started):
+    # What's left of a deadline (in seconds) that started counting at started (time.monotonic())
+    if deadline is None:
+        return None
+    return max(0.0, deadline - (time.monotonic() - started))
+
+def _drop_vanished(outcomes, vanished, workbookids, known, current):
+    # Forgets the outcomes of the workbooks that aren't part of the database anymore.
+    # Returns the workbooks the call now covers and the ones (that replaced them) still to be sent the request
+    for workbook in vanished:
+        del outcomes[workbook]
+    if known is not None and set(workbookids) == set(known):
+        # The call was meant for every workbook, so the ones that replaced them get it too
+        return current, [workbook for workbook in current if not workbook in workbookids]
+    return [workbook for workbook in workbookids if not workbook in vanished], []
+
+class _Fanout:
+    # The per-call side of a fan-out: the outcome of each workbook, then what's left once vanished workbooks are dropped
+    def __init__(self, metadata, workbookids, deadline):
+        self.metadata = metadata
+        self.workbookids = workbookids
+        self.deadline = deadline
+        self.known = metadata.workbookids(fresh=False)
+        self.started = time.monotonic()
+        self.outcomes = {}
+
+    def failed(self):
+        return _maybe_vanished(self.outcomes)
+
+    def replacements(self, vanished):
+        # The workbooks that replaced the vanished ones & what's left of the deadline for them:
+        # the whole call stays within the deadline
+        self.workbookids, replacements = _drop_vanished(self.outcomes, vanished, self.workbookids, self.known, self.metadata.workbookids(fresh=False))
+        return replacements, _remaining(self.deadline, self.started)
+
+    def result(self):
+        return _split_outcomes(self.workbookids, self.outcomes)
+
+def _select_query(kwargs):
+    _require(kwargs, ["table", "criteria"])
+    if not "columns" in kwargs:
+        columns = []
+    else:
+        columns = kwargs['columns']
+    if not isinstance(columns, list):
+        raise InvalidType("columns must be a list")
+    return str(kwargs['table']), str(kwargs['criteria']), columns
+
+def _select_payload(token, table, criteria, columns):
+    return {
+        "access_token": token,
+        "method": "worksheet.records.fetch",
+        "worksheet_name": table,
+        "criteria": criteria,
+        "column_names": ",".join(columns)
+    }
+
+def _select_format(kwargs):
+    as_ = kwargs.get("as_", "records")
+    if not as_ in ("records", "columns"):
+        raise InvalidType("as_ must be either \"records\" or \"columns\"")
+    return as_
+
+def _select_result(succeeded, as_):
+    if as_ == "columns":
+        for workbook, res in succeeded:
+            _raise_on_failure(res)
+        return ResultSet([(workbook, res['records']) for workbook, res in succeeded])
+    returned = RecordList()
+    for workbook, res in succeeded:
+        returned.extend(_select_records(workbook, res))
+    return returned
+
+def _select_records(workbook_id, res):
+    _raise_on_failure(res)
+    # The records were freshly parsed from this response, so tag them in place instead of copying
+    records = res['records']
+    for record in records:
+        record['workbook_id'] = workbook_id
+    return records
+
+def _select_consistency(kwargs):
+    consistency = kwargs.get("consistency", "remote")
+    if not consistency in ("remote", "local"):
+        raise InvalidType("consistency must be either \"remote\" or \"local\"")
+    return consistency
+
+def _local_select(replica, table, criteria, columns, as_):
+    if replica is None or not replica.synced(table):
+        raise MissingData(f"The {table} table has no local replica yet, call sync() first")
+    parts = replica.select(table, criteria, columns)
+    if as_ == "columns":
+        return ResultSet(parts)
+    returned = RecordList()
+    for workbook, records in parts:
+        for record in records:
+            record['workbook_id'] = workbook
+        returned.extend(records)
+    return returned
+
+class _Select:
+    # The per-call side of select(): the answers that don't need Zoho (the replica's, the query cache's),
+    # then the result of the workbooks' answers
+    def __init__(self, db, kwargs):
+        self.db = db
+        self.table, self.criteria, self.columns = _select_query(kwargs)
+        db._check_criteria(self.criteria)
+        self.as_ = _select_format(kwargs)
+        self.local = _select_consistency(kwargs) == "local"
+        self.use_cache = db.query_cache is not None and kwargs.get("use_cache", True)
+        self.workbook_timeout, self.deadline, self.allow_partial = _fanout_options(kwargs, db.workbook_timeout, db.deadline)
+
+    def local_result(self):
+        return self.__indexed(_local_select(self.db.replica, self.table, self.criteria, self.columns, self.as_))
+
+    def cached(self):
+        if not self.use_cache:
+            return None
+        self.cache_key = self.db.query_cache.key(self.table, self.criteria, self.columns, self.as_)
+        cached = self.db.query_cache.get(self.cache_key)
+        if cached is None:
+            self.generation = self.db.query_cache.generation(self.table)
+        return cached
+
+    def workbooks(self, workbookids):
+        return _shard_targets(self.db.sharding, self.table, self.criteria, workbookids)
+
+    def payload(self, token):
+        return _select_payload(token, self.table, self.criteria, self.columns)
+
+    def result(self, succeeded, failures):
+        returned = _select_result(succeeded, self.as_)
+        returned.failures = failures
+        self.__indexed(returned)
+        _check_failures(failures, self.allow_partial, returned)
+        if self.use_cache and len(failures) == 0:
+            self.db.query_cache.set(self.cache_key, returned, self.generation)
+        return returned
+
+    def __indexed(self, returned):
+        if self.db.row_index is not None:
+            self.db.row_index.records(self.table, returned)
+        return returned
+
+def _select_iter_query(kwargs):
+    table, criteria, columns = _select_query(kwargs)
+    page_size = int(kwargs.get("page_size", 1000))
+    offset = int(kwargs.get("offset", 0))
+    limit = kwargs.get("limit")
+    if limit is not None:
+        limit = int(limit)
+    if page_size <= 0 or offset < 0 or (limit is not None and limit < 0):
+        raise InvalidType("page_size must be positive, offset and limit can't be negative")
+    return table, criteria, columns, page_size, offset, limit
+
+def _select_page_payload(token, table, criteria, columns, start, count):
+    payload = _select_payload(token, table, criteria, columns)
+    payload['records_start_index'] = start
+    payload['count'] = count
+    return payload
+
+class _SelectPaging:
+    def __init__(self, page_size, offset, limit):
+        self.page_size = page_size
+        self.skip = offset
+        self.remaining = limit
+
+    def done(self):
+        return self.remaining is not None and self.remaining <= 0
+
+    def count(self):
+        # Don't download more than the limit still needs (plus what the offset is going to skip)
+        if self.remaining is None:
+            return self.page_size
+        return max(1, min(self.page_size, self.remaining + self.skip))
+
+    def take(self, records):
+        if self.skip > 0:
+            skipped = min(self.skip, len(records))
+            self.skip -= skipped
+            records = records[skipped:]
+        if self.remaining is not None:
+            records = records[:self.remaining]
+            self.remaining -= len(records)
+        return records
+
+class _SelectPages:
+    # The per-call side of select_iter(): the next page of each workbook, then the records of each page to yield
+    def __init__(self, db, kwargs):
+        self.db = db
+        self.table, self.criteria, self.columns, page_size, offset, limit = _select_iter_query(kwargs)
+        db._check_criteria(self.criteria)
+        self.paging = _SelectPaging(page_size, offset, limit)
+        self.workbook = None
+
+    def workbooks(self, workbookids):
+        return _shard_targets(self.db.sharding, self.table, self.criteria, workbookids)
+
+    def more(self, workbook):
+        # Whether the workbook has another page to fetch, moving on to a workbook starts at its first record
+        if workbook != self.workbook:
+            self.workbook = workbook
+            self.start = 1
+            self.exhausted = False
+        return not self.exhausted and not self.paging.done()
+
+    def payload(self, token):
+        self.count = self.paging.count()
+        return _select_page_payload(token, self.table, self.criteria, self.columns, self.start, self.count)
+
+    def page(self, res):
+        records = _select_records(self.workbook, res)
+        if self.db.row_index is not None:
+            self.db.row_index.records(self.table, records)
+        self.exhausted = len(records) < self.count
+        self.start += len(records)
+        return self.paging.take(records)
+
+def _insert_query(kwargs):
+    _require(kwargs, ["table", "data"])
+    data = kwargs['data']
+    if not isinstance(data, list):
+        raise InvalidType("data must be a list")
+    return str(kwargs['table']), data
+
+def _insert_payload(token, table, data):
+    return {
+        "access_token": token,
+        "method": "worksheet.records.add",
+        "worksheet_name": table,
+        "json_data": json.dumps(data)
+    }
+
+def _insert_many_query(kwargs):
+    _require(kwargs, ["table", "data"])
+    data = kwargs['data']
+    if isinstance(data, (dict, str, bytes)) or not hasattr(data, "__iter__"):
+        raise InvalidType("data must be an iterable of dictionaries")
+    chunk_rows = int(kwargs.get("chunk_rows", 1000))
+    chunk_bytes = int(kwargs.get("chunk_bytes", 1000000))
+    if chunk_rows <= 0 or chunk_bytes <= 0:
+        raise InvalidType("chunk_rows and chunk_bytes must be positive")
+    return str(kwargs['table']), data, chunk_rows, chunk_bytes, int(kwargs.get("retries", 2))
+
+def _chunks(data, chunk_rows, chunk_bytes):
+    # Lazily splits data into chunks of at most chunk_rows rows and (roughly) chunk_bytes of JSON
+    rows = []
+    size = 2
+    index = 0
+    offset = 0
+    for row in data:
+        if not isinstance(row, dict):
+            raise InvalidType("data must be an iterable of dictionaries")
+        row_size = len(json.dumps(row)) + 1
+        if rows and (len(rows) >= chunk_rows or size + row_size > chunk_bytes):
+            yield InsertChunkResult(index, offset, rows)
+            index += 1
+            offset += len(rows)
+            rows = []
+            size = 2
+        rows.append(row)
+        size += row_size
+    if rows:
+        yield InsertChunkResult(index, offset, rows)
+
+def _chunk_retry_delay(attempt):
+    return min(0.5 * (2 ** (attempt - 1)), 5)
+
+def _chunk_workbooks(chunk, workbookids):
+    # Every chunk starts at a different workbook so concurrent chunks spread across workbooks
+    start = chunk.index % len(workbookids)
+    return workbookids[start:] + workbookids[:start]
+
+def _chunk_attempted(chunk, retries, error):
+    # Records how the chunk's last attempt went, returns the delay before the next one or None when there's none.
+    # Adding rows isn't idempotent: a retry only sends the rows the earlier attempts didn't place (chunk.result)
+    chunk.error = error if error is not None else _unplaced_error(chunk.result)
+    if chunk.error is None or chunk.attempts > retries:
+        return None
+    return _chunk_retry_delay(chunk.attempts)
+
+def _workbook_is_full(res):
+    return "error_code" in res and (res['error_code'] == 2870 or res['error_code'] == 2872)
+
+def _marked_full(cache, workbook):
+    try:
+        cached_ts = cache.get("full_workbooks", str(workbook))
+    except InvalidCacheTable:
+        return False
+    if cached_ts == None:
+        return False
+    if (cached_ts + 3600) <= calendar.timegm(time.gmtime()):
+        cache.delete("full_workbooks", str(workbook))
+        return False
+    return True
+
+def _mark_full(cache, workbook):
+    cache.set("full_workbooks", str(workbook), calendar.timegm(time.gmtime()))
+
+def _unmark_full(cache, workbooks):
+    for workbook in workbooks:
+        try:
+            cache.delete("full_workbooks", str(workbook))
+        except InvalidCacheTable:
+            pass
+
+def _recheck_full(rechecked, workbook, res):
+    # A full answer may only mean the tracked capacity was off: the first one per workbook reads its used area again
+    # so what fits can be sent, a second one marks it full
+    if not _workbook_is_full(res) or workbook in rechecked:
+        return False
+    rechecked.add(workbook)
+    return True
+
+def _usedarea_payload(token, table):
+    return {
+        "access_token": token,
+        "method": "worksheet.usedarea",
+        "worksheet_name": table
+    }
+
+def _used_area(res):
+    # (last used row, last used column) of a worksheet, or None if Zoho didn't tell us
+    if res.get('status') == "failure":
+        return None
+    try:
+        return int(res['last_row']), int(res['last_column'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _sync_plan(previous, used_area, full, check_rows):
+    # How to bring a workbook's mirror up to date: ("replace"|"append"|"unchanged", first record index to fetch).
+    # Rows are only ever appended at the bottom, so an append fetches the records after the ones already mirrored,
+    # starting check_rows earlier to compare the last mirrored rows with what the worksheet holds now
+    last_row = used_area[0] if used_area is not None else None
+    if full or previous is None or previous['stale'] or last_row is None or last_row < previous['last_row']:
+        return "replace", 1
+    plan = "unchanged" if last_row == previous['last_row'] else "append"
+    return plan, max(1, previous['last_row'] - int(check_rows))
+
+def _mirror_cells(record):
+    # What a record holds, leaving out the differences between a mirrored insert and the same row fetched from Zoho
+    cells = {str(key): str(value) for key, value in record.items() if key != "workbook_id" and value is not None and str(value) != ""}
+    return sorted(cells.items())
+
+def _sync_tail(previous, records, mirrored):
+    # The records an append/unchanged plan fetched beyond the mirror, or None when the rows fetched again don't match
+    # the mirror anymore (deleted rows replaced by as many appended ones, rows edited in place)
+    known = [record for record in records if int(record['row_index']) <= previous['last_row']]
+    if [_mirror_cells(record) for record in known] != [_mirror_cells(record) for record in mirrored]:
+        return None
+    return records[len(known):]
+
+class _ReplicaSync:
+    # The per-call side of sync(): what the replica held before, then the sync of each workbook that answered
+    def __init__(self, replica, capacity, table, indexes, workbookids):
+        self.replica = replica
+        self.capacity = capacity
+        self.table = table
+        self.workbookids = workbookids
+        if indexes:
+            replica.index(table, indexes)
+        self.previous = replica.state(table)
+        replica.forget(table, [workbook for workbook in self.previous if not workbook in workbookids])
+
+    def workbooks(self, succeeded, failures, allow_partial, full, check_rows):
+        _check_failures(failures, allow_partial, None)
+        self.replica.mark_stale(self.table, list(failures))
+        syncs = []
+        for workbook, res in succeeded:
+            used_area = _used_area(res)
+            self.capacity.refreshed(workbook, self.table, used_area)
+            syncs.append(_WorkbookSync(self.replica, self.table, workbook, self.workbookids.index(workbook), self.previous.get(workbook), used_area, full, check_rows))
+        return syncs
+
+class _WorkbookSync:
+    # One workbook's side of sync(): the first record to fetch, then what the fetched records change in its mirror
+    def __init__(self, replica, table, workbook, position, previous, used_area, full, check_rows):
+        self.replica = replica
+        self.table = table
+        self.workbook = workbook
+        self.position = position
+        self.previous = previous
+        self.used_area = used_area
+        self.plan, self.start = _sync_plan(previous, used_area, full, check_rows)
+        self.records = None
+
+    def fetched(self, records):
+        # False when the records fetched again don't match the mirror, then every record is fetched from the first one
+        if self.plan != "replace":
+            records = _sync_tail(self.previous, records, self.replica.rows(self.table, self.workbook, self.start + 1, self.previous['last_row']))
+            if records is None:
+                self.plan = "replace"
+                self.start = 1
+                return False
+            if self.plan == "unchanged" and len(records) > 0:
+                self.plan = "append"
+        self.records = records
+        return True
+
+    def store(self):
+        last_row = max([self.used_area[0] if self.used_area is not None else 1] + [int(record['row_index']) for record in self.records[-1:]])
+        if self.plan == "replace":
+            self.replica.replace(self.table, self.workbook, self.position, self.records, last_row)
+        else:
+            self.replica.append(self.table, self.workbook, self.position, self.records, last_row)
+        return {"plan": self.plan, "rows": len(self.records)}
+
+def _mirror_insert(replica, table, data, result, first_placement = 0):
+    # Placements before first_placement were mirrored by an earlier attempt
+    if replica is None:
+        return
+    for placement in result.placements[first_placement:]:
+        rows = data[placement['offset']:placement['offset'] + placement['count']]
+        replica.inserted(table, placement['workbook_id'], rows)
+
+def _mirror_update(replica, table, criteria, data, succeeded, failures):
+    if replica is None or not replica.synced(table):
+        return
+    stale = list(failures)
+    for workbook, res in succeeded:
+        if replica.updated(table, [workbook], criteria, data) != _affected_rows(res):
+            stale.append(workbook)
+    if len(stale) > 0:
+        replica.mark_stale(table, stale)
+
+def _mirror_delete(replica, table, criteria, rowid, succeeded, failures):
+    if replica is None or not replica.synced(table):
+        return
+    stale = list(failures)
+    for workbook, res in succeeded:
+        if rowid != "":
+            deleted = replica.deleted(table, workbook, row_indexes=json.loads(rowid))
+        else:
+            deleted = replica.deleted(table, workbook, criteria=criteria)
+        if deleted != _deleted_rows(res):
+            stale.append(workbook)
+    if len(stale) > 0:
+        replica.mark_stale(table, stale)
+
+def _update_query(kwargs):
+    _require(kwargs, ["table", "data"] if "key" in kwargs else ["table", "criteria", "data"])
+    data = kwargs['data']
+    if not isinstance(data, dict):
+        raise InvalidType("data must be a dictionary")
+    return str(kwargs['table']), str(kwargs.get('criteria', "")), data, _workbook_id_arg(kwargs)
+
+def _update_payload(token, table, criteria, data):
+    return {
+        "access_token": token,
+        "method": "worksheet.records.update",
+        "worksheet_name": table,
+        "criteria": criteria,
+        "data": json.dumps(data)
+    }
+
+def _affected_rows(res):
+    return _raise_on_failure(res)['no_of_affected_rows']
+
+def _updated_row(updated, failures, allow_partial):
+    # The outcome of an update_many() update aimed at one row, updated being the rows Zoho updated
+    outcome = _check_failures(failures, allow_partial, updated > 0)
+    if updated > 1:
+        # Matched by its cells (or a key column holding duplicates), every row that looked the same was updated
+        raise UnexpectedResponse(f"{updated} rows matched the row and were all updated")
+    return outcome
+
+def _delete_row_ids(kwargs):
+    if "row_ids" in kwargs:
+        if not isinstance(kwargs['row_ids'], list) or len(kwargs['row_ids']) <= 0:
+            raise EmptyInput("row_ids must be a non-empty list")
+        row_ids = [int(row_id) for row_id in kwargs['row_ids']]
+    elif "row_id" in kwargs and int(kwargs['row_id']) > 0:
+        row_ids = [int(kwargs['row_id'])]
+    else:
+        # row_id = 0 deletes by criteria
+        return []
+    if min(row_ids) <= 1:
+        raise InvalidType("Row indexes start at 2 (row 1 holds the column names)")
+    return row_ids
+
+def _delete_query(kwargs):
+    _require(kwargs, ["table"] if "key" in kwargs else ["table", "criteria"])
+    row_ids = _delete_row_ids(kwargs)
+    if len(row_ids) > 0:
+        # Highest rows first, so the rows Zoho shifts up are never ones still to be deleted
+        rowid = json.dumps(sorted(set(row_ids), reverse=True))
+    else:
+        rowid = ""
+    return str(kwargs['table']), str(kwargs.get('criteria', "")), _workbook_id_arg(kwargs), rowid
+
+def _delete_payload(token, table, criteria, rowid):
+    return {
+        "access_token": token,
+        "method": "worksheet.records.delete",
+        "worksheet_name": table,
+        "criteria": criteria,
+        "row_array": rowid,
+        "delete_rows": "true"
+    }
+
+def _deleted_rows(res):
+    return _raise_on_failure(res)['no_of_rows_deleted']
+
+def _delete_rows_outcomes(row_ids, deleted, failures, allow_partial, used_rows):
+    # Zoho only says how many rows a row index delete removed. That's an answer per row when it removed every row sent,
+    # or when the rows it left are exactly the ones past the last used row of the worksheet (as last known)
+    _check_failures(failures, allow_partial, None)
+    if len(failures) > 0:
+        return [False] * len(row_ids)
+    deleted = sum(deleted.values())
+    sent = set(row_ids)
+    missing = set() if used_rows is None else set(row_id for row_id in sent if row_id > used_rows)
+    if deleted == len(sent):
+        outcomes = dict.fromkeys(sent, True)
+    elif deleted == len(sent) - len(missing):
+        outcomes = {row_id: not row_id in missing for row_id in sent}
+    else:
+        unknown = UnexpectedResponse(f"{deleted} of the {len(sent)} rows sent were deleted, which ones is unknown")
+        outcomes = dict.fromkeys(sent, unknown)
+    return [outcomes[row_id] for row_id in row_ids]
+
+def _normalize_criteria(criteria):
+    try:
+        return normalize_criteria(criteria)
+    except InvalidCriteria:
+        pass
+    # Collapses whitespace and keyword case outside of quoted strings so equivalent criteria share a cache entry
+    parts = str(criteria).split("\"")
+    for index in range(0, len(parts), 2):
+        parts[index] = " ".join(parts[index].split()).lower()
+        parts[index] = parts[index].replace("( ", "(").replace(" )", ")")
+    return "\"".join(parts).strip()
+
+def _escape(criteria, parameters):
+    for k, v in parameters.items():
+        k = k.strip()
+        v = str(v).replace("\"", "'")
+        criteria = criteria.replace(k, v)
+    return criteria
+
+def _client_options(http2, max_connections, max_keepalive_connections, keepalive_expiry, timeout):
+    if max_keepalive_connections is None:
+        max_keepalive_connections = max_connections
+    return {
+        "http2": http2,
+        "limits": httpx.Limits(
+            max_connections=int(max_connections),
+            max_keepalive_connections=int(max_keepalive_connections),
+            keepalive_expiry=keepalive_expiry
+        ),
+        "timeout": timeout
+    }
+
+def _oauth_code(url):
+    urlparams = url.split("/")[3].split("&")
+    for param in urlparams:
+        try:
+            key = param.split("=")[0]
+            val = param.split("=")[1]
+            if key == 'code' or key == '?code':
+                return val
+        except IndexError:
+            continue
+    return ""
+# ----------
+
+def ZohoWorkbookRequest(workbook_id, data, client = None, timeout = None):
+    url, payload, headers = _workbook_request(workbook_id, data)
+    if client is None:
+        client = httpx
+    options = {}
+    if timeout is not None:
+        options['timeout'] = timeout
+    try:
+        return client.post(url, data=payload, headers=headers, **options)
+    except httpx.RequestError as e:
+        raise HttpRequestError(f"A Zoho workbook request has failed: {e}")
+
+async def AsyncZohoWorkbookRequest(workbook_id, data, client, timeout = None):
+    url, payload, headers = _workbook_request(workbook_id, data)
+    options = {}
+    if timeout is not None:
+        options['timeout'] = timeout
+    try:
+        return await client.post(url, data=payload, headers=headers, **options)
     except httpx.RequestError as e:
         raise HttpRequestError(f"A Zoho workbook request has failed: {e}")
         
+class JsonFileCacheBackend:
+    def __init__(self, path, stale_lock_timeout = 30):
+        self.path = path
+        self.stale_lock_timeout = stale_lock_timeout
+        self.metrics = None
+        Path(f"{self.path}").mkdir(parents=True, exist_ok=True)
+        self.__thread_locks = {}
+        self.__thread_locks_guard = threading.Lock()
+
+    def __thread_lock(self, table):
+        with self.__thread_locks_guard:
+            if not table in self.__thread_locks:
+                self.__thread_locks[table] = threading.Lock()
+            return self.__thread_locks[table]
+
+    @contextlib.contextmanager
+    def __locked(self, table):
+        lock_path = f"{self.path}/{table}.lock"
+        start = time.perf_counter()
+        with self.__thread_lock(table):
+            if fcntl is not None:
+                # flock() is released by the kernel when its holder dies, so a crash can't leave the table locked
+                with open(lock_path, "a") as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    if self.metrics is not None:
+                        self.metrics.phase("cache_lock_wait", time.perf_counter() - start)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+                return
+            while True:
+                try:
+                    os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    break
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(lock_path) > self.stale_lock_timeout:
+                            os.remove(lock_path)
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    time.sleep(0.005)
+            if self.metrics is not None:
+                self.metrics.phase("cache_lock_wait", time.perf_counter() - start)
+            try:
+                yield
+            finally:
+                os.remove(lock_path)
+
+    def __read(self, table):
+        try:
+            with open(f"{self.path}/{table}.json", "r") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            raise InvalidCacheTable
+        except json.decoder.JSONDecodeError:
+            raise CorruptedCacheTable
+
+    def __write(self, table, data):
+        tmp_path = f"{self.path}/{table}.json.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(data))
+        os.replace(tmp_path, f"{self.path}/{table}.json")
+
+    def get(self, table, key):
+        data = self.__read(table)
+        if key in data:
+            return data[key]
+        return None
+
+    def set(self, table, key, value):
+        with self.__locked(table):
+            try:
+                data = self.__read(table)
+            except InvalidCacheTable:
+                data = {}
+            data[key] = value
+            self.__write(table, data)
+        return True
+
+    def update(self, table, key, function):
+        with self.__locked(table):
+            try:
+                data = self.__read(table)
+            except InvalidCacheTable:
+                data = {}
+            data[key] = function(data.get(key))
+            self.__write(table, data)
+            return data[key]
+
+    def delete(self, table, key):
+        with self.__locked(table):
+            data = self.__read(table)
+            if not key in data:
+                return False
+            del data[key]
+            self.__write(table, data)
+        return True
+
+class SQLiteCacheBackend:
+    def __init__(self, path, timeout = 30):
+        self.path = path
+        self.timeout = timeout
+        self.metrics = None
+        Path(f"{self.path}").mkdir(parents=True, exist_ok=True)
+        self.__local = threading.local()
+        with self.__transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS cache_tables (name TEXT PRIMARY KEY)")
+            db.execute("CREATE TABLE IF NOT EXISTS cache (tbl TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (tbl, key))")
+
+    def __connection(self):
+        db = getattr(self.__local, "db", None)
+        if db is None:
+            # One connection per thread; WAL lets readers run alongside a writer from any process
+            db = sqlite3.connect(f"{self.path}/cache.sqlite3", timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self.__local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        db = self.__connection()
+        if self.metrics is None:
+            db.execute("BEGIN IMMEDIATE")
+        else:
+            start = time.perf_counter()
+            db.execute("BEGIN IMMEDIATE")
+            self.metrics.phase("cache_lock_wait", time.perf_counter() - start)
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def __table_exists(self, db, table):
+        return db.execute("SELECT 1 FROM cache_tables WHERE name = ?", (table,)).fetchone() is not None
+
+    def get(self, table, key):
+        db = self.__connection()
+        row = db.execute("SELECT value FROM cache WHERE tbl = ? AND key = ?", (table, key)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        if not self.__table_exists(db, table):
+            raise InvalidCacheTable
+        return None
+
+    def set(self, table, key, value):
+        with self.__transaction() as db:
+            db.execute("INSERT OR IGNORE INTO cache_tables (name) VALUES (?)", (table,))
+            db.execute("INSERT INTO cache (tbl, key, value) VALUES (?, ?, ?) ON CONFLICT (tbl, key) DO UPDATE SET value = excluded.value", (table, key, json.dumps(value)))
+        return True
+
+    def update(self, table, key, function):
+        with self.__transaction() as db:
+            row = db.execute("SELECT value FROM cache WHERE tbl = ? AND key = ?", (table, key)).fetchone()
+            value = function(None if row is None else json.loads(row[0]))
+            db.execute("INSERT OR IGNORE INTO cache_tables (name) VALUES (?)", (table,))
+            db.execute("INSERT INTO cache (tbl, key, value) VALUES (?, ?, ?) ON CONFLICT (tbl, key) DO UPDATE SET value = excluded.value", (table, key, json.dumps(value)))
+        return value
+
+    def delete(self, table, key):
+        with self.__transaction() as db:
+            if not self.__table_exists(db, table):
+                raise InvalidCacheTable
+            deleted = db.execute("DELETE FROM cache WHERE tbl = ? AND key = ?", (table, key)).rowcount
+        return deleted > 0
+
 class ZohoDBCache:
-    def __init__(self, hash):
+    def __init__(self, hash, backend = None, memory_ttl = 5, metrics = None, cache_root = None):
         if not hash:
             raise MissingData("The cache hash is required")
         self.hash = hash
-        self.cache_path = f"./.zohodb/db_cache/{self.hash}"
-        Path(f"{self.cache_path}").mkdir(parents=True, exist_ok=True)
-        
-    def __wait_till_released(self, table):
-        while True:
-            if Path(f"{self.cache_path}/{table}.lock").exists():
-                time.sleep(1)
-                continue
+        self.cache_root = _cache_root(cache_root)
+        self.cache_path = f"{self.cache_root}/db_cache/{self.hash}"
+        if backend is None:
+            backend = SQLiteCacheBackend(self.cache_path)
+        self.backend = backend
+        self.metrics = metrics
+        # Backends that report their lock waits expose a `metrics` attribute
+        if metrics is not None and getattr(backend, "metrics", False) is None:
+            backend.metrics = metrics
+        # Short-lived in-process copy of what the (possibly shared) backend holds
+        self.memory_ttl = memory_ttl
+        self.__memory = {}
+        self.__memory_lock = threading.Lock()
+
+    def __remember(self, table, key, value):
+        if self.memory_ttl and self.memory_ttl > 0:
+            with self.__memory_lock:
+                self.__memory[(table, key)] = (value, time.monotonic() + self.memory_ttl)
+
+    def __forget(self, table, key):
+        with self.__memory_lock:
+            self.__memory.pop((table, key), None)
+
+    def __backend(self, function, *args):
+        if self.metrics is None:
+            return function(*args)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.metrics.phase("cache_io", time.perf_counter() - start)
+
+    def get(self, table, key):
+        with self.__memory_lock:
+            cached = self.__memory.get((table, key))
+        if cached is not None and cached[1] > time.monotonic():
+            if self.metrics is not None:
+                self.metrics.cache_lookup(table, True)
+            return copy.deepcopy(cached[0])
+        if self.metrics is not None:
+            self.metrics.cache_lookup(table, False)
+        value = self.__backend(self.backend.get, table, key)
+        self.__remember(table, key, value)
+        return copy.deepcopy(value)
+
+    def set(self, table, key, value):
+        self.__forget(table, key)
+        return self.__backend(self.backend.set, table, key, value)
+
+    def update(self, table, key, function):
+        self.__forget(table, key)
+        return self.__backend(self.backend.update, table, key, function)
+
+    def delete(self, table, key):
+        self.__forget(table, key)
+        return self.__backend(self.backend.delete, table, key)
+
+class ZohoQueryCache:
+    def __init__(self, max_entries = 1024, ttl = 60, table_ttls = None):
+        self.max_entries = int(max_entries)
+        self.ttl = ttl
+        self.table_ttls = dict(table_ttls or {})
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.__entries = collections.OrderedDict()
+        self.__generations = {}
+        self.__lock = threading.Lock()
+
+    def key(self, table, criteria, columns, as_ = "records"):
+        key = (str(table), _normalize_criteria(criteria), tuple(columns))
+        if as_ != "records":
+            key += (as_,)
+        return key
+
+    def generation(self, table):
+        with self.__lock:
+            return self.__generations.get(str(table), 0)
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    del self.__entries[key]
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            if isinstance(entry[0], ResultSet):
+                # Result sets are read-only, so they can be shared instead of copied
+                return entry[0]
+            # Only results without failures are cached
+            return RecordList(dict(record) for record in entry[0])
+
+    def set(self, key, records, generation):
+        ttl = self.table_ttls.get(key[0], self.ttl)
+        if ttl is None or ttl <= 0:
+            return False
+        with self.__lock:
+            # A write to the table happened while this result was being fetched
+            if self.__generations.get(key[0], 0) != generation:
+                return False
+            if not isinstance(records, ResultSet):
+                records = [dict(record) for record in records]
+            self.__entries[key] = (records, time.monotonic() + ttl)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def invalidate(self, table = None):
+        with self.__lock:
+            if table is None:
+                tables = set(key[0] for key in self.__entries) | set(self.__generations)
             else:
-                break
+                tables = {str(table)}
+            for name in tables:
+                self.__generations[name] = self.__generations.get(name, 0) + 1
+            stale = [key for key in self.__entries if key[0] in tables]
+            for key in stale:
+                del self.__entries[key]
+            self.invalidations += len(stale)
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "entries": len(self.__entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+class InsertResult:
+    def __init__(self, total):
+        self.total = total
+        self.placements = []
+        # Where each row of the inserted data landed (None for the rows no workbook could take)
+        self.workbooks = [None] * total
+        self.row_indexes = [None] * total
+
+    def add(self, workbook_id, offset, count, first_row_index):
+        self.placements.append({
+            "workbook_id": workbook_id,
+            "offset": offset,
+            "count": count,
+            "first_row_index": first_row_index
+        })
+        for index in range(count):
+            self.workbooks[offset + index] = workbook_id
+            if first_row_index is not None:
+                self.row_indexes[offset + index] = first_row_index + index
+
+    def add_rows(self, workbook_id, indexes, first_row_index):
+        # Rows that aren't next to each other in the inserted data (sharded inserts) get a placement per run
+        start = 0
+        for position in range(1, len(indexes) + 1):
+            if position == len(indexes) or indexes[position] != indexes[position - 1] + 1:
+                self.add(workbook_id, indexes[start], position - start, None if first_row_index is None else first_row_index + start)
+                start = position
+
+    @property
+    def inserted(self):
+        return sum(placement['count'] for placement in self.placements)
+
+    def slice(self, offset, count):
+        # The result of rows [offset, offset + count) alone
+        result = InsertResult(count)
+        for placement in self.placements:
+            start = max(placement['offset'], offset)
+            end = min(placement['offset'] + placement['count'], offset + count)
+            if start < end:
+                first_row_index = placement['first_row_index']
+                if first_row_index is not None:
+                    first_row_index += start - placement['offset']
+                result.add(placement['workbook_id'], start - offset, end - start, first_row_index)
+        return result
+
+    def __bool__(self):
+        return self.total > 0 and self.inserted == self.total
+
+    def __repr__(self):
+        return f"InsertResult(inserted={self.inserted}/{self.total}, placements={self.placements!r})"
+
+class InsertChunkResult:
+    def __init__(self, index, offset, rows):
+        self.index = index
+        self.offset = offset
+        self.count = len(rows)
+        self.rows = rows
+        self.result = None
+        self.error = None
+        self.attempts = 0
+
+    def release(self):
+        # Drops the row data once the chunk is done so a long import doesn't keep it all in memory
+        self.rows = None
+
+    @property
+    def inserted(self):
+        if self.result is None:
+            return 0
+        return self.result.inserted
+
+    def __bool__(self):
+        return self.error is None and self.result is not None and bool(self.result)
+
+    def __repr__(self):
+        return f"InsertChunkResult(index={self.index}, offset={self.offset}, count={self.count}, inserted={self.inserted}, attempts={self.attempts}, error={self.error!r})"
+
+class ZohoCapacityTracker:
+    def __init__(self, cache, max_rows = 65536, max_cells = 2000000, refresh_interval = 3600):
+        self.cache = cache
+        self.max_rows = int(max_rows)
+        self.max_cells = int(max_cells)
+        self.refresh_interval = refresh_interval
+
+    def __state(self, workbook):
+        try:
+            state = self.cache.get("capacity", str(workbook))
+        except InvalidCacheTable:
+            state = None
+        if state is None:
+            return {"sheets": {}, "refreshed_at": {}}
+        return state
+
+    def __change(self, workbook, function):
+        def apply(state):
+            if state is None:
+                state = {"sheets": {}, "refreshed_at": {}}
+            function(state)
+            return state
+        return self.cache.update("capacity", str(workbook), apply)
+
+    def used_rows(self, workbook, table):
+        sheet = self.__state(workbook)['sheets'].get(str(table))
+        if sheet is None:
+            return None
+        return sheet[0]
+
+    def room(self, workbook, table, columns):
+        # Rows the worksheet can still take, or None when nothing is known about it yet
+        state = self.__state(workbook)
+        sheet = state['sheets'].get(str(table))
+        if sheet is None:
+            return None
+        columns = max(int(columns), sheet[1], 1)
+        used_cells = sum(rows * cols for name, (rows, cols) in state['sheets'].items() if name != str(table))
+        rows_left = self.max_rows - sheet[0]
+        cells_left = (self.max_cells - used_cells) // columns - sheet[0]
+        return max(0, min(rows_left, cells_left))
+
+    def needs_refresh(self, workbook, table):
+        if not self.refresh_interval:
+            return False
+        refreshed_at = self.__state(workbook)['refreshed_at'].get(str(table), 0)
+        return (refreshed_at + self.refresh_interval) <= calendar.timegm(time.gmtime())
+
+    def refreshed(self, workbook, table, used_area):
+        def apply(state):
+            state['refreshed_at'][str(table)] = calendar.timegm(time.gmtime())
+            if used_area is not None:
+                state['sheets'][str(table)] = [int(used_area[0]), int(used_area[1])]
+        self.__change(workbook, apply)
+
+    def inserted(self, workbook, table, rows, columns):
+        def apply(state):
+            sheet = state['sheets'].get(str(table))
+            if sheet is not None:
+                state['sheets'][str(table)] = [sheet[0] + int(rows), max(sheet[1], int(columns))]
+        self.__change(workbook, apply)
+
+    def deleted(self, workbook, table, rows):
+        def apply(state):
+            sheet = state['sheets'].get(str(table))
+            if sheet is not None:
+                state['sheets'][str(table)] = [max(1, sheet[0] - int(rows)), sheet[1]]
+        self.__change(workbook, apply)
+
+    def full(self, workbook, table):
+        def apply(state):
+            sheet = state['sheets'].get(str(table), [0, 1])
+            state['sheets'][str(table)] = [self.max_rows, sheet[1]]
+        self.__change(workbook, apply)
+
+class ZohoMetadataCache:
+    def __init__(self, cache, workbooks_ttl = 3600, schema_ttl = 600, recheck_interval = 30):
+        self.cache = cache
+        self.workbooks_ttl = workbooks_ttl
+        self.schema_ttl = schema_ttl
+        # Listing the workbooks again after a failed request happens at most once per recheck_interval seconds
+        self.recheck_interval = recheck_interval
+
+    def __get(self, key):
+        try:
+            return self.cache.get("metadata", key)
+        except InvalidCacheTable:
+            return None
+
+    def __fresh(self, entry, ttl):
+        if entry is None:
+            return False
+        return not ttl or entry['fetched_at'] + ttl > calendar.timegm(time.gmtime())
+
+    def __entry(self, value):
+        return {"value": value, "fetched_at": calendar.timegm(time.gmtime())}
+
+    def __delete(self, key):
+        try:
+            self.cache.delete("metadata", key)
+        except InvalidCacheTable:
+            pass
+
+    def workbookids(self, fresh = True):
+        entry = self.__get("workbooks")
+        if entry is None or len(entry['value']) <= 0 or (fresh and not self.__fresh(entry, self.workbooks_ttl)):
+            return None
+        return entry['value']
+
+    def set_workbookids(self, workbookids):
+        previous = self.workbookids(fresh=False)
+        self.cache.set("metadata", "workbooks", self.__entry(list(workbookids)))
+        if previous is not None and previous != list(workbookids):
+            # The worksheets were listed per workbook ID
+            self.__delete("worksheets")
+
+    def worksheets(self):
+        entry = self.__get("worksheets")
+        if not self.__fresh(entry, self.schema_ttl):
+            return None
+        return entry['value']
+
+    def set_worksheets(self, worksheets):
+        self.cache.set("metadata", "worksheets", self.__entry(worksheets))
+
+    def headers(self, table):
+        entry = (self.__get("headers") or {}).get(str(table))
+        if not self.__fresh(entry, self.schema_ttl):
+            return None
+        return entry['value']
+
+    def set_headers(self, table, headers):
+        def apply(tables):
+            tables = tables or {}
+            tables[str(table)] = self.__entry(list(headers))
+            return tables
+        self.cache.update("metadata", "headers", apply)
+
+    def invalidate(self, table = None):
+        # Forgets the headers of one table, or everything when no table is given
+        if table is not None:
+            def apply(tables):
+                tables = tables or {}
+                tables.pop(str(table), None)
+                return tables
+            self.cache.update("metadata", "headers", apply)
+            return
+        for key in ("workbooks", "worksheets", "headers"):
+            self.__delete(key)
+
+    def recheck_due(self):
+        # Kept in the cache, so processes sharing it don't all list the workbooks after the same failure
+        now = time.time()
+        due = []
+        def apply(rechecked_at):
+            due.append(rechecked_at is None or not (0 <= now - rechecked_at < self.recheck_interval))
+            return now if due[0] else rechecked_at
+        self.cache.update("metadata", "rechecked_at", apply)
+        return due[0]
+
+class _InsertRouting:
+    def __init__(self, table, data, workbookids, cache, tracker, result = None):
+        self.table = table
+        self.data = data
+        self.workbookids = list(workbookids)
+        self.cache = cache
+        self.tracker = tracker
+        # Carrying on with the result of an earlier attempt skips the rows it already placed
+        self.result = result if result is not None else InsertResult(len(data))
+        self.placed = len(self.result.placements)
+        self.offset = self.result.inserted
+        self.columns = len(set(key for row in data for key in row)) if data else 0
+        self.rechecked = set()
+
+    def done(self):
+        return self.offset >= len(self.data)
+
+    def next_chunk(self, workbook):
+        # The rows to send to this workbook, or None to skip it
+        if self.done() or _marked_full(self.cache, workbook):
+            return None
+        room = self.tracker.room(workbook, self.table, self.columns)
+        if room is None:
+            return self.data[self.offset:]
+        if room <= 0:
+            return None
+        return self.data[self.offset:self.offset + room]
+
+    def full(self, workbook):
+        _mark_full(self.cache, workbook)
+        self.tracker.full(workbook, self.table)
+
+    def recheck(self, workbook, res):
+        return _recheck_full(self.rechecked, workbook, res)
+
+    def answered(self, workbook, chunk, res):
+        # The bookkeeping of the workbook's answer to chunk, False when it was full
+        if _workbook_is_full(res):
+            self.full(workbook)
+            return False
+        if res['status'] != "failure":
+            self.landed(workbook, chunk)
         return True
-        
-    def __lock(self, table):
-        open(f"{self.cache_path}/{table}.lock", 'a').close()
+
+    def landed(self, workbook, chunk):
+        # Only exact while the workbook's insert lock is held from before the request until now
+        used_rows = self.tracker.used_rows(workbook, self.table)
+        first_row_index = None if used_rows is None else used_rows + 1
+        self.result.add(workbook, self.offset, len(chunk), first_row_index)
+        self.tracker.inserted(workbook, self.table, len(chunk), self.columns)
+        self.offset += len(chunk)
+
+    def finished(self, res, vanished, metadata):
+        # Whether every row was placed once a workbook answered res, vanished holding it when it isn't part of the database anymore
+        if len(vanished) > 0:
+            # Move on to the workbooks that replaced it, if any
+            self.workbookids.extend(other for other in metadata.workbookids(fresh=False) if not other in self.workbookids)
+            return False
+        _raise_on_failure(res)
+        return self.done()
+
+    def record(self, row_index, replica):
+        _record_insert(row_index, replica, self.table, self.data, self.result, self.placed)
+
+class TokenBucket:
+    def __init__(self, rate, burst = None):
+        if rate is None or float(rate) <= 0:
+            raise InvalidType("The rate must be a positive number of requests per second")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.reservations = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens = 1):
+        # Takes the tokens right away (going into debt if needed) and returns how long the caller must wait
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= tokens
+            self.reservations += 1
+            if self.tokens >= 0:
+                return 0.0
+            delay = -self.tokens / self.rate
+            self.throttled += 1
+            self.waited += delay
+            return delay
+
+    def stats(self):
+        with self.lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "available": max(0.0, min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)),
+                "requests": self.reservations,
+                "throttled": self.throttled,
+                "waited": self.waited
+            }
+
+class SharedTokenBucket:
+    # A TokenBucket kept in an SQLite database, every process using the same path draws from the same budget
+    def __init__(self, path, name, rate, burst = None, timeout = 30):
+        if rate is None or float(rate) <= 0:
+            raise InvalidType("The rate must be a positive number of requests per second")
+        self.path = path
+        self.name = str(name)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.timeout = timeout
+        # The stats only count this process' reservations
+        self.reservations = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self.lock = threading.Lock()
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.__local = threading.local()
+        with self.__transaction() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            db.execute("INSERT OR IGNORE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (self.name, self.burst, time.time()))
+
+    def __connection(self):
+        db = getattr(self.__local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # Losing the last few reservations in a crash only hands out a little extra budget
+            db.execute("PRAGMA synchronous=OFF")
+            self.__local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        db = self.__connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def __available(self, db, now):
+        stored, updated = db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+        # Wall clock time is the one all processes share, don't let it going backwards add tokens
+        return min(self.burst, stored + max(0.0, now - updated) * self.rate)
+
+    def reserve(self, tokens = 1):
+        with self.__transaction() as db:
+            now = time.time()
+            available = self.__available(db, now) - tokens
+            db.execute("UPDATE buckets SET tokens = ?, updated = ? WHERE name = ?", (available, now, self.name))
+        with self.lock:
+            self.reservations += 1
+            if available >= 0:
+                return 0.0
+            delay = -available / self.rate
+            self.throttled += 1
+            self.waited += delay
+            return delay
+
+    def stats(self):
+        available = max(0.0, self.__available(self.__connection(), time.time()))
+        with self.lock:
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "available": available,
+                "requests": self.reservations,
+                "throttled": self.throttled,
+                "waited": self.waited
+            }
+
+class ZohoRateLimiter:
+    def __init__(self, rate = None, burst = None, workbook_rate = None, workbook_burst = None, path = None):
+        # With a path, the budget is kept in an SQLite database shared by every process using it
+        self.path = path
+        self.bucket = self.__new_bucket("global", rate, burst) if rate else None
+        self.workbook_rate = workbook_rate
+        self.workbook_burst = workbook_burst
+        self.workbook_buckets = {}
+        self.__lock = threading.Lock()
+
+    def __new_bucket(self, name, rate, burst):
+        if self.path is None:
+            return TokenBucket(rate, burst)
+        return SharedTokenBucket(self.path, name, rate, burst)
+
+    def __workbook_bucket(self, workbook):
+        if not self.workbook_rate:
+            return None
+        with self.__lock:
+            if not workbook in self.workbook_buckets:
+                self.workbook_buckets[workbook] = self.__new_bucket(f"workbook:{workbook}", self.workbook_rate, self.workbook_burst)
+            return self.workbook_buckets[workbook]
+
+    def reserve(self, workbook = None):
+        delay = 0.0
+        if self.bucket is not None:
+            delay = self.bucket.reserve()
+        bucket = self.__workbook_bucket(workbook)
+        if bucket is not None:
+            delay = max(delay, bucket.reserve())
+        return delay
+
+    def acquire(self, workbook = None):
+        delay = self.reserve(workbook)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, workbook = None):
+        delay = self.reserve(workbook)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def stats(self):
+        with self.__lock:
+            buckets = dict(self.workbook_buckets)
+        return {
+            "global": None if self.bucket is None else self.bucket.stats(),
+            "workbooks": {workbook: bucket.stats() for workbook, bucket in buckets.items()}
+        }
+
+class ZohoRetryPolicy:
+    def __init__(self, max_attempts = 4, backoff = 0.5, max_backoff = 30, retry_statuses = (429, 500, 502, 503, 504), retry_error_codes = (), retry_non_idempotent = False):
+        self.max_attempts = int(max_attempts)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.retry_statuses = set(retry_statuses)
+        self.retry_error_codes = set(retry_error_codes)
+        self.retry_non_idempotent = retry_non_idempotent
+        self.retries = 0
+        self.gave_up = 0
+        self.__lock = threading.Lock()
+
+    def allows(self, data, attempt):
+        if attempt >= self.max_attempts:
+            return False
+        # Adding rows or deleting by row index twice isn't harmless, so those need an explicit opt-in
+        return self.retry_non_idempotent or data.get("method") in _IDEMPOTENT_METHODS
+
+    def retryable(self, req, res):
+        if req.status_code in self.retry_statuses:
+            return True
+        return isinstance(res, dict) and res.get("error_code") in self.retry_error_codes
+
+    def delay(self, attempt, req = None):
+        if req is not None:
+            retry_after = req.headers.get("Retry-After")
+            if retry_after is not None:
+                try:
+                    return min(max(0.0, float(retry_after)), self.max_backoff)
+                except ValueError:
+                    pass
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** (attempt - 1))))
+
+    def record(self, retried):
+        with self.__lock:
+            if retried:
+                self.retries += 1
+            else:
+                self.gave_up += 1
+
+    def stats(self):
+        with self.__lock:
+            return {"retries": self.retries, "gave_up": self.gave_up}
+
+def _shard_value(value):
+    # Zoho compares cells that look like numbers numerically and text case-insensitively, so 5, 5.0 & "5" (or "A" & "a") share a shard
+    text = str(value).strip()
+    try:
+        number = float(text)
+    except ValueError:
+        return text.lower()
+    if number.is_integer():
+        return str(int(number))
+    return repr(number)
+
+class ZohoSharding:
+    def __init__(self, keys):
+        if not isinstance(keys, dict):
+            raise InvalidType("shard_keys must be a dictionary of table name -> shard key column")
+        self.keys = {str(table): str(column) for table, column in keys.items()}
+
+    def column(self, table):
+        return self.keys.get(str(table))
+
+    def workbook(self, table, key, workbookids):
+        # Rendezvous hashing: every workbook scores the key and the highest score wins,
+        # so adding a workbook only moves the keys it wins & removing one only moves its own keys
+        value = _shard_value(key)
+        return max(workbookids, key=lambda workbook: hashlib.md5(f"{table}\0{value}\0{workbook}".encode('utf-8')).digest())
+
+    def targets(self, table, criteria, workbookids):
+        # The workbooks a query has to ask: a single one when the criteria pins the shard key to one value
+        column = self.column(table)
+        if column is None:
+            return workbookids
+        try:
+            value = equality_value(criteria, column)
+        except InvalidCriteria:
+            return workbookids
+        if value is None:
+            return workbookids
+        return [self.workbook(table, value, workbookids)]
+
+    def rows(self, table, data, workbookids, placed = None):
+        # {workbook: [indexes of the rows of data it should hold]}, leaving out the rows already placed (see InsertResult.workbooks)
+        column = self.column(table)
+        groups = {}
+        for index, row in enumerate(data):
+            if placed is not None and placed[index] is not None:
+                continue
+            if row.get(column) is None or str(row[column]).strip() == "":
+                raise MissingData(f"Row {index} is missing the shard key '{column}' of the table '{table}'")
+            groups.setdefault(self.workbook(table, row[column], workbookids), []).append(index)
+        return groups
+
+    def misplaced(self, table, records, workbookids):
+        # The records (as returned by select()) that another workbook should hold, and how many have no shard key
+        column = self.column(table)
+        moves = []
+        unkeyed = 0
+        for record in records:
+            if record.get(column) is None or str(record[column]).strip() == "":
+                unkeyed += 1
+                continue
+            target = self.workbook(table, record[column], workbookids)
+            if target != record['workbook_id']:
+                moves.append((record, target))
+        return moves, unkeyed
+
+def _shard_targets(sharding, table, criteria, workbookids):
+    if sharding is None:
+        return workbookids
+    return sharding.targets(table, criteria, workbookids)
+
+def _sharded(sharding, table):
+    return sharding is not None and sharding.column(table) is not None
+
+def _check_shard_update(sharding, table, criteria, data):
+    # An update can't move a row to another workbook, so it may only write the shard key the criteria already pins it to
+    if not _sharded(sharding, table):
+        return
+    column = sharding.column(table)
+    if column not in data:
+        return
+    try:
+        pinned = equality_value(criteria, column)
+    except InvalidCriteria:
+        pinned = None
+    if pinned is None or _shard_value(pinned) != _shard_value(data[column]):
+        raise InvalidType(f"update() can't change the shard key '{column}' of the table '{table}', insert the row again & delete the old one instead")
+
+class _ShardedInsert:
+    # The per-call side of a sharded insert: the rows each workbook gets, then the bookkeeping of each answer
+    def __init__(self, table, data, sharding, workbookids, cache, tracker, result = None):
+        self.table = table
+        self.data = data
+        self.cache = cache
+        self.tracker = tracker
+        # Carrying on with the result of an earlier attempt skips the rows it already placed
+        self.result = result if result is not None else InsertResult(len(data))
+        self.placed = len(self.result.placements)
+        self.groups = sharding.rows(table, data, workbookids, self.result.workbooks)
+        self.columns = len(set(key for row in data for key in row))
+        self.error = None
+        self.rechecked = set()
+        # The indexes of the rows last sent to each workbook
+        self.sent = {}
+
+    def workbooks(self):
+        return list(self.groups)
+
+    def next_chunk(self, workbook):
+        # The rows to send to the workbook, only the ones that fit once its used area was read again, or None
+        indexes = self.groups[workbook]
+        if workbook in self.rechecked:
+            room = self.tracker.room(workbook, self.table, self.columns)
+            if room is not None:
+                indexes = indexes[:room]
+        if len(indexes) <= 0:
+            return None
+        self.sent[workbook] = indexes
+        return [self.data[index] for index in indexes]
+
+    def recheck(self, workbook, res):
+        return _recheck_full(self.rechecked, workbook, res)
+
+    def answered(self, workbook, chunk, res):
+        # Only exact while the workbook's insert lock is held from before the request until now.
+        # The shard key decides the workbook, so there's no other one to try: a full or failed workbook is final
+        if _workbook_is_full(res):
+            _mark_full(self.cache, workbook)
+            self.tracker.full(workbook, self.table)
+            return False
+        if res['status'] == "failure":
+            self.error = self.error or res
+            return True
+        used_rows = self.tracker.used_rows(workbook, self.table)
+        self.result.add_rows(workbook, self.sent[workbook], None if used_rows is None else used_rows + 1)
+        self.tracker.inserted(workbook, self.table, len(chunk), self.columns)
         return True
-        
-    def __release(self, table):
-        if Path(f"{self.cache_path}/{table}.lock").exists():
-            os.remove(f"{self.cache_path}/{table}.lock")
+
+    def record(self, row_index, replica):
+        _record_insert(row_index, replica, self.table, self.data, self.result, self.placed)
+
+    def finish(self):
+        # Once every workbook answered, raises the first failure
+        if self.error is not None:
+            _raise_on_failure(self.error)
+        return self.result
+
+def _record_insert(row_index, replica, table, data, result, first_placement):
+    if row_index is not None:
+        row_index.placed(table, data, result)
+    _mirror_insert(replica, table, data, result, first_placement)
+
+def _unplaced_error(result):
+    if result.inserted >= result.total:
+        return None
+    return UnexpectedResponse(f"{result.total - result.inserted} of {result.total} rows couldn't be placed in any workbook")
+
+def _rebalance_plan(sharding, table, records, workbookids):
+    if not _sharded(sharding, table):
+        raise MissingData(f"No shard key was declared for the table '{table}'")
+    moves, unkeyed = sharding.misplaced(table, records, workbookids)
+    report = {"rows": len(records), "moved": 0, "unkeyed": unkeyed, "moves": {}}
+    for record, target in moves:
+        sources = report['moves'].setdefault(record['workbook_id'], {})
+        sources[target] = sources.get(target, 0) + 1
+    data = [{key: value for key, value in record.items() if key != "row_index" and key != "workbook_id"} for record, target in moves]
+    return moves, data, report
+
+def _rebalance_deletes(moves, inserted):
+    # Only the rows that made it to their new workbook are removed from the old one: {workbook: [row indexes]}
+    deletes = {}
+    for index, (record, target) in enumerate(moves):
+        if inserted.workbooks[index] is not None:
+            deletes.setdefault(record['workbook_id'], []).append(int(record['row_index']))
+    return deletes
+
+class ZohoRowIndex:
+    def __init__(self, keys):
+        if not isinstance(keys, dict):
+            raise InvalidType("keys must be a dictionary of table name -> key column")
+        self.keys = {str(table): str(column) for table, column in keys.items()}
+        self.hits = 0
+        self.misses = 0
+        self.repairs = 0
+        self.__rows = {}
+        self.__lock = threading.Lock()
+
+    def column(self, table):
+        return self.keys.get(str(table))
+
+    def locate(self, table, key):
+        with self.__lock:
+            location = self.__rows.get(str(table), {}).get(str(key))
+            if location is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return tuple(location)
+
+    def put(self, table, key, workbook, row_index = None):
+        with self.__lock:
+            self.__rows.setdefault(str(table), {})[str(key)] = [workbook, row_index]
+
+    def discard(self, table, key, stale = False):
+        with self.__lock:
+            self.__rows.get(str(table), {}).pop(str(key), None)
+            if stale:
+                self.repairs += 1
+
+    def rename(self, table, old_key, new_key):
+        with self.__lock:
+            rows = self.__rows.get(str(table), {})
+            if str(old_key) in rows:
+                rows[str(new_key)] = rows.pop(str(old_key))
+
+    def records(self, table, records):
+        column = self.column(table)
+        if column is None:
+            return
+        if isinstance(records, ResultSet):
+            # Read the key & row_index columns directly instead of going through a Row view per record
+            if not column in records.columns:
+                return
+            keys = records.column(column)
+            row_indexes = records.column("row_index") if "row_index" in records.columns else [None] * len(records)
+            with self.__lock:
+                rows = self.__rows.setdefault(str(table), {})
+                for start, end, workbook in records.runs():
+                    for index in range(start, end):
+                        if keys[index] is not None:
+                            rows[str(keys[index])] = [workbook, row_indexes[index]]
+            return
+        with self.__lock:
+            rows = self.__rows.setdefault(str(table), {})
+            for record in records:
+                if column in record and "workbook_id" in record:
+                    rows[str(record[column])] = [record['workbook_id'], record.get('row_index')]
+
+    def placed(self, table, data, result):
+        column = self.column(table)
+        if column is None:
+            return
+        with self.__lock:
+            rows = self.__rows.setdefault(str(table), {})
+            for index, row in enumerate(data):
+                if column in row and result.workbooks[index] is not None:
+                    rows[str(row[column])] = [result.workbooks[index], result.row_indexes[index]]
+
+    def rows_deleted(self, table, workbook, row_indexes):
+        # Rows below a deleted row move up by one for every deleted row above them
+        deleted = sorted(int(row) for row in row_indexes)
+        with self.__lock:
+            rows = self.__rows.get(str(table), {})
+            for key in list(rows):
+                location = rows[key]
+                if location[0] != workbook or location[1] is None:
+                    continue
+                if location[1] in deleted:
+                    del rows[key]
+                    continue
+                location[1] -= bisect.bisect_left(deleted, location[1])
+
+    def forget_rows(self, table, workbook):
+        # Deleted rows we can't pin down shifted an unknown part of the worksheet; keep the workbooks, drop the row indexes
+        with self.__lock:
+            for location in self.__rows.get(str(table), {}).values():
+                if location[0] == workbook:
+                    location[1] = None
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "entries": sum(len(rows) for rows in self.__rows.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "repairs": self.repairs
+            }
+
+def _criteria_value(value):
+    # The value as a criteria literal, or None when no literal matches it
+    if isinstance(value, float):
+        if value != value or value in (float("inf"), float("-inf")):
+            return None
+        # Zoho compares numbers the way the cell shows them, never in the exponent form repr() may use
+        return format(decimal.Decimal(repr(value)).normalize(), "f")
+    if isinstance(value, int) and not isinstance(value, bool):
+        return repr(value)
+    # A criteria string can't hold a double quote
+    if "\"" in str(value):
+        return None
+    return "\"" + str(value) + "\""
+
+def _row_criteria(row, key_column):
+    # Pins a row read with select(): by its key when the table has one, otherwise by every non-empty cell it had
+    if key_column is not None and row.get(key_column) is not None and _criteria_value(row[key_column]) is not None and str(row[key_column]) != "":
+        columns = [key_column]
+    else:
+        columns = [column for column in row if column != "row_index" and column != "workbook_id" and row[column] is not None and str(row[column]) != "" and _criteria_value(row[column]) is not None]
+    if len(columns) <= 0:
+        raise MissingData("A row without any non-empty cell a criteria can match can't be told apart from the others")
+    return " and ".join(f"\"{column}\" = {_criteria_value(row[column])}" for column in columns)
+
+def _located_row(row):
+    if not isinstance(row, collections.abc.Mapping) or row.get("row_index") is None or row.get("workbook_id") is None:
+        raise MissingData("Every row needs the 'row_index' and 'workbook_id' select() returned it with")
+    return int(row['row_index']), str(row['workbook_id'])
+
+def _delete_many_query(kwargs):
+    _require(kwargs, ["table", "rows"])
+    rows = kwargs['rows']
+    if isinstance(rows, (dict, str, bytes)) or not hasattr(rows, "__iter__"):
+        raise InvalidType("rows must be a list of rows returned by select()")
+    return str(kwargs['table']), [_located_row(row) for row in rows]
+
+def _update_many_query(kwargs, key_column):
+    # Returns [(criteria, workbook_id, data, row_index)], workbook_id is "" & row_index None for the updates given a criteria
+    _require(kwargs, ["table", "updates"])
+    updates = []
+    for update in kwargs['updates']:
+        if not isinstance(update, (tuple, list)) or len(update) != 2:
+            raise InvalidType("updates must be a list of (criteria or row, data) pairs")
+        target, data = update
+        if not isinstance(data, dict):
+            raise InvalidType("data must be a dictionary")
+        if isinstance(target, str):
+            updates.append((target, "", data, None))
+        else:
+            row_index, workbook_id = _located_row(target)
+            updates.append((_row_criteria(target, key_column), workbook_id, data, row_index))
+    return str(kwargs['table']), updates
+
+def _many_options(kwargs):
+    # The per-call options of delete_many()/update_many() passed on to every delete()/update()
+    return {key: value for key, value in kwargs.items() if key in ("workbook_timeout", "deadline", "allow_partial")}
+
+def _key_column(row_index, sharding, table):
+    # The column that tells the rows of a table apart, if any
+    if row_index is not None and row_index.column(table) is not None:
+        return row_index.column(table)
+    if sharding is not None:
+        return sharding.column(table)
+    return None
+
+def _queue_delete_many(batch, kwargs):
+    # The deletes of the same workbook merge into one row_array request, the workbooks are handled concurrently
+    table, rows = _delete_many_query(kwargs)
+    for row_index, workbook_id in rows:
+        batch.delete(table=table, criteria="", row_id=row_index, workbook_id=workbook_id, **_many_options(kwargs))
+
+def _queue_update_many(batch, kwargs, key_column):
+    # Updates of different workbooks run concurrently, the ones of the same workbook in the given order
+    table, updates = _update_many_query(kwargs, key_column)
+    for criteria, workbook_id, data, row_index in updates:
+        options = _many_options(kwargs)
+        if row_index is not None:
+            # Answered by _update_row(), which tells when more than the row was updated
+            options['row_index'] = row_index
+        batch.update(table=table, criteria=criteria, data=data, workbook_id=workbook_id, **options)
+
+class _KeyLookup:
+    # The per-call side of a key based update()/delete()
+    def __init__(self, row_index, table, kwargs):
+        self.row_index = row_index
+        self.table = table
+        self.key = kwargs.get("key")
+        self.column = None
+        self.location = None
+        if self.key is None:
+            return
+        if row_index is None or row_index.column(table) is None:
+            raise MissingData(f"No key column was declared for the table '{table}'")
+        self.column = row_index.column(table)
+
+    def criteria(self, criteria):
+        if self.key is None:
+            return criteria
+        value = _criteria_value(self.key)
+        if value is None:
+            raise InvalidType(f"The key {self.key!r} can't be matched by a criteria")
+        key_criteria = f"\"{self.column}\" = {value}"
+        if criteria.strip() == "":
+            return key_criteria
+        return f"({criteria}) and {key_criteria}"
+
+    def workbook(self):
+        if self.key is None:
+            return None
+        self.location = self.row_index.locate(self.table, self.key)
+        if self.location is None:
+            return None
+        return self.location[0]
+
+    def stale(self):
+        self.row_index.discard(self.table, self.key, True)
+        self.location = None
+
+    def updated(self, workbooks, data):
+        if self.key is None:
+            return
+        if len(workbooks) > 0:
+            row = self.location[1] if self.location is not None and self.location[0] == workbooks[0] else None
+            self.row_index.put(self.table, self.key, workbooks[0], row)
+            if self.column in data and str(data[self.column]) != str(self.key):
+                self.row_index.rename(self.table, self.key, data[self.column])
+
+    def deleted(self, workbook, count):
+        if self.key is not None and self.location is not None and self.location[0] == workbook and self.location[1] is not None and count == 1:
+            self.row_index.rows_deleted(self.table, workbook, [self.location[1]])
+        else:
+            self.row_index.forget_rows(self.table, workbook)
+        if self.key is not None:
+            self.row_index.discard(self.table, self.key)
+
+class _Write:
+    # The per-call side of update()/delete(): the workbooks to ask, whether to ask them all again, then the bookkeeping
+    # of their answers (_Update & _Delete)
+    def __init__(self, db, kwargs, table, criteria, workbook_id):
+        self.db = db
+        self.table = table
+        self.workbook_id = workbook_id
+        self.lookup = _KeyLookup(db.row_index, table, kwargs)
+        self.criteria = self.lookup.criteria(criteria)
+        db._check_criteria(self.criteria)
+        self.workbook_timeout, self.deadline, self.allow_partial = _fanout_options(kwargs, db.workbook_timeout, db.deadline)
+
+    def located(self):
+        # The workbook the call names or the key index points at, None when it goes to every workbook of the shard
+        if self.workbook_id and self.workbook_id != "":
+            return [self.workbook_id]
+        located = self.lookup.workbook()
+        return [located] if located else None
+
+    def workbooks(self, workbookids):
+        return _shard_targets(self.db.sharding, self.table, self.criteria, workbookids)
+
+    def missed(self, succeeded, failures):
+        # Whether the index pointed at the wrong workbook: then every workbook is asked & the answer remembered
+        if self.lookup.location is None or len(failures) > 0 or any(self.count(res) >= 1 for workbook, res in succeeded):
+            return False
+        self.lookup.stale()
         return True
-            
-    def __release_and_return(self, return_value, table):
-        self.__release(table)
-        return return_value
 
-    def set(self, table, key, value):
-        self.__wait_till_released(table)
-        self.__lock(table)
-        if not Path(f"{self.cache_path}/{table}.json").exists():
-            with open(f"{self.cache_path}/{table}.json", "w") as f:
-                data = {}
-                data[key] = value
-                f.write(json.dumps(data))
-                return self.__release_and_return(True, table)
-        with open(f"{self.cache_path}/{table}.json", "r") as f:
-            try:
-                data = json.loads(f.read())
-            except json.decoder.JSONDecodeError:
-                self.__release(table)
-                raise CorruptedCacheTable
-            data[key] = value
-            with open(f"{self.cache_path}/{table}.json", "w") as fw:
-                fw.write(json.dumps(data))
-                return self.__release_and_return(True, table)
-        return self.__release_and_return(False, table)
-                
-    def get(self, table, key):
-        if not Path(f"{self.cache_path}/{table}.json").exists():
-            raise InvalidCacheTable
-        with open(f"{self.cache_path}/{table}.json", "r") as f:
-            try:
-                data = json.loads(f.read())
-            except json.decoder.JSONDecodeError:
-                raise CorruptedCacheTable
-            if key in data:
-                return data[key]
+    def counts(self, succeeded, failures):
+        # The rows of each workbook that answered, the failures & whether they're allowed
+        return {workbook: self.count(res) for workbook, res in succeeded}, failures, self.allow_partial
+
+class _Update(_Write):
+    def __init__(self, db, kwargs):
+        table, criteria, self.data, workbook_id = _update_query(kwargs)
+        super().__init__(db, kwargs, table, criteria, workbook_id)
+        _check_shard_update(db.sharding, table, self.criteria, self.data)
+
+    def payload(self, token):
+        return _update_payload(token, self.table, self.criteria, self.data)
+
+    def count(self, res):
+        return _affected_rows(res)
+
+    def answered(self, succeeded, failures):
+        self.lookup.updated([workbook for workbook, res in succeeded if _affected_rows(res) >= 1], self.data)
+        _mirror_update(self.db.replica, self.table, self.criteria, self.data, succeeded, failures)
+        return self.counts(succeeded, failures)
+
+class _Delete(_Write):
+    def __init__(self, db, kwargs):
+        table, criteria, workbook_id, self.rowid = _delete_query(kwargs)
+        super().__init__(db, kwargs, table, criteria, workbook_id)
+
+    def payload(self, token):
+        return _delete_payload(token, self.table, self.criteria, self.rowid)
+
+    def count(self, res):
+        return _deleted_rows(res)
+
+    def answered(self, succeeded, failures):
+        affected_workbooks = []
+        for workbook, res in succeeded:
+            deleted = _deleted_rows(res)
+            if deleted >= 1:
+                self.db.capacity.deleted(workbook, self.table, deleted)
+                if self.db.row_index is not None:
+                    if self.rowid != "":
+                        self.db.row_index.rows_deleted(self.table, workbook, json.loads(self.rowid))
+                    else:
+                        self.lookup.deleted(workbook, deleted)
+                if not workbook in affected_workbooks:
+                    affected_workbooks.append(workbook)
+        _mirror_delete(self.db.replica, self.table, self.criteria, self.rowid, succeeded, failures)
+        if len(affected_workbooks) > 0:
+            _unmark_full(self.db.cache, affected_workbooks)
+        return self.counts(succeeded, failures)
+
+class ZohoInsertBuffer:
+    def __init__(self, db, max_rows = 500, max_delay = 0.5):
+        self.db = db
+        self.max_rows = int(max_rows)
+        self.max_delay = float(max_delay)
+        self.flushes = 0
+        self.__rows = {}
+        self.__pending = set()
+        self.__condition = threading.Condition()
+        self.__closed = False
+        # insert() queues its workbook requests on db.pool, running the flushes there too could leave every pool thread
+        # waiting on requests queued behind it
+        self.__executor = ThreadPoolExecutor(max_workers=self.db.max_threads, thread_name_prefix="zohodb-insert-buffer")
+        self.__thread = threading.Thread(target=self.__run, name="zohodb-insert-buffer", daemon=True)
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def add(self, table, row):
+        if not isinstance(row, dict):
+            raise InvalidType("row must be a dictionary")
+        future = Future()
+        with self.__condition:
+            if self.__closed:
+                raise MissingData("The insert buffer has been closed")
+            rows = self.__rows.setdefault(str(table), [])
+            rows.append((row, future, time.monotonic()))
+            # The first row of a table starts its max_delay clock, the flusher may be waiting with no deadline
+            if len(rows) == 1 or len(rows) >= self.max_rows:
+                self.__condition.notify()
+        return future
+
+    def __due(self, now):
+        due = []
+        for table, rows in self.__rows.items():
+            if len(rows) >= self.max_rows or now - rows[0][2] >= self.max_delay:
+                due.append(table)
+        return due
+
+    def __take(self, tables):
+        batches = []
+        for table in tables:
+            rows = self.__rows.pop(table, [])
+            for start in range(0, len(rows), self.max_rows):
+                batches.append((table, rows[start:start + self.max_rows]))
+        return batches
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__closed:
+                    due = self.__due(time.monotonic())
+                    if due:
+                        break
+                    if self.__rows:
+                        oldest = min(rows[0][2] for rows in self.__rows.values())
+                        self.__condition.wait(max(0.0, oldest + self.max_delay - time.monotonic()))
+                    else:
+                        self.__condition.wait()
+                if self.__closed and not self.__rows:
+                    return
+                # Submitting while holding the lock lets flush() see every batch taken so far
+                for table, rows in self.__take(self.__due(time.monotonic()) if not self.__closed else list(self.__rows)):
+                    self.__submit(table, rows)
+
+    def __submit(self, table, rows):
+        with self.__condition:
+            future = self.__executor.submit(self.__write, table, rows)
+            self.__pending.add(future)
+            self.flushes += 1
+        future.add_done_callback(self.__done)
+
+    def __done(self, future):
+        with self.__condition:
+            self.__pending.discard(future)
+            self.__condition.notify_all()
+
+    def __write(self, table, rows):
+        try:
+            result = self.db.insert(table=table, data=[row for row, future, queued_at in rows])
+        except Exception as e:
+            for row, future, queued_at in rows:
+                future.set_exception(e)
+            return
+        for index, (row, future, queued_at) in enumerate(rows):
+            if result.workbooks[index] is None:
+                future.set_exception(UnexpectedResponse("No workbook could take the row"))
             else:
-                return None
-                
-    def delete(self, table, key):
-        if not Path(f"{self.cache_path}/{table}.json").exists():
-            raise InvalidCacheTable
-        self.__wait_till_released(table)
-        self.__lock(table)
-        with open(f"{self.cache_path}/{table}.json", "r") as f:
-            try:
-                data = json.loads(f.read())
-            except json.decoder.JSONDecodeError:
-                self.__release(table)
-                raise CorruptedCacheTable
-            if key in data:
-                del data[key]
+                future.set_result({"workbook_id": result.workbooks[index], "row_index": result.row_indexes[index]})
+
+    def flush(self, table = None):
+        with self.__condition:
+            for table_name, rows in self.__take([str(table)] if table is not None else list(self.__rows)):
+                self.__submit(table_name, rows)
+            while self.__pending:
+                self.__condition.wait()
+
+    def close(self):
+        with self.__condition:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__thread.join()
+        self.flush()
+        self.__executor.shutdown()
+        atexit.unregister(self.close)
+
+class _BatchGroup:
+    def __init__(self, kind, table, workbooks, kwargs):
+        self.kind = kind
+        self.table = table
+        # The workbooks the group can touch, None when it may touch any of them
+        self.workbooks = workbooks
+        self.kwargs = kwargs
+        self.operations = []
+        self.depends = []
+
+    def conflicts(self, table, workbooks):
+        if self.table != table:
+            return False
+        return self.workbooks is None or workbooks is None or len(self.workbooks & workbooks) > 0
+
+    def merge_key(self):
+        if self.kind != "insert" and self.kind != "delete_rows":
+            return None
+        if self.kind == "delete_rows" and _workbook_id_arg(self.kwargs) == "":
+            # Without a workbook every workbook deletes the row indexes, the count Zoho answers with can't be split per row
+            return None
+        # Only operations that differ in nothing but their rows can share a request
+        options = tuple(sorted((key, repr(value)) for key, value in self.kwargs.items() if not key in ("data", "row_id", "row_ids")))
+        return (self.kind, options)
+
+def _batch_operation(kind, kwargs):
+    # Validates a queued operation the same way the direct call would, returns (kind, table, workbooks)
+    if kind == "insert":
+        table, data = _insert_query(kwargs)
+        return "insert", table, None
+    if kind == "update":
+        table, criteria, data, workbook_id = _update_query(kwargs)
+        if "row_index" in kwargs:
+            kind = "update_row"
+    else:
+        table, criteria, workbook_id, rowid = _delete_query(kwargs)
+        if rowid != "" and not "key" in kwargs:
+            kind = "delete_rows"
+    return kind, table, {workbook_id} if workbook_id else None
+
+def _plan_batch(operations):
+    # operations: [(kind, kwargs, future)] in the order they were queued
+    groups = []
+    for kind, kwargs, future in operations:
+        kind, table, workbooks = _batch_operation(kind, kwargs)
+        group = _BatchGroup(kind, table, workbooks, kwargs)
+        key = group.merge_key()
+        target = None
+        if key is not None:
+            # Merge into an earlier group of the same kind unless something queued since then touches the same rows
+            for candidate in reversed(groups):
+                if candidate.merge_key() == key:
+                    target = candidate
+                    break
+                if candidate.conflicts(table, workbooks):
+                    break
+        if target is None:
+            group.depends = [earlier for earlier in groups if earlier.conflicts(table, workbooks)]
+            groups.append(group)
+            target = group
+        target.operations.append((kwargs, future))
+    return groups
+
+def _batch_call(group):
+    # The (method, kwargs) a group runs as
+    if group.kind == "update_row":
+        return "_update_row", group.kwargs
+    if len(group.operations) == 1:
+        return group.kind.split("_")[0], group.kwargs
+    if group.kind == "insert":
+        return "insert", dict(group.kwargs, data=[row for kwargs, future in group.operations for row in kwargs['data']])
+    kwargs = {key: value for key, value in group.kwargs.items() if key != "row_id"}
+    kwargs['row_ids'] = [row_id for operation, future in group.operations for row_id in _delete_row_ids(operation)]
+    return "_delete_rows", kwargs
+
+def _batch_resolve(group, result, error):
+    if error is not None:
+        for kwargs, future in group.operations:
+            future.set_exception(error)
+        return
+    if group.kind == "insert":
+        offset = 0
+        for kwargs, future in group.operations:
+            future.set_result(result.slice(offset, len(kwargs['data'])))
+            offset += len(kwargs['data'])
+        return
+    if group.kind == "delete_rows" and len(group.operations) > 1:
+        # result holds an outcome per row index, in the order the operations were merged
+        offset = 0
+        for kwargs, future in group.operations:
+            count = len(_delete_row_ids(kwargs))
+            outcomes = result[offset:offset + count]
+            offset += count
+            errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+            if len(errors) > 0:
+                future.set_exception(errors[0])
             else:
-                return self.__release_and_return(False, table)
-            with open(f"{self.cache_path}/{table}.json", "w") as fw:
-                fw.write(json.dumps(data))
-                return self.__release_and_return(True, table)
-        return self.__release_and_return(False, table)
-
-class ZohoAuthHandler:
-    def __init__(self, client_id, client_secret):
+                future.set_result(all(outcomes))
+        return
+    for kwargs, future in group.operations:
+        future.set_result(result)
+
+def _batch_results(futures):
+    return [future.exception() if future.exception() is not None else future.result() for future in futures]
+
+class BaseZohoBatch:
+    def __init__(self, db):
+        self.db = db
+        self.results = None
+        self.requests = 0
+        self._operations = []
+
+    def _queue(self, kind, kwargs):
+        if self.results is not None:
+            raise MissingData("The batch has already been executed")
+        _batch_operation(kind, kwargs)
+        future = Future()
+        self._operations.append((kind, kwargs, future))
+        return future
+
+    def insert(self, **kwargs):
+        return self._queue("insert", kwargs)
+
+    def update(self, **kwargs):
+        return self._queue("update", kwargs)
+
+    def delete(self, **kwargs):
+        return self._queue("delete", kwargs)
+
+class ZohoBatch(BaseZohoBatch):
+    def __init__(self, db, max_workers = None):
+        super().__init__(db)
+        self.max_workers = max_workers
+
+    def __run(self, group):
+        for dependency in group.depends:
+            dependency.done.wait()
+        method, kwargs = _batch_call(group)
+        try:
+            result = getattr(self.db, method)(**kwargs)
+        except Exception as e:
+            _batch_resolve(group, None, e)
+        else:
+            _batch_resolve(group, result, None)
+        finally:
+            group.done.set()
+
+    def execute(self):
+        groups = _plan_batch(self._operations)
+        self.requests = len(groups)
+        if len(groups) > 0:
+            for group in groups:
+                group.done = threading.Event()
+            # Groups wait for the groups they depend on, which were submitted (and so started) before them.
+            # A pool of our own keeps them from starving the workbook requests queued on db.pool
+            workers = min(len(groups), self.max_workers or self.db.max_threads)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zohodb-batch") as executor:
+                for group in groups:
+                    executor.submit(self.__run, group)
+        self.results = _batch_results([future for kind, kwargs, future in self._operations])
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+class AsyncZohoBatch(BaseZohoBatch):
+    async def __run(self, group, tasks):
+        await asyncio.gather(*[tasks[dependency] for dependency in group.depends], return_exceptions=True)
+        method, kwargs = _batch_call(group)
+        try:
+            result = await getattr(self.db, method)(**kwargs)
+        except Exception as e:
+            _batch_resolve(group, None, e)
+        else:
+            _batch_resolve(group, result, None)
+
+    async def execute(self):
+        groups = _plan_batch(self._operations)
+        self.requests = len(groups)
+        tasks = {}
+        for group in groups:
+            tasks[group] = asyncio.ensure_future(self.__run(group, tasks))
+        await asyncio.gather(*tasks.values())
+        self.results = _batch_results([future for kind, kwargs, future in self._operations])
+        return self.results
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.execute()
+
+class BaseZohoAuthHandler:
+    def __init__(self, client_id, client_secret, http_client = None, refresh_margin = 60, metrics = None, cache_root = None):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.http_client = http_client
+        self.metrics = metrics
+        self.refresh_margin = int(refresh_margin)
+        self._token_data = None
         if not self.client_id or not self.client_secret:
             raise MissingData("Missing the Zoho authentication credentials")
         self.hash = hashlib.md5((str(self.client_id) + ":" + str(self.client_secret)).encode('utf-8')).hexdigest()
-        self.cache_path = f"./.zohodb/auth_cache/{self.hash}"
+        self.cache_root = _cache_root(cache_root)
+        self.cache_path = f"{self.cache_root}/auth_cache/{self.hash}"
         Path(f"{self.cache_path}").mkdir(parents=True, exist_ok=True)
+        self.redirecturi = urllib.parse.quote_plus("https://example.com")
+
+    def _authorization_prompt(self):
+        request_code_params = [
+            "response_type=code",
+            f"client_id={self.client_id}",
+            "scope=ZohoSheet.dataAPI.UPDATE,ZohoSheet.dataAPI.READ",
+            f"redirect_uri={self.redirecturi}",
+            "access_type=offline",
+            "prompt=consent"
+        ]
+        print(f"Please visit this URL: {ZOHO_OAUTH_API_BASE}/auth?" + "&".join(request_code_params))
+        return "Paste the URL you've been redirected to after authorizing the app here (be fast here before the code expires): "
+
+    def _token_url(self, code):
+        request_token_params = [
+            f"code={code}",
+            f"client_id={self.client_id}",
+            f"client_secret={self.client_secret}",
+            f"redirect_uri={self.redirecturi}",
+            "grant_type=authorization_code"
+        ]
+        return f"{ZOHO_OAUTH_API_BASE}/token?" + "&".join(request_token_params)
+
+    def _refresh_url(self, refresh_token):
+        req_params = "&".join([
+            f"client_id={self.client_id}",
+            f"client_secret={self.client_secret}",
+            "grant_type=refresh_token",
+            f"refresh_token={refresh_token}"
+        ])
+        return f"{ZOHO_OAUTH_API_BASE}/token?{req_params}"
+
+    def _write_token(self, data):
+        # Write to a temporary file first so a crash (or another writer) never leaves a half-written token.json
+        tmp_path = f"{self.cache_path}/token.json.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(data))
+        os.replace(tmp_path, f"{self.cache_path}/token.json")
+        self._token_data = data
+
+    def _store_fetched_token(self, tokenreq, ts):
+        tokenres = _parse_json(tokenreq, "token generation")
+        if not "access_token" in tokenres:
+            raise UnexpectedResponse("Failed to obtain an access token")
+        tokenres['created_at'] = ts
+        self._write_token(tokenres)
+        return tokenres['access_token']
+
+    def _store_refreshed_token(self, req, ts):
+        res = _parse_json(req, "token renewal")
+        if not "access_token" in res:
+            raise UnexpectedResponse("Failed to refresh the access token")
+        data = dict(self._cached_token())
+        data['access_token'] = res['access_token']
+        data['created_at'] = ts
+        data['expires_in'] = res['expires_in']
+        self._write_token(data)
+        return res['access_token']
+
+    def _cached_token(self):
+        if self._token_data is not None:
+            return self._token_data
+        if not Path(f"{self.cache_path}/token.json").exists():
+            self._token_data = {}
+            return self._token_data
+        with open(f"{self.cache_path}/token.json", "r") as f:
+            try:
+                self._token_data = json.loads(f.read())
+            except json.decoder.JSONDecodeError:
+                self._token_data = {}
+        return self._token_data
+
+    def _reload_token(self):
+        # Another process sharing the cache root may have refreshed the token since we read it
+        self._token_data = None
+        return self._cached_token()
+
+    def _lock_refresh(self, blocking = True):
+        # An flock() on the auth cache lets a single process (out of all the ones sharing it) refresh the token at a time.
+        # Returns the locked file, or None if blocking is False and another process holds the lock
+        lock_file = open(f"{self.cache_path}/token.lock", "a")
+        if fcntl is None:
+            return lock_file
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def _unlock_refresh(self, lock_file):
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+    @contextlib.contextmanager
+    def _refresh_lock(self):
+        lock_file = self._lock_refresh()
+        try:
+            yield
+        finally:
+            self._unlock_refresh(lock_file)
+
+    @contextlib.asynccontextmanager
+    async def _refresh_lock_async(self):
+        # Polls instead of blocking the event loop while another process refreshes
+        lock_file = self._lock_refresh(blocking=False)
+        while lock_file is None:
+            await asyncio.sleep(0.05)
+            lock_file = self._lock_refresh(blocking=False)
+        try:
+            yield
+        finally:
+            self._unlock_refresh(lock_file)
+
+    def _token_usable(self, data):
+        return "access_token" in data and "refresh_token" in data and "expires_in" in data and "created_at" in data
+
+    def _token_ttl(self, data):
+        return (int(data['created_at']) + int(data['expires_in'])) - calendar.timegm(time.gmtime())
+
+    def _token_expired(self, data):
+        return self._token_ttl(data) <= 0
+
+    def _record_refresh(self, kind, start, ok):
+        if self.metrics is not None:
+            self.metrics.token_refresh(kind, time.perf_counter() - start, ok)
+
+    def _record_lookup(self, start):
+        if self.metrics is not None:
+            self.metrics.phase("token", time.perf_counter() - start)
+
+class ZohoAuthHandler(BaseZohoAuthHandler):
+    def __init__(self, client_id, client_secret, http_client = None, refresh_margin = 60, metrics = None, cache_root = None):
+        super().__init__(client_id, client_secret, http_client, refresh_margin, metrics, cache_root)
+        self.__lock = threading.Lock()
+
+    def __http(self):
+        if self.http_client is None:
+            return httpx
+        return self.http_client
     
     def __fetch_token(self):
-        redirecturi = urllib.parse.quote_plus("https://example.com")
-        request_code_params = [
-            "response_type=code",
-            f"client_id={self.client_id}",
-            "scope=ZohoSheet.dataAPI.UPDATE,ZohoSheet.dataAPI.READ",
-            f"redirect_uri={redirecturi}",
-            "access_type=offline",
-            "prompt=consent"
-        ]
-        print(f"Please visit this URL: {ZOHO_OAUTH_API_BASE}/auth?" + "&".join(request_code_params))
-        url = input("Paste the URL you've been redirected to after authorizing the app here (be fast here before the code expires): ")
-        urlparams = url.split("/")[3].split("&")
-        code = ""
-        for param in urlparams:
-            try:
-                key = param.split("=")[0]
-                val = param.split("=")[1]
-                if key == 'code' or key == '?code':
-                    code = val
-                    break
-            except IndexError:
-                continue
-        request_token_params = [
-            f"code={code}",
-            f"client_id={self.client_id}",
-            f"client_secret={self.client_secret}",
-            f"redirect_uri={redirecturi}",
-            "grant_type=authorization_code"
-        ]
+        url = input(self._authorization_prompt())
         ts = calendar.timegm(time.gmtime())
+        start = time.perf_counter()
+        ok = False
         try:
-            tokenreq = httpx.post(f"{ZOHO_OAUTH_API_BASE}/token?" + "&".join(request_token_params))
+            tokenreq = self.__http().post(self._token_url(_oauth_code(url)))
+            token = self._store_fetched_token(tokenreq, ts)
+            ok = True
         except httpx.RequestError as e:
             raise HttpRequestError(f"Failed to request an access token: {e}")
-        try:
-            tokenres = json.loads(tokenreq.text)
-        except json.decoder.JSONDecodeError as e:
-            raise InvalidJsonResponse(f"Failed to parse the token generation response: {e}")
-        if not "access_token" in tokenres:
-            raise UnexpectedResponse("Failed to obtain an access token")
-        tokenres['created_at'] = ts
-        with open(f"{self.cache_path}/token.json", "w") as f:
-            f.write(json.dumps(tokenres))
-        return tokenres['access_token']
+        finally:
+            self._record_refresh("authorization_code", start, ok)
+        return token
         
     def __refresh_token(self, refresh_token):
-        req_params = "&".join([
-            f"client_id={self.client_id}",
-            f"client_secret={self.client_secret}",
-            "grant_type=refresh_token",
-            f"refresh_token={refresh_token}"
-        ])
         ts = calendar.timegm(time.gmtime())
+        start = time.perf_counter()
+        ok = False
         try:
-            req = httpx.post(f"{ZOHO_OAUTH_API_BASE}/token?{req_params}")
+            req = self.__http().post(self._refresh_url(refresh_token))
+            token = self._store_refreshed_token(req, ts)
+            ok = True
         except httpx.RequestError as e:
             raise HttpRequestError(f"Failed to request an access token renewal: {e}")
-        try:    
-            res = json.loads(req.text)
-        except json.decoder.JSONDecodeError as e:
-            raise InvalidJsonResponse(f"Failed to parse the token renewal response: {e}")
-        if not "access_token" in res:
-            raise UnexpectedResponse("Failed to refresh the access token")
-        with open(f"{self.cache_path}/token.json", "r") as f:
-            data = json.loads(f.read())
-            data['access_token'] = res['access_token']
-            data['created_at'] = ts
-            data['expires_in'] = res['expires_in']
-            with open(f"{self.cache_path}/token.json", "w") as fw:
-                fw.write(json.dumps(data))
-        return res['access_token']
-        
+        finally:
+            self._record_refresh("refresh", start, ok)
+        return token
+
+    def __background_refresh(self):
+        # Runs with self.__lock already acquired by token()
+        try:
+            with self._refresh_lock():
+                data = self._reload_token()
+                if self._token_usable(data) and self._token_ttl(data) <= self.refresh_margin:
+                    self.__refresh_token(data['refresh_token'])
+        except Exception:
+            # The token is still valid; token() refreshes synchronously once it actually expires
+            pass
+        finally:
+            self.__lock.release()
+
     def token(self):
-        if not Path(f"{self.cache_path}/token.json").exists():
-            with open(f"{self.cache_path}/token.json", "w") as f:
-                f.write("{}")
-        with open(f"{self.cache_path}/token.json", "r") as f:
-            data = json.loads(f.read())
-            if not "access_token" in data or not "refresh_token" in data or not "expires_in" in data or not "created_at" in data:
+        if self.metrics is None:
+            return self.__token()
+        start = time.perf_counter()
+        try:
+            return self.__token()
+        finally:
+            self._record_lookup(start)
+
+    def __token(self):
+        data = self._cached_token()
+        if self._token_usable(data):
+            ttl = self._token_ttl(data)
+            if ttl > self.refresh_margin:
+                return data['access_token']
+            if ttl > 0:
+                if self.__lock.acquire(blocking=False):
+                    threading.Thread(target=self.__background_refresh, daemon=True).start()
+                return data['access_token']
+        # Single-flight: one thread (of one process) talks to the OAuth server while the others wait for its result
+        with self.__lock, self._refresh_lock():
+            data = self._reload_token()
+            if not self._token_usable(data):
                 return self.__fetch_token()
-            if (int(data['created_at']) + int(data['expires_in'])) <= calendar.timegm(time.gmtime()):
+            if self._token_expired(data):
                 return self.__refresh_token(data['refresh_token'])
             return data['access_token']
 
-class ZohoDB:
-    def __init__(self, AuthHandler, workbooks, max_threads = 24):
-        if not isinstance(AuthHandler, ZohoAuthHandler):
-            raise InvalidType("Invalid ZohoAuthHandler instance passed")
+class AsyncZohoAuthHandler(BaseZohoAuthHandler):
+    def __init__(self, client_id, client_secret, http_client = None, refresh_margin = 60, metrics = None, cache_root = None):
+        super().__init__(client_id, client_secret, http_client, refresh_margin, metrics, cache_root)
+        self.__lock = None
+        # The event loop only keeps a weak reference to a task, so the running background refresh is kept here
+        self.__refresh_task = None
+
+    async def __post(self, url):
+        if self.http_client is None:
+            async with httpx.AsyncClient() as client:
+                return await client.post(url)
+        return await self.http_client.post(url)
+
+    async def __fetch_token(self):
+        url = await asyncio.get_running_loop().run_in_executor(None, input, self._authorization_prompt())
+        ts = calendar.timegm(time.gmtime())
+        start = time.perf_counter()
+        ok = False
+        try:
+            tokenreq = await self.__post(self._token_url(_oauth_code(url)))
+            token = self._store_fetched_token(tokenreq, ts)
+            ok = True
+        except httpx.RequestError as e:
+            raise HttpRequestError(f"Failed to request an access token: {e}")
+        finally:
+            self._record_refresh("authorization_code", start, ok)
+        return token
+
+    async def __refresh_token(self, refresh_token):
+        ts = calendar.timegm(time.gmtime())
+        start = time.perf_counter()
+        ok = False
+        try:
+            req = await self.__post(self._refresh_url(refresh_token))
+            token = self._store_refreshed_token(req, ts)
+            ok = True
+        except httpx.RequestError as e:
+            raise HttpRequestError(f"Failed to request an access token renewal: {e}")
+        finally:
+            self._record_refresh("refresh", start, ok)
+        return token
+
+    async def __background_refresh(self):
+        try:
+            async with self.__lock, self._refresh_lock_async():
+                data = self._reload_token()
+                if self._token_usable(data) and self._token_ttl(data) <= self.refresh_margin:
+                    await self.__refresh_token(data['refresh_token'])
+        except Exception:
+            pass
+
+    def __refresh_done(self, task):
+        if self.__refresh_task is task:
+            self.__refresh_task = None
+        if not task.cancelled():
+            task.exception()
+
+    async def token(self):
+        if self.metrics is None:
+            return await self.__token()
+        start = time.perf_counter()
+        try:
+            return await self.__token()
+        finally:
+            self._record_lookup(start)
+
+    async def __token(self):
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        data = self._cached_token()
+        if self._token_usable(data):
+            ttl = self._token_ttl(data)
+            if ttl > self.refresh_margin:
+                return data['access_token']
+            if ttl > 0:
+                if self.__refresh_task is None and not self.__lock.locked():
+                    self.__refresh_task = asyncio.ensure_future(self.__background_refresh())
+                    self.__refresh_task.add_done_callback(self.__refresh_done)
+                return data['access_token']
+        # Only one coroutine (of one process) talks to the OAuth server, the rest re-read its result
+        async with self.__lock, self._refresh_lock_async():
+            data = self._reload_token()
+            if not self._token_usable(data):
+                return await self.__fetch_token()
+            if self._token_expired(data):
+                return await self.__refresh_token(data['refresh_token'])
+            return data['access_token']
+
+class BaseZohoDB:
+    def __init__(self, AuthHandler, workbooks, cache_backend = None, query_cache = None, validate_criteria = False, capacity_tracker = None, workbook_timeout = None, deadline = None, rate_limiter = None, retry_policy = None, keys = None, metrics = None, replica_path = None, metadata = None, validate_schema = False, cache_root = None, shard_keys = None):
         if not isinstance(workbooks, list):
             raise InvalidJsonResponse("Invalid workbooks list passed")
         if len(workbooks) <= 0:
             raise EmptyInput("Couldn't find any workbook names to use")
         self.AuthHandler = AuthHandler
         self.workbooks = workbooks
-        self.max_threads = int(max_threads)
         self.hash = hashlib.md5(str(self.workbooks).encode('utf-8')).hexdigest()
-        self.cache = ZohoDBCache(self.hash)
+        if metrics is not None and not isinstance(metrics, ZohoMetrics):
+            raise InvalidType("Invalid ZohoMetrics instance passed")
+        self.metrics = metrics
+        # Every process pointed at the same cache root shares the workbook IDs, the full workbook markers & the schema
+        if cache_root is None:
+            cache_root = AuthHandler.cache_root
+        self.cache_root = cache_root
+        self.cache = ZohoDBCache(self.hash, cache_backend, metrics=metrics, cache_root=cache_root)
+        if query_cache is not None and not isinstance(query_cache, ZohoQueryCache):
+            raise InvalidType("Invalid ZohoQueryCache instance passed")
+        self.query_cache = query_cache
+        self.validate_criteria = validate_criteria
+        if capacity_tracker is None:
+            capacity_tracker = ZohoCapacityTracker(self.cache)
+        self.capacity = capacity_tracker
+        if metadata is None:
+            metadata = ZohoMetadataCache(self.cache)
+        self.metadata = metadata
+        self.validate_schema = validate_schema
+        self.workbook_timeout = workbook_timeout
+        self.deadline = deadline
+        self.rate_limiter = rate_limiter
+        if retry_policy is None:
+            retry_policy = ZohoRetryPolicy()
+        self.retry_policy = retry_policy
+        self.row_index = ZohoRowIndex(keys) if keys else None
+        self.sharding = ZohoSharding(shard_keys) if shard_keys else None
+        if replica_path is None:
+            replica_path = f"{self.cache_root}/replica/{self.hash}.sqlite3"
+        self.replica_path = replica_path
+        # A replica left by an earlier run keeps receiving our writes, otherwise it's created by the first sync()
+        self.replica = ZohoReplica(replica_path) if Path(replica_path).exists() else None
+        # Inserts into the same worksheet take turns (see _InsertRouting.landed)
+        self._insert_locks = {}
+        self.client = None
+        self._shares_client = False
+
+    def _attach_client(self, client):
+        # Called once every argument was checked, so a bad one doesn't leave a connection pool behind.
+        # The OAuth calls reuse our connection pool unless the handler brought its own
+        self.client = client
+        if self.AuthHandler.http_client is None:
+            self.AuthHandler.http_client = client
+            self._shares_client = True
+        if self.AuthHandler.metrics is None:
+            self.AuthHandler.metrics = self.metrics
+
+    def _detach_client(self):
+        if self._shares_client and self.AuthHandler.http_client is self.client:
+            self.AuthHandler.http_client = None
+        self._shares_client = False
+
+    def escape(self, criteria, parameters):
+        return _escape(criteria, parameters)
+
+    def _check_criteria(self, criteria):
+        if self.validate_criteria:
+            parse_criteria(criteria)
+
+    def _invalidate(self, table):
+        if self.query_cache is not None:
+            self.query_cache.invalidate(table)
+
+    def _stale_capacity(self, workbookids, table):
+        return [workbook for workbook in workbookids if self.capacity.needs_refresh(workbook, table)]
+
+    def _refreshed(self, table, succeeded, failures):
+        for workbook, res in succeeded:
+            self.capacity.refreshed(workbook, table, _used_area(res))
+        for workbook in failures:
+            self.capacity.refreshed(workbook, table, None)
+
+    def _key_column(self, kwargs):
+        return _key_column(self.row_index, self.sharding, kwargs.get("table"))
+
+class ZohoDB(BaseZohoDB):
+    def __init__(self, AuthHandler, workbooks, max_threads = 24, http2 = False, max_connections = None, max_keepalive_connections = None, keepalive_expiry = 30, timeout = 30, cache_backend = None, query_cache = None, validate_criteria = False, capacity_tracker = None, workbook_timeout = None, deadline = None, rate_limiter = None, retry_policy = None, keys = None, buffer_max_rows = 500, buffer_max_delay = 0.5, metrics = None, replica_path = None, metadata = None, validate_schema = False, cache_root = None, shard_keys = None):
+        if not isinstance(AuthHandler, ZohoAuthHandler):
+            raise InvalidType("Invalid ZohoAuthHandler instance passed")
+        super().__init__(AuthHandler, workbooks, cache_backend, query_cache, validate_criteria, capacity_tracker, workbook_timeout, deadline, rate_limiter, retry_policy, keys, metrics, replica_path, metadata, validate_schema, cache_root, shard_keys)
+        self.max_threads = int(max_threads)
+        if max_connections is None:
+            max_connections = self.max_threads
+        self.pool = ThreadPoolExecutor(max_workers=self.max_threads, thread_name_prefix="zohodb")
+        self.buffer_max_rows = buffer_max_rows
+        self.buffer_max_delay = buffer_max_delay
+        self.__buffer = None
+        self.__buffer_lock = threading.Lock()
+        self.__replica_lock = threading.Lock()
+        self.__insert_locks_guard = threading.Lock()
+        self._attach_client(httpx.Client(**_client_options(http2, max_connections, max_keepalive_connections, keepalive_expiry, timeout)))
+
+    def close(self):
+        if self.__buffer is not None:
+            self.__buffer.close()
+        self._detach_client()
+        self.pool.shutdown(wait=True)
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __request(self, workbook_id, data, timeout = None):
+        attempts = _RequestAttempts(self.metrics, self.retry_policy, workbook_id, data)
+        while True:
+            if self.rate_limiter is not None:
+                attempts.limited(self.rate_limiter.acquire(workbook_id))
+            attempts.sending()
+            try:
+                req = ZohoWorkbookRequest(workbook_id, data, self.client, timeout)
+            except HttpRequestError as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            res, delay = attempts.answered(req)
+            if delay is None:
+                return res
+            time.sleep(delay)
+
+    def __fanout_outcomes(self, workbookids, data, workbook_timeout, deadline):
+        # One request per workbook (each with its own copy of the payload) on the long-lived pool
+        futures = {self.pool.submit(self.__request, workbook, dict(data), workbook_timeout): workbook for workbook in workbookids}
+        done, not_done = wait(futures, timeout=deadline)
+        for future in not_done:
+            future.cancel()
+        outcomes = {}
+        for future in done:
+            try:
+                outcomes[futures[future]] = future.result()
+            except Exception as e:
+                outcomes[futures[future]] = e
+        return outcomes
+
+    def __fanout(self, workbookids, data, workbook_timeout = None, deadline = None):
+        fanout = _Fanout(self.metadata, workbookids, deadline)
+        fanout.outcomes = self.__fanout_outcomes(workbookids, data, workbook_timeout, deadline)
+        vanished = self.__rediscover(fanout.failed())
+        if len(vanished) > 0:
+            replacements, remaining = fanout.replacements(vanished)
+            fanout.outcomes.update(self.__fanout_outcomes(replacements, data, workbook_timeout, remaining))
+        return fanout.result()
+
+    def __rediscover(self, workbookids):
+        # The workbooks (out of the ones whose request failed) that aren't part of the database anymore
+        if len(workbookids) <= 0 or not self.metadata.recheck_due():
+            return []
+        try:
+            current = self.__fetch_workbooks()
+        except (HttpRequestError, UnexpectedResponse, InvalidJsonResponse):
+            return []
+        return _vanished_workbooks(workbookids, current)
 
     def __fetch_workbooks(self):
-        workbookids = []
+        url, headers = _workbook_list_request(self.AuthHandler.token())
         try:
-            req = httpx.get(f"{ZOHO_SHEETS_API_BASE}/workbooks?method=workbook.list",
-            headers={
-                "Authorization": f"Bearer {self.AuthHandler.token()}"
-            })
+            req = self.client.get(url, headers=headers)
         except httpx.RequestError as e:
             raise HttpRequestError(f"Failed to fetch the workbook(s) ID(s): {e}")
-        res = json.loads(req.text)
-        if res['status'] == "failure":
-            raise UnexpectedResponse(res['error_message'])
-        for workbook in res['workbooks']:
-            if workbook['workbook_name'] in self.workbooks:
-                workbookids.append(workbook['resource_id'])
-        if not workbookids or workbookids == []:
-            raise UnexpectedResponse("Unable to find any workbooks with the name(s) specified")
-        self.cache.set("workbooks", "workbooks", workbookids)
-        return workbookids
+        return _fetched_workbooks(self.metadata, req, self.workbooks)
         
     def workbookids(self):
-        try:
-            wbs = self.cache.get("workbooks", "workbooks")
-        except InvalidCacheTable:
-            return self.__fetch_workbooks()
-        if wbs == None or len(wbs) <= 0:
+        wbs = self.metadata.workbookids()
+        if wbs is None:
             return self.__fetch_workbooks()
         return wbs
-            
-    def escape(self, criteria, parameters):
-        for k, v in parameters.items():
-            k = k.strip()
-            v = str(v).replace("\"", "'")
-            criteria = criteria.replace(k, v)
-        return criteria
-     
-    def select(self, **kwargs):
-        requireds = [
-            "table",
-            "criteria"
-        ]
-        for required in requireds:
-            if not required in kwargs:
-                raise MissingData(f"Missing the required argument '{required}'")
-        table = str(kwargs['table'])
-        criteria = str(kwargs['criteria'])
-        if not "columns" in kwargs:
-            columns = []
-        else:
-            columns = kwargs['columns']
-        if not isinstance(columns, list):
-            raise InvalidType("columns must be a list")
+
+    def worksheets(self):
+        worksheets = self.metadata.worksheets()
+        if worksheets is None:
+            succeeded, failures = self.__fanout(self.workbookids(), _worksheets_payload(self.AuthHandler.token()), self.workbook_timeout, self.deadline)
+            worksheets = _fetched_worksheets(self.metadata, succeeded, failures)
+        return worksheets
+
+    def headers(self, table):
+        table = str(table)
+        headers = self.metadata.headers(table)
+        if headers is None:
+            succeeded, failures = self.__fanout(_header_workbooks(self.worksheets(), table), _headers_payload(self.AuthHandler.token(), table), self.workbook_timeout, self.deadline)
+            headers = _fetched_headers(self.metadata, table, succeeded, failures)
+        return headers
+
+    def warmup(self, tables = None):
+        # Resolves the token, the workbook IDs, the worksheet names and the column headers before the first query needs them
+        token = self.AuthHandler.token()
+        self.workbookids()
+        worksheets = self.worksheets()
+        tables, requests = _warmup_requests(worksheets, tables)
+        futures = [self.pool.submit(self.__request, workbook, _headers_payload(token, table)) for table, workbook in requests]
+        headers = _warmed_headers(self.metadata, tables, requests, [future.result() for future in futures])
+        return {"workbooks": self.workbookids(), "worksheets": worksheets, "headers": headers}
+
+    def rebalance(self, table, dry_run = False):
+        # Moves the rows the shard key places in another workbook (e.g. after adding workbooks) to that workbook
+        table = str(table)
         workbookids = self.workbookids()
-        responses = []
-        returned = []
-        with ThreadPoolExecutor(max_workers=self.max_threads) as pool:
-            responses = list(pool.map(ZohoWorkbookRequest, workbookids, [{
-                "access_token": self.AuthHandler.token(),
-                "method": "worksheet.records.fetch",
-                "worksheet_name": table,
-                "criteria": criteria,
-                "column_names": ",".join(columns)
-            }]))
-        for index, res in enumerate(responses):
-            res = json.loads(res.text)
-            if res['status'] == "failure":
-                raise UnexpectedResponse(res['error_message'])
-            returned.extend([dict(record, **{'workbook_id': workbookids[index]}) for record in res['records']])
-        return returned
+        records = self.select(table=table, criteria="", use_cache=False)
+        moves, data, report = _rebalance_plan(self.sharding, table, records, workbookids)
+        if dry_run or len(moves) <= 0:
+            return report
+        inserted = self.insert(table=table, data=data)
+        deletes = _rebalance_deletes(moves, inserted)
+        for workbook, row_indexes in deletes.items():
+            self.delete(table=table, criteria="", row_ids=row_indexes, workbook_id=workbook)
+        report['moved'] = sum(len(row_indexes) for row_indexes in deletes.values())
+        return report
+
+    def __check_schema(self, table, columns):
+        if self.validate_schema:
+            _check_schema(table, self.worksheets(), self.headers(table) if len(columns) > 0 else [], columns)
+
+    def refresh_capacity(self, table, workbookids = None):
+        if workbookids is None:
+            workbookids = self.workbookids()
+        succeeded, failures = self.__fanout(workbookids, _usedarea_payload(self.AuthHandler.token(), str(table)), self.workbook_timeout, self.deadline)
+        self._refreshed(table, succeeded, failures)
+
+    def __refresh_capacity(self, workbookids, table):
+        stale = self._stale_capacity(workbookids, table)
+        if len(stale) > 0:
+            self.refresh_capacity(table, stale)
+
+    def sync(self, table, indexes = None, full = False, page_size = 1000, allow_partial = False, check_rows = 100):
+        table = str(table)
+        with self.__replica_lock:
+            if self.replica is None:
+                self.replica = ZohoReplica(self.replica_path)
+        workbookids = self.workbookids()
+        sync = _ReplicaSync(self.replica, self.capacity, table, indexes, workbookids)
+        succeeded, failures = self.__fanout(workbookids, _usedarea_payload(self.AuthHandler.token(), table), self.workbook_timeout, self.deadline)
+        futures = {workbook.workbook: self.pool.submit(self.__sync_workbook, workbook, page_size) for workbook in sync.workbooks(succeeded, failures, allow_partial, full, check_rows)}
+        return {workbook: future.result() for workbook, future in futures.items()}
+
+    def __sync_workbook(self, sync, page_size):
+        while True:
+            if sync.fetched(self.__sync_records(sync.table, sync.workbook, sync.start, page_size)):
+                return sync.store()
+
+    def __sync_records(self, table, workbook, start, page_size):
+        records = []
+        while True:
+            page = _select_records(workbook, self.__request(workbook, _select_page_payload(self.AuthHandler.token(), table, "", [], start, page_size)))
+            records.extend(page)
+            if len(page) < page_size:
+                return records
+            start += len(page)
+
+    def __measured(self, name, kwargs, function):
+        if self.metrics is None:
+            return function(kwargs)
+        with self.metrics.operation(name, table=kwargs.get("table")):
+            return function(kwargs)
+
+    def select(self, **kwargs):
+        return self.__measured("select", kwargs, self.__select)
+
+    def __select(self, kwargs):
+        select = _Select(self, kwargs)
+        if select.local:
+            return select.local_result()
+        self.__check_schema(select.table, select.columns)
+        cached = select.cached()
+        if cached is not None:
+            return cached
+        succeeded, failures = self.__fanout(select.workbooks(self.workbookids()), select.payload(self.AuthHandler.token()), select.workbook_timeout, select.deadline)
+        return select.result(succeeded, failures)
+
+    def select_iter(self, **kwargs):
+        pages = _SelectPages(self, kwargs)
+        self.__check_schema(pages.table, pages.columns)
+        for workbook in pages.workbooks(self.workbookids()):
+            while pages.more(workbook):
+                for record in pages.page(self.__request(workbook, pages.payload(self.AuthHandler.token()))):
+                    yield record
         
+    def __recount(self, table, workbook):
+        # Reads the used area in the calling thread (inserts may run on the pool, so refresh_capacity() could wait on itself)
+        try:
+            used_area = _used_area(self.__request(workbook, _usedarea_payload(self.AuthHandler.token(), table)))
+        except (HttpRequestError, UnexpectedResponse, InvalidJsonResponse):
+            used_area = None
+        self.capacity.refreshed(workbook, table, used_area)
+
+    def __insert_lock(self, workbook, table):
+        with self.__insert_locks_guard:
+            if not (workbook, table) in self._insert_locks:
+                self._insert_locks[(workbook, table)] = threading.Lock()
+            return self._insert_locks[(workbook, table)]
+
+    def __insert_into(self, routing, table, workbook):
+        # The workbook's answer to the rows it can take, or None when it took none
+        with self.__insert_lock(workbook, table):
+            while True:
+                chunk = routing.next_chunk(workbook)
+                if chunk is None:
+                    return None
+                res = self.__request(workbook, _insert_payload(self.AuthHandler.token(), table, chunk))
+                if not routing.recheck(workbook, res):
+                    return res if routing.answered(workbook, chunk, res) else None
+                self.__recount(table, workbook)
+
+    def __insert_sharded(self, table, data, workbookids, concurrent, result):
+        insert = _ShardedInsert(table, data, self.sharding, workbookids, self.cache, self.capacity, result)
+        workbooks = insert.workbooks()
+        try:
+            if concurrent and len(workbooks) > 1:
+                futures = [self.pool.submit(self.__insert_into, insert, table, workbook) for workbook in workbooks]
+                wait(futures)
+                for future in futures:
+                    future.result()
+            else:
+                for workbook in workbooks:
+                    self.__insert_into(insert, table, workbook)
+        finally:
+            # The rows that landed before a failure are recorded too
+            insert.record(self.row_index, self.replica)
+        return insert.finish()
+
+    def __insert_rows(self, table, data, workbookids, concurrent = False, result = None):
+        # result is the InsertResult of an earlier attempt, only the rows it didn't place are sent
+        if _sharded(self.sharding, table):
+            return self.__insert_sharded(table, data, workbookids, concurrent, result)
+        routing = _InsertRouting(table, data, workbookids, self.cache, self.capacity, result)
+        try:
+            for workbook in routing.workbookids:
+                res = self.__insert_into(routing, table, workbook)
+                if res is not None and routing.finished(res, self.__rediscover(_maybe_vanished({workbook: res})), self.metadata):
+                    break
+        finally:
+            routing.record(self.row_index, self.replica)
+        return routing.result
+
     def insert(self, **kwargs):
-        requireds = [
-            "table",
-            "data"
-        ]
-        for required in requireds:
-            if not required in kwargs:
-                raise MissingData(f"Missing the required argument '{required}'")
-        table = str(kwargs['table'])
-        data = kwargs['data']
-        if not isinstance(data, list):
-            raise InvalidType("data must be a list")
-        workbookids = self.workbookids()
-        for workbook in workbookids:
+        return self.__measured("insert", kwargs, self.__insert)
+
+    def __insert(self, kwargs):
+        table, data = _insert_query(kwargs)
+        self.__check_schema(table, _data_columns(data))
+        try:
+            workbookids = self.workbookids()
+            self.__refresh_capacity(workbookids, table)
+            return self.__insert_rows(table, data, workbookids, True)
+        finally:
+            self._invalidate(table)
+
+    def buffered_insert(self, table, row):
+        with self.__buffer_lock:
+            if self.__buffer is None:
+                self.__buffer = ZohoInsertBuffer(self, self.buffer_max_rows, self.buffer_max_delay)
+        return self.__buffer.add(table, row)
+
+    def flush(self, table = None):
+        if self.__buffer is not None:
+            self.__buffer.flush(table)
+
+    def batch(self, max_workers = None):
+        return ZohoBatch(self, max_workers)
+
+    def delete_many(self, **kwargs):
+        with self.batch() as batch:
+            _queue_delete_many(batch, kwargs)
+        return batch.results
+
+    def update_many(self, **kwargs):
+        with self.batch() as batch:
+            _queue_update_many(batch, kwargs, self._key_column(kwargs))
+        return batch.results
+
+    def __insert_chunk(self, table, chunk, workbookids, retries):
+        chunk.result = InsertResult(chunk.count)
+        while True:
+            chunk.attempts += 1
             try:
-                cached_ts = self.cache.get("full_workbooks", str(workbook))
-                if cached_ts != None:
-                    if (cached_ts + 3600) <= calendar.timegm(time.gmtime()):
-                        self.cache.delete("full_workbooks", str(workbook))
-                    else:
-                        break
-            except InvalidCacheTable:
-                pass
-            req = ZohoWorkbookRequest(workbook, {
-                "access_token": self.AuthHandler.token(),
-                "method": "worksheet.records.add",
-                "worksheet_name": table,
-                "json_data": json.dumps(data)
-            })
-            res = json.loads(req.text)
-            if "error_code" in res:
-                if res['error_code'] == 2870 or res['error_code'] == 2872:
-                    self.cache.set("full_workbooks", str(workbook), calendar.timegm(time.gmtime()))
-                    continue
-            if res['status'] == "failure":
-                raise UnexpectedResponse(res['error_message'])
-            return True
-        return False
+                self.__insert_rows(table, chunk.rows, workbookids, result=chunk.result)
+                delay = _chunk_attempted(chunk, retries, None)
+            except (HttpRequestError, UnexpectedResponse, InvalidJsonResponse) as e:
+                delay = _chunk_attempted(chunk, retries, e)
+            if delay is None:
+                break
+            time.sleep(delay)
+        chunk.release()
+        return chunk
+
+    def insert_many(self, **kwargs):
+        return self.__measured("insert_many", kwargs, self.__insert_many)
+
+    def __insert_many(self, kwargs):
+        table, data, chunk_rows, chunk_bytes, retries = _insert_many_query(kwargs)
+        try:
+            workbookids = self.workbookids()
+            self.__refresh_capacity(workbookids, table)
+            results = []
+            pending = set()
+            for chunk in _chunks(data, chunk_rows, chunk_bytes):
+                pending.add(self.pool.submit(self.__insert_chunk, table, chunk, _chunk_workbooks(chunk, workbookids), retries))
+                results.append(chunk)
+                # Keep a bounded number of chunks in memory when data is a huge generator
+                if len(pending) >= self.max_threads * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            wait(pending)
+            return results
+        finally:
+            self._invalidate(table)
         
     def update(self, **kwargs):
-        requireds = [
-            "table",
-            "criteria",
-            "data"
-        ]
-        for required in requireds:
-            if not required in kwargs:
-                raise MissingData(f"Missing the required argument '{required}'")
-        table = str(kwargs['table'])
-        criteria = str(kwargs['criteria'])
-        data = kwargs['data']
-        if not isinstance(data, dict):
-            raise InvalidType("data must be a dictionary")
-        if not "workbook_id" in kwargs:
-            workbook_id = ""
-        else:
-            workbook_id = str(kwargs['workbook_id']).strip()
-        return_bool = False
-        if workbook_id and workbook_id != "":
-            req = ZohoWorkbookRequest(workbook_id, {
-                "access_token": self.AuthHandler.token(),
-                "method": "worksheet.records.update",
-                "worksheet_name": table,
-                "criteria": criteria,
-                "data": json.dumps(data)
-            })
-            res = json.loads(req.text)
-            if res['status'] == "failure":
-                raise UnexpectedResponse(res['error_message'])
-            if res['no_of_affected_rows'] >= 1:
-                return_bool = True
-        else:
-            responses = []
-            workbookids = self.workbookids()
-            with ThreadPoolExecutor(max_workers=self.max_threads) as pool:
-                responses = list(pool.map(ZohoWorkbookRequest, workbookids, [{
-                    "access_token": self.AuthHandler.token(),
-                    "method": "worksheet.records.update",
-                    "worksheet_name": table,
-                    "criteria": criteria,
-                    "data": json.dumps(data)
-                }]))
-            for res in responses:
-                res = json.loads(res.text)
-                if res['status'] == "failure":
-                    raise UnexpectedResponse(res['error_message'])
-                if res['no_of_affected_rows'] >= 1:
-                    return_bool = True
-        return return_bool
+        return self.__measured("update", kwargs, self.__update)
+
+    def _update_row(self, **kwargs):
+        # update() of a row update_many() was given, failing when Zoho updated more rows than that one
+        updated, failures, allow_partial = self.__measured("update", kwargs, self.__update_counts)
+        return _updated_row(sum(updated.values()), failures, allow_partial)
+
+    def __update(self, kwargs):
+        updated, failures, allow_partial = self.__update_counts(kwargs)
+        return _check_failures(failures, allow_partial, sum(updated.values()) > 0)
+
+    def __update_counts(self, kwargs):
+        update = _Update(self, kwargs)
+        self.__check_schema(update.table, _data_columns(update.data))
+        try:
+            return update.answered(*self.__write(update))
+        finally:
+            self._invalidate(update.table)
+
+    def __write(self, write):
+        # The answers to an _Update or a _Delete
+        payload = write.payload(self.AuthHandler.token())
+        succeeded, failures = self.__fanout(write.located() or write.workbooks(self.workbookids()), payload, write.workbook_timeout, write.deadline)
+        if write.missed(succeeded, failures):
+            succeeded, failures = self.__fanout(self.workbookids(), payload, write.workbook_timeout, write.deadline)
+        return succeeded, failures
         
     def delete(self, **kwargs):
-        requireds = [
-            "table",
-            "criteria"
-        ]
-        for required in requireds:
-            if not required in kwargs:
-                raise MissingData(f"Missing the required argument '{required}'")
-        table = str(kwargs['table'])
-        criteria = str(kwargs['criteria'])
-        if not "workbook_id" in kwargs:
-            workbook_id = ""
-        else:
-            workbook_id = str(kwargs['workbook_id']).strip()
-        if "row_id" in kwargs:
-            row_id = int(kwargs['row_id'])
-        else:
-            row_id = 0
-        if row_id > 0:
-            rowid = json.dumps([row_id])
-        else:
-            rowid = ""
-        return_bool = False
-        affected_workbooks = []
-        if workbook_id and workbook_id != "":
-            req = ZohoWorkbookRequest(workbook_id, {
-                "access_token": self.AuthHandler.token(),
-                "method": "worksheet.records.delete",
-                "worksheet_name": table,
-                "criteria": criteria,
-                "row_array": rowid,
-                "delete_rows": "true"
-            })
-            res = json.loads(req.text)
-            if res['status'] == "failure":
-                raise UnexpectedResponse(res['error_message'])
-            if res['no_of_rows_deleted'] >= 1:
-                if not workbook_id in affected_workbooks:
-                    affected_workbooks.append(workbook_id)
-                return_bool = True
-        else:
-            responses = []
-            workbookids = self.workbookids()
-            with ThreadPoolExecutor(max_workers=self.max_threads) as pool:
-                responses = list(pool.map(ZohoWorkbookRequest, workbookids, [{
-                    "access_token": self.AuthHandler.token(),
-                    "method": "worksheet.records.delete",
-                    "worksheet_name": table,
-                    "criteria": criteria,
-                    "row_array": rowid,
-                    "delete_rows": "true"
-                }]))
-            for index, res in enumerate(responses):
-                res = json.loads(res.text)
-                if res['status'] == "failure":
-                    raise UnexpectedResponse(res['error_message'])
-                if res['no_of_rows_deleted'] >= 1:
-                    if not workbookids[index] in affected_workbooks:
-                        affected_workbooks.append(workbookids[index])
-                    return_bool = True
-        if return_bool == True:
-            for workbook in affected_workbooks:
-                try:
-                    self.cache.delete("full_workbooks", str(workbook))
-                except InvalidCacheTable:
-                    pass
-        return return_bool
+        return self.__measured("delete", kwargs, self.__delete)
+
+    def _delete_rows(self, **kwargs):
+        # delete() by row indexes, answering with an outcome per row index (merged batch deletes)
+        table, criteria, workbook_id, rowid = _delete_query(kwargs)
+        if workbook_id != "":
+            self.__refresh_capacity([workbook_id], table)
+        used_rows = self.capacity.used_rows(workbook_id, table)
+        deleted, failures, allow_partial = self.__measured("delete", kwargs, self.__delete_counts)
+        return _delete_rows_outcomes(_delete_row_ids(kwargs), deleted, failures, allow_partial, used_rows)
+
+    def __delete(self, kwargs):
+        deleted, failures, allow_partial = self.__delete_counts(kwargs)
+        return _check_failures(failures, allow_partial, sum(deleted.values()) > 0)
+
+    def __delete_counts(self, kwargs):
+        delete = _Delete(self, kwargs)
+        try:
+            return delete.answered(*self.__write(delete))
+        finally:
+            self._invalidate(delete.table)
+
+class AsyncZohoDB(BaseZohoDB):
+    def __init__(self, AuthHandler, workbooks, max_concurrency = 24, http2 = False, max_connections = None, max_keepalive_connections = None, keepalive_expiry = 30, timeout = 30, cache_backend = None, query_cache = None, validate_criteria = False, capacity_tracker = None, workbook_timeout = None, deadline = None, rate_limiter = None, retry_policy = None, keys = None, metrics = None, replica_path = None, metadata = None, validate_schema = False, cache_root = None, shard_keys = None):
+        if not isinstance(AuthHandler, AsyncZohoAuthHandler):
+            raise InvalidType("Invalid AsyncZohoAuthHandler instance passed")
+        super().__init__(AuthHandler, workbooks, cache_backend, query_cache, validate_criteria, capacity_tracker, workbook_timeout, deadline, rate_limiter, retry_policy, keys, metrics, replica_path, metadata, validate_schema, cache_root, shard_keys)
+        self.max_concurrency = int(max_concurrency)
+        if max_connections is None:
+            max_connections = self.max_concurrency
+        self.__semaphore = None
+        self._attach_client(httpx.AsyncClient(**_client_options(http2, max_connections, max_keepalive_connections, keepalive_expiry, timeout)))
+
+    async def aclose(self):
+        self._detach_client()
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+
+    async def __request(self, workbook_id, data, timeout = None):
+        if self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+        attempts = _RequestAttempts(self.metrics, self.retry_policy, workbook_id, data)
+        while True:
+            if self.rate_limiter is not None:
+                attempts.limited(await self.rate_limiter.acquire_async(workbook_id))
+            try:
+                async with self.__semaphore:
+                    attempts.sending()
+                    req = await AsyncZohoWorkbookRequest(workbook_id, data, self.client, timeout)
+            except HttpRequestError as e:
+                delay = attempts.failed(e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            res, delay = attempts.answered(req)
+            if delay is None:
+                return res
+            await asyncio.sleep(delay)
+
+    async def __fanout_outcomes(self, workbookids, data, workbook_timeout, deadline):
+        if len(workbookids) <= 0:
+            return {}
+        tasks = {asyncio.ensure_future(self.__request(workbook, dict(data), workbook_timeout)): workbook for workbook in workbookids}
+        try:
+            done, not_done = await asyncio.wait(tasks, timeout=deadline)
+        except BaseException:
+            # Don't leave the workbook requests running behind a cancellation
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        for task in not_done:
+            task.cancel()
+        if not_done:
+            await asyncio.gather(*not_done, return_exceptions=True)
+        outcomes = {}
+        for task in done:
+            outcomes[tasks[task]] = task.exception() or task.result()
+        return outcomes
+
+    async def __fanout(self, workbookids, data, workbook_timeout = None, deadline = None):
+        fanout = _Fanout(self.metadata, workbookids, deadline)
+        fanout.outcomes = await self.__fanout_outcomes(workbookids, data, workbook_timeout, deadline)
+        vanished = await self.__rediscover(fanout.failed())
+        if len(vanished) > 0:
+            replacements, remaining = fanout.replacements(vanished)
+            fanout.outcomes.update(await self.__fanout_outcomes(replacements, data, workbook_timeout, remaining))
+        return fanout.result()
+
+    async def __timed(self, name, kwargs, coroutine):
+        if self.metrics is None:
+            return await self.__within_timeout(kwargs, coroutine)
+        with self.metrics.operation(name, table=kwargs.get("table")):
+            return await self.__within_timeout(kwargs, coroutine)
+
+    async def __within_timeout(self, kwargs, coroutine):
+        if kwargs.get("timeout") is None:
+            return await coroutine
+        return await asyncio.wait_for(coroutine, float(kwargs['timeout']))
+
+    async def __rediscover(self, workbookids):
+        if len(workbookids) <= 0 or not self.metadata.recheck_due():
+            return []
+        try:
+            current = await self.__fetch_workbooks()
+        except (HttpRequestError, UnexpectedResponse, InvalidJsonResponse):
+            return []
+        return _vanished_workbooks(workbookids, current)
+
+    async def __fetch_workbooks(self):
+        url, headers = _workbook_list_request(await self.AuthHandler.token())
+        try:
+            req = await self.client.get(url, headers=headers)
+        except httpx.RequestError as e:
+            raise HttpRequestError(f"Failed to fetch the workbook(s) ID(s): {e}")
+        return _fetched_workbooks(self.metadata, req, self.workbooks)
+
+    async def workbookids(self):
+        wbs = self.metadata.workbookids()
+        if wbs is None:
+            return await self.__fetch_workbooks()
+        return wbs
+
+    async def worksheets(self):
+        worksheets = self.metadata.worksheets()
+        if worksheets is None:
+            succeeded, failures = await self.__fanout(await self.workbookids(), _worksheets_payload(await self.AuthHandler.token()), self.workbook_timeout, self.deadline)
+            worksheets = _fetched_worksheets(self.metadata, succeeded, failures)
+        return worksheets
+
+    async def headers(self, table):
+        table = str(table)
+        headers = self.metadata.headers(table)
+        if headers is None:
+            succeeded, failures = await self.__fanout(_header_workbooks(await self.worksheets(), table), _headers_payload(await self.AuthHandler.token(), table), self.workbook_timeout, self.deadline)
+            headers = _fetched_headers(self.metadata, table, succeeded, failures)
+        return headers
+
+    async def warmup(self, tables = None):
+        token = await self.AuthHandler.token()
+        await self.workbookids()
+        worksheets = await self.worksheets()
+        tables, requests = _warmup_requests(worksheets, tables)
+        responses = await asyncio.gather(*[self.__request(workbook, _headers_payload(token, table)) for table, workbook in requests])
+        headers = _warmed_headers(self.metadata, tables, requests, responses)
+        return {"workbooks": await self.workbookids(), "worksheets": worksheets, "headers": headers}
+
+    async def rebalance(self, table, dry_run = False):
+        table = str(table)
+        workbookids = await self.workbookids()
+        records = await self.select(table=table, criteria="", use_cache=False)
+        moves, data, report = _rebalance_plan(self.sharding, table, records, workbookids)
+        if dry_run or len(moves) <= 0:
+            return report
+        inserted = await self.insert(table=table, data=data)
+        deletes = _rebalance_deletes(moves, inserted)
+        await asyncio.gather(*[self.delete(table=table, criteria="", row_ids=row_indexes, workbook_id=workbook) for workbook, row_indexes in deletes.items()])
+        report['moved'] = sum(len(row_indexes) for row_indexes in deletes.values())
+        return report
+
+    async def __check_schema(self, table, columns):
+        if self.validate_schema:
+            _check_schema(table, await self.worksheets(), await self.headers(table) if len(columns) > 0 else [], columns)
+
+    async def refresh_capacity(self, table, workbookids = None):
+        if workbookids is None:
+            workbookids = await self.workbookids()
+        succeeded, failures = await self.__fanout(workbookids, _usedarea_payload(await self.AuthHandler.token(), str(table)), self.workbook_timeout, self.deadline)
+        self._refreshed(table, succeeded, failures)
+
+    async def __refresh_capacity(self, workbookids, table):
+        stale = self._stale_capacity(workbookids, table)
+        if len(stale) > 0:
+            await self.refresh_capacity(table, stale)
+
+    async def sync(self, table, indexes = None, full = False, page_size = 1000, allow_partial = False, check_rows = 100):
+        table = str(table)
+        if self.replica is None:
+            self.replica = ZohoReplica(self.replica_path)
+        workbookids = await self.workbookids()
+        sync = _ReplicaSync(self.replica, self.capacity, table, indexes, workbookids)
+        succeeded, failures = await self.__fanout(workbookids, _usedarea_payload(await self.AuthHandler.token(), table), self.workbook_timeout, self.deadline)
+        workbooks = sync.workbooks(succeeded, failures, allow_partial, full, check_rows)
+        results = await asyncio.gather(*[self.__sync_workbook(workbook, page_size) for workbook in workbooks])
+        return {workbook.workbook: result for workbook, result in zip(workbooks, results)}
+
+    async def __sync_workbook(self, sync, page_size):
+        while True:
+            if sync.fetched(await self.__sync_records(sync.table, sync.workbook, sync.start, page_size)):
+                return sync.store()
+
+    async def __sync_records(self, table, workbook, start, page_size):
+        records = []
+        while True:
+            page = _select_records(workbook, await self.__request(workbook, _select_page_payload(await self.AuthHandler.token(), table, "", [], start, page_size)))
+            records.extend(page)
+            if len(page) < page_size:
+                return records
+            start += len(page)
+
+    async def select(self, **kwargs):
+        return await self.__timed("select", kwargs, self.__select(kwargs))
+
+    async def __select(self, kwargs):
+        select = _Select(self, kwargs)
+        if select.local:
+            return select.local_result()
+        await self.__check_schema(select.table, select.columns)
+        cached = select.cached()
+        if cached is not None:
+            return cached
+        succeeded, failures = await self.__fanout(select.workbooks(await self.workbookids()), select.payload(await self.AuthHandler.token()), select.workbook_timeout, select.deadline)
+        return select.result(succeeded, failures)
+
+    async def select_iter(self, **kwargs):
+        pages = _SelectPages(self, kwargs)
+        await self.__check_schema(pages.table, pages.columns)
+        for workbook in pages.workbooks(await self.workbookids()):
+            while pages.more(workbook):
+                for record in pages.page(await self.__request(workbook, pages.payload(await self.AuthHandler.token()))):
+                    yield record
+
+    async def insert(self, **kwargs):
+        return await self.__timed("insert", kwargs, self.__insert(kwargs))
+
+    def batch(self):
+        return AsyncZohoBatch(self)
+
+    async def delete_many(self, **kwargs):
+        async with self.batch() as batch:
+            _queue_delete_many(batch, kwargs)
+        return batch.results
+
+    async def update_many(self, **kwargs):
+        async with self.batch() as batch:
+            _queue_update_many(batch, kwargs, self._key_column(kwargs))
+        return batch.results
+
+    async def __recount(self, table, workbook):
+        try:
+            used_area = _used_area(await self.__request(workbook, _usedarea_payload(await self.AuthHandler.token(), table)))
+        except (HttpRequestError, UnexpectedResponse, InvalidJsonResponse):
+            used_area = None
+        self.capacity.refreshed(workbook, table, used_area)
+
+    def __insert_lock(self, workbook, table):
+        if not (workbook, table) in self._insert_locks:
+            self._insert_locks[(workbook, table)] = asyncio.Lock()
+        return self._insert_locks[(workbook, table)]
+
+    async def __insert_into(self, routing, table, workbook):
+        async with self.__insert_lock(workbook, table):
+            while True:
+                chunk = routing.next_chunk(workbook)
+                if chunk is None:
+                    return None
+                res = await self.__request(workbook, _insert_payload(await self.AuthHandler.token(), table, chunk))
+                if not routing.recheck(workbook, res):
+                    return res if routing.answered(workbook, chunk, res) else None
+                await self.__recount(table, workbook)
+
+    async def __insert_sharded(self, table, data, workbookids, result):
+        insert = _ShardedInsert(table, data, self.sharding, workbookids, self.cache, self.capacity, result)
+        outcomes = await asyncio.gather(*[self.__insert_into(insert, table, workbook) for workbook in insert.workbooks()], return_exceptions=True)
+        insert.record(self.row_index, self.replica)
+        for outcome in outcomes:
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return insert.finish()
+
+    async def __insert_rows(self, table, data, workbookids, result = None):
+        if _sharded(self.sharding, table):
+            return await self.__insert_sharded(table, data, workbookids, result)
+        routing = _InsertRouting(table, data, workbookids, self.cache, self.capacity, result)
+        try:
+            for workbook in routing.workbookids:
+                res = await self.__insert_into(routing, table, workbook)
+                if res is not None and routing.finished(res, await self.__rediscover(_maybe_vanished({workbook: res})), self.metadata):
+                    break
+        finally:
+            routing.record(self.row_index, self.replica)
+        return routing.result
+
+    async def __insert(self, kwargs):
+        table, data = _insert_query(kwargs)
+        await self.__check_schema(table, _data_columns(data))
+        try:
+            workbookids = await self.workbookids()
+            await self.__refresh_capacity(workbookids, table)
+            return await self.__insert_rows(table, data, workbookids)
+        finally:
+            self._invalidate(table)
+
+    async def __insert_chunk(self, table, chunk, workbookids, retries):
+        chunk.result = InsertResult(chunk.count)
+        while True:
+            chunk.attempts += 1
+            try:
+                await self.__insert_rows(table, chunk.rows, workbookids, result=chunk.result)
+                delay = _chunk_attempted(chunk, retries, None)
+            except (HttpRequestError, UnexpectedResponse, InvalidJsonResponse) as e:
+                delay = _chunk_attempted(chunk, retries, e)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        chunk.release()
+        return chunk
+
+    async def insert_many(self, **kwargs):
+        return await self.__timed("insert_many", kwargs, self.__insert_many(kwargs))
+
+    async def __insert_many(self, kwargs):
+        table, data, chunk_rows, chunk_bytes, retries = _insert_many_query(kwargs)
+        pending = set()
+        try:
+            workbookids = await self.workbookids()
+            await self.__refresh_capacity(workbookids, table)
+            results = []
+            for chunk in _chunks(data, chunk_rows, chunk_bytes):
+                pending.add(asyncio.ensure_future(self.__insert_chunk(table, chunk, _chunk_workbooks(chunk, workbookids), retries)))
+                results.append(chunk)
+                if len(pending) >= self.max_concurrency * 2:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if pending:
+                await asyncio.wait(pending)
+            return results
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            raise
+        finally:
+            self._invalidate(table)
+
+    async def update(self, **kwargs):
+        return await self.__timed("update", kwargs, self.__update(kwargs))
+
+    async def _update_row(self, **kwargs):
+        updated, failures, allow_partial = await self.__timed("update", kwargs, self.__update_counts(kwargs))
+        return _updated_row(sum(updated.values()), failures, allow_partial)
+
+    async def __update(self, kwargs):
+        updated, failures, allow_partial = await self.__update_counts(kwargs)
+        return _check_failures(failures, allow_partial, sum(updated.values()) > 0)
+
+    async def __update_counts(self, kwargs):
+        update = _Update(self, kwargs)
+        await self.__check_schema(update.table, _data_columns(update.data))
+        try:
+            return update.answered(*await self.__write(update))
+        finally:
+            self._invalidate(update.table)
+
+    async def __write(self, write):
+        payload = write.payload(await self.AuthHandler.token())
+        succeeded, failures = await self.__fanout(write.located() or write.workbooks(await self.workbookids()), payload, write.workbook_timeout, write.deadline)
+        if write.missed(succeeded, failures):
+            succeeded, failures = await self.__fanout(await self.workbookids(), payload, write.workbook_timeout, write.deadline)
+        return succeeded, failures
+
+    async def delete(self, **kwargs):
+        return await self.__timed("delete", kwargs, self.__delete(kwargs))
+
+    async def _delete_rows(self, **kwargs):
+        table, criteria, workbook_id, rowid = _delete_query(kwargs)
+        if workbook_id != "":
+            await self.__refresh_capacity([workbook_id], table)
+        used_rows = self.capacity.used_rows(workbook_id, table)
+        deleted, failures, allow_partial = await self.__timed("delete", kwargs, self.__delete_counts(kwargs))
+        return _delete_rows_outcomes(_delete_row_ids(kwargs), deleted, failures, allow_partial, used_rows)
+
+    async def __delete(self, kwargs):
+        deleted, failures, allow_partial = await self.__delete_counts(kwargs)
+        return _check_failures(failures, allow_partial, sum(deleted.values()) > 0)
+
+    async def __delete_counts(self, kwargs):
+        delete = _Delete(self, kwargs)
+        try:
+            return delete.answered(*await self.__write(delete))
+        finally:
+            self._invalidate(delete.table)